@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm
 from .models import (User, UserCurrencyAccount, 
-                    Transaction, AccountHistory, DepositHistory
+                    Transaction, AccountHistory, DepositHistory, ExchangeRate
 )
 
 
@@ -16,6 +16,9 @@ class UserCurrencyAccountInline(admin.TabularInline):
     model = UserCurrencyAccount
     extra = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
 
 class UserAdmin(admin.ModelAdmin):
     form = UserForm
@@ -29,12 +32,14 @@ class UserAdmin(admin.ModelAdmin):
 
 class UserCurrencyAccountAdmin(admin.ModelAdmin):
     list_display = ('account_id', 'user', 'currency_code', 'balance', 'is_active', 'updated_at', 'account_number')
+    list_select_related = ('user',)
     list_filter = ('currency_code', 'is_active', 'updated_at')
     search_fields = ('user__username', 'currency_code')
 
 
 class TransactionAdmin(admin.ModelAdmin):
     list_display = ('transaction_id', 'user', 'from_currency', 'to_currency', 'amount', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('from_currency', 'to_currency', 'created_at')
     search_fields = ('user__username', 'from_currency', 'to_currency')
     ordering = ('-created_at',)
@@ -42,6 +47,7 @@ class TransactionAdmin(admin.ModelAdmin):
 
 class AccountHistoryAdmin(admin.ModelAdmin):
     list_display = ('history_id', 'user', 'currency', 'amount', 'action', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('currency', 'action', 'created_at')
     search_fields = ('user__username', 'currency', 'action')
     ordering = ('-created_at',)
@@ -49,13 +55,21 @@ class AccountHistoryAdmin(admin.ModelAdmin):
 
 class DepositHistoryAdmin(admin.ModelAdmin):
     list_display = ('deposit_id', 'user', 'user_currency_account', 'amount', 'created_at')
-    list_filter = ('user', 'user_currency_account', 'created_at')
+    list_select_related = ('user', 'user_currency_account__user')
+    list_filter = ('user_currency_account__currency_code', 'created_at')
     search_fields = ('user__username', 'user_currency_account__currency_code')
 
 
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('rate_id', 'currency', 'bid', 'ask', 'table_number', 'effective_date', 'fetched_at')
+    list_filter = ('currency', 'effective_date')
+    ordering = ('-effective_date', 'currency')
+
+
 
 admin.site.register(User, UserAdmin)
 admin.site.register(UserCurrencyAccount, UserCurrencyAccountAdmin)
 admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(AccountHistory, AccountHistoryAdmin)
-admin.site.register(DepositHistory, DepositHistoryAdmin)
\ No newline at end of file
+admin.site.register(DepositHistory, DepositHistoryAdmin)
+admin.site.register(ExchangeRate, ExchangeRateAdmin)
\ No newline at end of file
@@ -0,0 +1,154 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import CENTS, User, UserCurrencyAccount, DepositHistory
+from .ledger import deposit_legs, post
+from .portfolio import apply_balance_changes
+
+
+class BulkRowError(Exception):
+    pass
+
+
+def read_rows(stream, file_format):
+    """
+    Yield (line_number, row_dict) from a CSV or JSONL text stream, one line at
+    a time.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+    else:
+        raise ValueError(f"Unsupported format: {file_format}")
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def capped(rows, limit):
+    """
+    The first rows as a list, or None when there are more than limit. Reads
+    at most limit + 1 rows, so an oversized upload is not loaded whole.
+    """
+    rows = list(islice(rows, limit + 1))
+    return None if len(rows) > limit else rows
+
+
+def parse_deposit(row):
+    if not isinstance(row, dict):
+        raise BulkRowError("Malformed row")
+    user_id = row.get('user_id')
+    currency_code = row.get('currency_code') or row.get('user_currency_account_code')
+    amount = row.get('amount')
+    if not all([user_id, currency_code, amount]):
+        raise BulkRowError("Missing required fields")
+    try:
+        user_id = int(user_id)
+        amount = Decimal(str(amount))
+    except (TypeError, ValueError, InvalidOperation):
+        raise BulkRowError("Invalid user_id or amount")
+    # Checked after rounding, so 0.001 is not stored as a 0.00 deposit.
+    if amount.is_finite():
+        amount = amount.quantize(CENTS)
+    if not amount.is_finite() or amount <= 0:
+        raise BulkRowError("Deposit amount must be greater than zero.")
+    return user_id, currency_code, amount
+
+
+def apply_deposit_chunk(deposits):
+    """
+    Apply a list of (ref, user_id, currency_code, amount) in one transaction:
+    one query to resolve accounts, one UPDATE for all balance deltas, one
+    bulk insert of DepositHistory rows and one portfolio valuation update. Returns (applied_count, rejected) where
+    rejected is a list of (ref, error).
+    """
+    user_ids = {user_id for _, user_id, _, _ in deposits}
+    currency_codes = {currency_code for _, _, currency_code, _ in deposits}
+
+    with db_transaction.atomic():
+        accounts = {
+            (user_id, currency_code): account_id
+            for account_id, user_id, currency_code in UserCurrencyAccount.objects.filter(
+                user_id__in=user_ids, currency_code__in=currency_codes
+            ).values_list('account_id', 'user_id', 'currency_code')
+        }
+
+        deltas = {}
+        changes = []
+        histories = []
+        rejected = []
+        for ref, user_id, currency_code, amount in deposits:
+            account_id = accounts.get((user_id, currency_code))
+            if account_id is None:
+                rejected.append((ref, f"Account with currency {currency_code} not found for user {user_id}."))
+                continue
+            deltas[account_id] = deltas.get(account_id, 0) + amount
+            changes.append((user_id, currency_code, amount))
+            histories.append(DepositHistory(user_id=user_id, user_currency_account_id=account_id, amount=amount))
+
+        if deltas:
+            UserCurrencyAccount.objects.filter(pk__in=deltas).update(
+                balance=F('balance') + Case(
+                    *[When(pk=account_id, then=Value(delta)) for account_id, delta in deltas.items()],
+                    output_field=UserCurrencyAccount._meta.get_field('balance'),
+                ),
+                updated_at=timezone.now(),
+            )
+            DepositHistory.objects.bulk_create(histories)
+            post(('deposit', deposit_legs(history.user_currency_account_id, currency_code, history.amount))
+                 for history, (_, currency_code, _) in zip(histories, changes))
+            apply_balance_changes(changes)
+            User.bump_accounts_version({user_id for user_id, _, _ in changes})
+
+    return len(histories), rejected
+
+
+def apply_deposits(rows, chunk_size=1000, on_error=None):
+    """
+    Stream deposits from an iterable of (ref, row_dict) in chunks of
+    chunk_size, so memory use does not depend on the number of rows. Each
+    chunk is committed separately. Returns a summary of applied and rejected
+    rows; per-row errors are passed to on_error(ref, message).
+    """
+    summary = {"applied": 0, "rejected": 0, "chunks": 0}
+
+    def reject(ref, message):
+        summary["rejected"] += 1
+        if on_error:
+            on_error(ref, message)
+
+    for chunk in chunked(rows, chunk_size):
+        deposits = []
+        for ref, row in chunk:
+            try:
+                deposits.append((ref, *parse_deposit(row)))
+            except BulkRowError as e:
+                reject(ref, str(e))
+
+        if deposits:
+            applied, rejected = apply_deposit_chunk(deposits)
+            summary["applied"] += applied
+            for ref, message in rejected:
+                reject(ref, message)
+        summary["chunks"] += 1
+
+    return summary
@@ -0,0 +1,81 @@
+import csv
+import json
+
+from django.conf import settings
+
+from .models import AccountHistory, DepositHistory, Transaction
+from .pagination import InvalidQuery, filter_date_range
+from .serializers import AccountHistoryRowSerializer, DepositHistoryRowSerializer, TransactionRowSerializer
+
+
+EXPORTS = {
+    'history': (AccountHistory, AccountHistoryRowSerializer),
+    'transactions': (Transaction, TransactionRowSerializer),
+    'deposits': (DepositHistory, DepositHistoryRowSerializer),
+}
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def export_rows(kind, params, chunk_size=None):
+    """
+    Return an iterator of serialized rows of one export kind in primary key
+    order, reading the table with a chunked server-side iterator. params may
+    carry user_id, date_from and date_to; invalid values raise InvalidQuery.
+    """
+    model, row_serializer = EXPORTS[kind]
+    queryset = model.objects.all()
+    if params.get('user_id'):
+        try:
+            queryset = queryset.filter(user_id=int(params['user_id']))
+        except ValueError:
+            raise InvalidQuery("user_id must be an integer")
+    queryset = filter_date_range(params, queryset, 'created_at')
+    rows = queryset.order_by('pk').values_list(*row_serializer.columns).iterator(
+        chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE
+    )
+    return map(row_serializer.to_row, rows)
+
+
+def stream_export(kind, rows, export_format, batch_size=500):
+    """
+    Encode rows as CSV, NDJSON or a JSON array and yield them in batches of
+    batch_size rows. The CSV header and the opening bracket are yielded on
+    their own so the first byte goes out before the first batch is read. The
+    JSON array is encoded the way the list endpoints render their pages.
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORTS[kind][1].fields)
+        yield from batches(rows, lambda row: writer.writerow(row.values()), batch_size)
+    elif export_format == 'json':
+        yield '['
+        separator = ''
+        for batch in batches(rows, lambda row: ',' + encoder.encode(row), batch_size):
+            # Only the first row goes without a leading comma.
+            yield batch if separator else batch[1:]
+            separator = ','
+        yield ']'
+    else:
+        yield from batches(rows, lambda row: encoder.encode(row) + '\n', batch_size)
+
+
+def batches(rows, encode, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) >= batch_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
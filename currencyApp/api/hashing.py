@@ -0,0 +1,102 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the work factor taken from PASSWORD_HASH_ITERATIONS.
+    Existing pbkdf2_sha256 hashes stay valid; hashes with a different
+    iteration count are upgraded on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingLimiter:
+    """
+    Caps how many password hashes run at once. The hash runs inline in the
+    calling thread; a caller that finds all ``limit`` slots taken waits up to
+    ``timeout`` seconds for one and then gets HashingBusy, so a login spike is
+    shed instead of piling up behind the CPU.
+    """
+
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._stats = {'completed': 0, 'rejected': 0, 'in_flight': 0, 'hash_seconds': 0.0, 'wait_seconds': 0.0}
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def run(self, func, *args):
+        waiting = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._add(rejected=1)
+            raise HashingBusy("Too many password operations in progress; try again shortly.")
+        started = time.monotonic()
+        self._add(in_flight=1, wait_seconds=started - waiting)
+        try:
+            return func(*args)
+        finally:
+            self._slots.release()
+            self._add(completed=1, in_flight=-1, hash_seconds=time.monotonic() - started)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['limit'] = self.limit
+        return stats
+
+
+_limiter = None
+_limiter_guard = threading.Lock()
+
+
+def get_hashing_limiter():
+    global _limiter
+    with _limiter_guard:
+        if _limiter is None:
+            _limiter = HashingLimiter(settings.PASSWORD_HASH_CONCURRENCY, settings.PASSWORD_HASH_TIMEOUT)
+        return _limiter
+
+
+@receiver(setting_changed)
+def reset_hashing_limiter(setting=None, **kwargs):
+    global _limiter
+    if setting in (None, 'PASSWORD_HASH_CONCURRENCY', 'PASSWORD_HASH_TIMEOUT'):
+        with _limiter_guard:
+            _limiter = None
+
+
+def hash_password(password):
+    return get_hashing_limiter().run(make_password, password)
+
+
+def _verify(password, encoded):
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, upgraded[0] if upgraded else None
+
+
+def verify_password(password, encoded):
+    """
+    Check password against encoded under the hashing limit. Returns (valid,
+    new_encoded); new_encoded is a fresh hash when the stored one uses an
+    outdated hasher or work factor, and None otherwise.
+    """
+    return get_hashing_limiter().run(_verify, password, encoded)
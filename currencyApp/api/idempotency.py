@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import json
+import time
+from datetime import timedelta
+from functools import partial, wraps
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+def record_key(scope, key):
+    return hashlib.sha256(f"{scope}\n{key}".encode()).hexdigest()
+
+
+def request_data(request):
+    if hasattr(request, 'data'):
+        return request.data
+    # A plain Django request, as async views get.
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body)
+        except ValueError:
+            return request.body.decode(errors='replace')
+    return request.POST
+
+
+def request_fingerprint(request):
+    data = request_data(request)
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+class ClaimLost(Exception):
+    pass
+
+
+def claim(key, fingerprint):
+    """
+    Insert an in-progress record for key. Returns (claimed_until, None) when
+    this request owns the key, otherwise (None, existing record). A record
+    left in progress past IDEMPOTENCY_LOCK_TIMEOUT, or finished and expired,
+    is replaced; claimed_until identifies the claim, so an owner whose claim
+    was replaced cannot commit.
+    """
+    while True:
+        now = timezone.now()
+        claimed_until = now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        try:
+            with db_transaction.atomic():
+                IdempotencyRecord.objects.create(key=key, fingerprint=fingerprint, expires_at=claimed_until)
+            return claimed_until, None
+        except IntegrityError:
+            record = IdempotencyRecord.objects.filter(key=key).first()
+            if record is not None and record.expires_at > now:
+                return None, record
+            # Gone or expired: replace it. Whoever loses a race retries.
+            IdempotencyRecord.objects.filter(key=key, expires_at__lte=now).delete()
+
+
+def wait_for(record):
+    """
+    Poll an in-progress record for up to IDEMPOTENCY_WAIT seconds. Returns
+    the finished record, or None if it is still running or was released.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+    while record is not None and record.status_code is None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyRecord.objects.filter(key=record.key).first()
+    if record is None or record.status_code is None:
+        return None
+    return record
+
+
+async def await_record(record):
+    """Async variant of wait_for, polling without blocking the event loop."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT
+    while record is not None and record.status_code is None and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+        record = await IdempotencyRecord.objects.filter(key=record.key).afirst()
+    if record is None or record.status_code is None:
+        return None
+    return record
+
+
+def json_response(data, status, headers=None):
+    return JsonResponse(data, status=status, headers=headers, safe=False)
+
+
+def error(respond, message, status_code, headers=None):
+    return respond({"error": message}, status=status_code, headers=headers)
+
+
+def in_progress(respond=Response):
+    return error(
+        respond, "A request with this Idempotency-Key is still in progress.", status.HTTP_409_CONFLICT,
+        headers={"Retry-After": "1"},
+    )
+
+
+def replay(record, respond=Response):
+    response = respond(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def check_key(request, respond):
+    """The record key of the request, or an error response for a malformed Idempotency-Key."""
+    key = request.headers.get('Idempotency-Key')
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None, error(respond, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.", status.HTTP_400_BAD_REQUEST)
+    return record_key(request.path, key), None
+
+
+def conflicting(record, fingerprint, respond):
+    if record.fingerprint != fingerprint:
+        return error(respond, "Idempotency-Key was already used with a different request.", status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return None
+
+
+def run_claimed(owned, call, payload, respond):
+    """
+    Run call() in a transaction that also stores its response on the owned
+    claim, so the writes and the stored response commit together.
+    """
+    try:
+        with db_transaction.atomic():
+            response = call()
+            if response.status_code < 500:
+                stored = owned.update(
+                    status_code=response.status_code,
+                    response=payload(response),
+                    expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+                if not stored:
+                    # Another request took over the timed out claim; roll back so only one commits.
+                    raise ClaimLost
+    except ClaimLost:
+        return in_progress(respond)
+    except BaseException:
+        owned.delete()
+        raise
+    if response.status_code >= 500:
+        owned.delete()
+    return response
+
+
+def idempotent(view=None, *, prepare=None):
+    """
+    Honour an Idempotency-Key header on POST. The first request with a key
+    runs the view and stores its response in the same transaction as the
+    view's writes; later requests with the same key and body get that
+    response back without running the view. A duplicate that arrives while
+    the first is running waits for it. A claim running longer than
+    IDEMPOTENCY_LOCK_TIMEOUT may be taken over, but then its own writes are
+    rolled back, so at most one of them commits. Server errors are not
+    stored, so the request can be retried.
+
+    ``prepare(request)`` runs after the key is claimed and before the
+    transaction opens, e.g. to fetch exchange rates; a response it returns is
+    sent instead of running the view. Async views get an async wrapper and
+    an async ``prepare``, and answer with JsonResponse. Apply below @api_view.
+    """
+    if view is None:
+        return partial(idempotent, prepare=prepare)
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'POST' or 'Idempotency-Key' not in request.headers:
+                return await view(request, *args, **kwargs)
+            key, response = check_key(request, json_response)
+            if response is not None:
+                return response
+
+            fingerprint = request_fingerprint(request)
+            claimed_until, record = await sync_to_async(claim)(key, fingerprint)
+            if record is not None:
+                response = conflicting(record, fingerprint, json_response)
+                if response is not None:
+                    return response
+                finished = await await_record(record)
+                return in_progress(json_response) if finished is None else replay(finished, json_response)
+
+            owned = IdempotencyRecord.objects.filter(key=key, expires_at=claimed_until, status_code__isnull=True)
+            if prepare is not None:
+                response = await prepare(request)
+                if response is not None:
+                    await owned.adelete()
+                    return response
+            # The view's thread sensitive queries run in this thread, inside the transaction.
+            return await sync_to_async(run_claimed)(
+                owned, lambda: async_to_sync(view)(request, *args, **kwargs),
+                lambda response: json.loads(response.content), json_response,
+            )
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST' or 'Idempotency-Key' not in request.headers:
+            return view(request, *args, **kwargs)
+        key, response = check_key(request, Response)
+        if response is not None:
+            return response
+
+        fingerprint = request_fingerprint(request)
+        claimed_until, record = claim(key, fingerprint)
+        if record is not None:
+            response = conflicting(record, fingerprint, Response)
+            if response is not None:
+                return response
+            finished = wait_for(record)
+            return in_progress() if finished is None else replay(finished)
+
+        owned = IdempotencyRecord.objects.filter(key=key, expires_at=claimed_until, status_code__isnull=True)
+        if prepare is not None:
+            response = prepare(request)
+            if response is not None:
+                owned.delete()
+                return response
+        return run_claimed(owned, lambda: view(request, *args, **kwargs), lambda response: response.data, Response)
+
+    return wrapper
+
+
+def purge_expired_records(now=None):
+    return IdempotencyRecord.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
@@ -0,0 +1,242 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import Combinable
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import CENTS, LedgerCheckpoint, LedgerEntry, UserCurrencyAccount
+
+
+# account_id of the bank's side of a posting.
+BANK = None
+
+BALANCE_FIELD = DecimalField(max_digits=16, decimal_places=2)
+# Sums are compared with a tolerance below a cent: SQLite adds decimals as floats.
+HALF_CENT = CENTS / 2
+
+
+class UnbalancedPosting(ValueError):
+    pass
+
+
+def deposit_legs(account_id, currency, amount):
+    return [(account_id, currency, amount), (BANK, currency, -amount)]
+
+
+def conversion_legs(from_account_id, from_currency, debited, to_account_id, to_currency, credited):
+    return [
+        (from_account_id, from_currency, -debited),
+        (BANK, from_currency, debited),
+        (BANK, to_currency, -credited),
+        (to_account_id, to_currency, credited),
+    ]
+
+
+def adjustment_legs(account_id, old_currency, old_balance, new_currency, new_balance):
+    if old_currency == new_currency:
+        return deposit_legs(account_id, new_currency, new_balance - old_balance)
+    return deposit_legs(account_id, old_currency, -old_balance) + deposit_legs(account_id, new_currency, new_balance)
+
+
+def posting_entries(kind, legs):
+    """
+    Entries of one posting from (account_id, currency, amount) legs. Raises
+    UnbalancedPosting unless the legs sum to zero in every currency.
+    """
+    totals = {}
+    for _, currency, amount in legs:
+        totals[currency] = totals.get(currency, 0) + amount
+    unbalanced = {currency: total for currency, total in totals.items() if total}
+    if unbalanced:
+        raise UnbalancedPosting(f"Posting legs do not balance: {unbalanced}")
+    posting = uuid.uuid4()
+    return [
+        LedgerEntry(posting=posting, account_id=account_id, currency=currency, amount=amount, kind=kind)
+        for account_id, currency, amount in legs
+        if amount
+    ]
+
+
+def post(postings):
+    """
+    Append (kind, legs) postings to the ledger with a single insert. Call in
+    the transaction that changes the balances.
+    """
+    entries = [entry for kind, legs in postings for entry in posting_entries(kind, legs)]
+    if entries:
+        LedgerEntry.objects.bulk_create(entries)
+    return entries
+
+
+def _tracks_balance(instance, update_fields):
+    # F() updates come from the write paths, which post their own entries.
+    if isinstance(instance.balance, Combinable):
+        return False
+    return update_fields is None or bool({'balance', 'currency_code'} & set(update_fields))
+
+
+def _balance_of(instance):
+    return instance.currency_code, Decimal(str(instance.balance)).quantize(CENTS)
+
+
+@receiver(pre_save, sender=UserCurrencyAccount)
+def remember_stored_balance(sender, instance, update_fields=None, **kwargs):
+    instance._stored_balance = None
+    if instance.pk is None or not _tracks_balance(instance, update_fields):
+        return
+    loaded = getattr(instance, '_loaded_balance', None)
+    if loaded is not None and loaded == _balance_of(instance):
+        # Nothing to post, e.g. moving the account or editing other fields.
+        instance._stored_balance = loaded
+        return
+    instance._stored_balance = (
+        UserCurrencyAccount.objects.filter(pk=instance.pk).values_list('currency_code', 'balance').first()
+    )
+
+
+@receiver(post_save, sender=UserCurrencyAccount)
+def post_balance_change(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Post opening balances and the difference of balances written with
+    save(), e.g. from the admin, the API's account update or a shell, so
+    the ledger keeps reconciling.
+    """
+    if not _tracks_balance(instance, update_fields):
+        if isinstance(instance.balance, Combinable):
+            instance._loaded_balance = None
+        return
+    current = _balance_of(instance)
+    stored = getattr(instance, '_stored_balance', None)
+    if created or stored is None:
+        if current[1]:
+            post([('opening', deposit_legs(instance.pk, *current))])
+    elif stored != current:
+        post([('adjustment', adjustment_legs(instance.pk, *stored, *current))])
+    instance._loaded_balance = current
+
+
+def with_ledger_balance(accounts):
+    """
+    Annotate accounts with ``ledger_balance``: the checkpointed balance plus
+    the entries appended after the checkpoint.
+    """
+    newer = (
+        LedgerEntry.objects.filter(
+            account=OuterRef('pk'),
+            entry_id__gt=Coalesce(OuterRef('ledger_checkpoint__last_entry_id'), Value(0)),
+        )
+        .order_by()
+        .values('account')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return accounts.annotate(ledger_balance=Coalesce(
+        F('ledger_checkpoint__balance'), Value(Decimal(0)), output_field=BALANCE_FIELD,
+    ) + Coalesce(Subquery(newer, output_field=BALANCE_FIELD), Value(Decimal(0)), output_field=BALANCE_FIELD))
+
+
+def ledger_balance(account_id):
+    balance = with_ledger_balance(UserCurrencyAccount.objects.filter(pk=account_id)).values_list(
+        'ledger_balance', flat=True
+    ).first()
+    return None if balance is None else balance.quantize(CENTS)
+
+
+def checkpoint_accounts(chunk_size=2000, lag=None):
+    """
+    Fold entries older than ``lag`` seconds into the accounts' checkpoints, so
+    balance reads only sum the entries appended since. Entries still inside
+    the lag may belong to transactions that have not committed yet. Returns
+    the number of checkpoints written.
+    """
+    lag = settings.LEDGER_CHECKPOINT_LAG if lag is None else lag
+    upto = LedgerEntry.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=lag)).aggregate(
+        last=Max('entry_id')
+    )['last']
+    if upto is None:
+        return 0
+
+    checkpointed = LedgerCheckpoint.objects.filter(account=OuterRef('account')).values('last_entry_id')
+    deltas = (
+        LedgerEntry.objects.filter(
+            account__isnull=False,
+            entry_id__lte=upto,
+            entry_id__gt=Coalesce(Subquery(checkpointed), Value(0)),
+        )
+        .order_by('account')
+        .values_list('account')
+        .annotate(total=Sum('amount'))
+        .values_list('account', 'total')
+    )
+    written = 0
+    chunk = []
+    for row in deltas.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            written += _write_checkpoints(chunk, upto)
+            chunk = []
+    if chunk:
+        written += _write_checkpoints(chunk, upto)
+    return written
+
+
+def _write_checkpoints(deltas, upto):
+    with db_transaction.atomic():
+        account_ids = [account_id for account_id, _ in deltas]
+        existing = set(UserCurrencyAccount.objects.filter(pk__in=account_ids).values_list('pk', flat=True))
+        balances = dict(LedgerCheckpoint.objects.filter(account_id__in=account_ids).values_list('account_id', 'balance'))
+        now = timezone.now()
+        checkpoints = [
+            LedgerCheckpoint(
+                account_id=account_id,
+                balance=(balances.get(account_id, Decimal(0)) + total).quantize(CENTS),
+                last_entry_id=upto,
+                updated_at=now,
+            )
+            for account_id, total in deltas
+            if account_id in existing
+        ]
+        LedgerCheckpoint.objects.bulk_create(
+            checkpoints,
+            update_conflicts=True,
+            unique_fields=['account'],
+            update_fields=['balance', 'last_entry_id', 'updated_at'],
+        )
+    return len(checkpoints)
+
+
+def balance_mismatches(chunk_size=2000):
+    """
+    Stream (account_id, balance, ledger_balance) of accounts whose balance
+    column disagrees with the ledger.
+    """
+    accounts = (
+        with_ledger_balance(UserCurrencyAccount.objects.order_by('pk'))
+        .annotate(drift=F('ledger_balance') - F('balance'))
+        .filter(Q(drift__gte=HALF_CENT) | Q(drift__lte=-HALF_CENT))
+        .values_list('pk', 'balance', 'ledger_balance')
+    )
+    for account_id, balance, ledger in accounts.iterator(chunk_size=chunk_size):
+        yield account_id, balance, ledger.quantize(CENTS)
+
+
+def unbalanced_postings(chunk_size=2000):
+    """
+    Stream (posting, currency, total) of postings whose legs do not sum to zero.
+    """
+    postings = (
+        LedgerEntry.objects.order_by()
+        .values('posting', 'currency')
+        .annotate(total=Sum('amount'))
+        .filter(Q(total__gte=HALF_CENT) | Q(total__lte=-HALF_CENT))
+        .values_list('posting', 'currency', 'total')
+    )
+    for posting, currency, total in postings.iterator(chunk_size=chunk_size):
+        yield posting, currency, total.quantize(CENTS)
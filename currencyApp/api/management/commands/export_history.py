@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import CONTENT_TYPES, EXPORTS, export_rows, stream_export
+from api.pagination import InvalidQuery
+
+
+class Command(BaseCommand):
+    help = "Stream account history, transactions or deposits as CSV, NDJSON or a JSON array with bounded memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(CONTENT_TYPES), default='csv')
+        parser.add_argument('--user-id', type=int, help="Export a single user; defaults to all users.")
+        parser.add_argument('--date-from', help="YYYY-MM-DD, inclusive.")
+        parser.add_argument('--date-to', help="YYYY-MM-DD, inclusive.")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per database round trip.")
+        parser.add_argument('--output', '-o', default='-', help="Output file, or - for stdout.")
+
+    def handle(self, *args, **options):
+        params = {
+            'user_id': options['user_id'],
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+        }
+        try:
+            rows = export_rows(options['kind'], params, options['chunk_size'])
+        except InvalidQuery as e:
+            raise CommandError(str(e))
+
+        chunks = stream_export(options['kind'], rows, options['format'])
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
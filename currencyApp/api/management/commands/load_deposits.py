@@ -0,0 +1,37 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import apply_deposits, read_rows
+
+
+class Command(BaseCommand):
+    help = "Stream deposits from a CSV or JSONL file (user_id, currency_code, amount) and apply them in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=settings.BULK_DEPOSIT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError("Cannot infer the file format; pass --format csv or --format jsonl.")
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        def on_error(line_number, message):
+            self.stderr.write(f"line {line_number}: {message}")
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            summary = apply_deposits(read_rows(stream, file_format), options['chunk_size'], on_error)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Applied {summary['applied']} deposits in {summary['chunks']} chunks, rejected {summary['rejected']}."
+        ))
@@ -0,0 +1,51 @@
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.bulk import read_rows
+from api.onboarding import hash_pool, onboard_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream users from a CSV or JSONL file (username, password, first_name, last_name, phone_number, email) "
+        "and create them with their PLN accounts in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=settings.BULK_USER_CHUNK_SIZE)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Processes used to hash passwords. Defaults to the number of CPUs.",
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError("Cannot infer the file format; pass --format csv or --format jsonl.")
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--chunk-size and --workers must be positive.")
+
+        def on_error(line_number, message):
+            self.stderr.write(f"line {line_number}: {message}")
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        pool = hash_pool(options['workers'])
+        try:
+            summary = onboard_users(read_rows(stream, file_format), options['chunk_size'], pool, on_error)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']} users in {summary['chunks']} chunks, rejected {summary['rejected']}."
+        ))
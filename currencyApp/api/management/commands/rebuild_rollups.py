@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from api.bulk import chunked
+from api.models import User
+from api.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the daily history rollups from AccountHistory, one chunk of users per transaction. "
+        "Each chunk locks its users' accounts, so conversions for those users wait for it to finish."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids', help="Limit to these users.")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Users per chunk.")
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help="Chunks rebuilt in parallel, each on its own connection. Keep 1 on SQLite.",
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--chunk-size and --workers must be positive.")
+
+        users = User.objects.order_by('user_id')
+        if options['user_ids']:
+            users = users.filter(user_id__in=options['user_ids'])
+        chunks = list(chunked(users.values_list('user_id', flat=True), options['chunk_size']))
+
+        if options['workers'] == 1:
+            counts = [rebuild_rollups(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                counts = list(executor.map(self.rebuild_chunk, chunks))
+
+        total = sum(counts)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} daily rollups in {len(chunks)} chunks."))
+
+    @staticmethod
+    def rebuild_chunk(user_ids):
+        try:
+            return rebuild_rollups(user_ids)
+        finally:
+            connections.close_all()
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ledger import balance_mismatches, unbalanced_postings
+
+
+class Command(BaseCommand):
+    help = (
+        "Verify in one streaming pass that every posting balances and that every account balance "
+        "equals its ledger checkpoint plus the newer entries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per round trip.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be positive.")
+
+        problems = 0
+        for posting, currency, total in unbalanced_postings(options['chunk_size']):
+            problems += 1
+            self.stderr.write(f"Posting {posting} does not balance in {currency}: {total}")
+        for account_id, balance, ledger_balance in balance_mismatches(options['chunk_size']):
+            problems += 1
+            self.stderr.write(f"Account {account_id}: balance {balance}, ledger {ledger_balance}")
+
+        if problems:
+            raise CommandError(f"Ledger does not reconcile: {problems} problems.")
+        self.stdout.write(self.style.SUCCESS("Ledger reconciles with all account balances."))
@@ -0,0 +1,60 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.rates import (
+    RateFetchError, last_publication_date, refresh_rate_table, save_rate_table, seconds_until_next_publication,
+)
+
+
+class Command(BaseCommand):
+    help = "Fetch the full NBP table C in one request, store it in the ExchangeRate table and save the fallback rate file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help="Keep running and re-ingest after every NBP publication.",
+        )
+        parser.add_argument(
+            '--retry-interval',
+            type=int,
+            default=300,
+            help="Seconds to wait before retrying a failed or not yet published fetch in --loop mode.",
+        )
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            try:
+                self.ingest()
+            except RateFetchError as e:
+                raise CommandError(str(e))
+            return
+
+        while True:
+            try:
+                table = self.ingest()
+                expected = last_publication_date()
+                if date.fromisoformat(str(table.effective_date)) >= expected:
+                    delay = seconds_until_next_publication()
+                else:
+                    # NBP publishes late now and then; poll until the new table appears.
+                    self.stderr.write(f"NBP has not published the table for {expected} yet.")
+                    delay = options['retry_interval']
+            except RateFetchError as e:
+                self.stderr.write(str(e))
+                delay = options['retry_interval']
+            time.sleep(delay)
+
+    def ingest(self):
+        table = refresh_rate_table()
+        try:
+            save_rate_table(table)
+        except OSError as e:
+            # The stored rates are in; a stale fallback file is no reason to fail the run.
+            self.stderr.write(f"Cannot save the fallback rate file: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored NBP table {table.number} ({table.effective_date}) with {len(table.rates)} currencies."
+        ))
+        return table
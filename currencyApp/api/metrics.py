@@ -0,0 +1,204 @@
+import threading
+from bisect import bisect_left
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter keyed by label values, e.g. counter.inc('GET', '200').
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram keyed by label values. ``observe`` is one bisect and
+    a few additions under a lock, cheap enough to call on every request.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def total(self, *labels):
+        entry = self._values.get(labels)
+        return entry[1] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._values.items()]
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = (('le', _format_value(float(bound))),)
+                yield f'{self.name}_bucket', _format_labels(self.labelnames, labels, le), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labelnames, labels), total
+            yield f'{self.name}_count', _format_labels(self.labelnames, labels), count
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """
+    Value read when the metrics are rendered. ``collect`` returns an iterable
+    of (label values, value).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+    def reset(self):
+        pass
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        The registered metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requests by view, method and status code.', ('view', 'method', 'status'),
+))
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by view.', ('view', 'method'),
+))
+db_queries = registry.register(Histogram(
+    'http_request_db_queries', 'Database queries per request by view.', ('view', 'method'), QUERY_COUNT_BUCKETS,
+))
+db_duration = registry.register(Histogram(
+    'http_request_db_duration_seconds', 'Time spent in database queries per request by view.', ('view', 'method'),
+))
+slow_requests = registry.register(Counter(
+    'http_slow_requests_total', 'Requests slower than METRICS_SLOW_REQUEST_MS by view.', ('view',),
+))
+upstream_duration = registry.register(Histogram(
+    'rate_upstream_request_duration_seconds', 'Outbound rate provider calls by provider and outcome.',
+    ('provider', 'outcome'),
+))
+rate_cache_requests = registry.register(Counter(
+    'rate_cache_requests_total', 'Rate cache lookups by result (hit, stale or miss).', ('result',),
+))
+
+
+def _circuit_states():
+    from .rates import get_rate_providers
+
+    for provider in get_rate_providers():
+        breaker = getattr(provider, 'breaker', None)
+        if breaker is not None:
+            yield (provider.name,), 0 if breaker.state == 'closed' else 1
+
+
+def _hashing_stats():
+    from .hashing import get_hashing_limiter
+
+    for name, value in get_hashing_limiter().metrics().items():
+        yield (name,), value
+
+
+registry.register(Gauge(
+    'rate_provider_circuit_open', '1 while the circuit breaker of a rate provider is open or half-open.',
+    ('provider',), _circuit_states,
+))
+registry.register(Gauge(
+    'password_hashing', 'Password hashing limiter counters and settings.', ('stat',), _hashing_stats,
+))
@@ -0,0 +1,165 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper counting queries and their time. The SQL of the
+    first ``limit`` queries is kept for the slow request log.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.queries) < self.limit:
+                self.queries.append((elapsed, sql))
+
+
+def add_execute_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def remove_execute_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.view_name or match._func_path
+
+
+class RecordedStream:
+    """
+    Streaming response content that counts the queries run while it is
+    iterated and calls on_close, once, when the response is closed.
+    """
+
+    def __init__(self, content, recorder, on_close):
+        self.content = content
+        self.recorder = recorder
+        self.on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with connection.execute_wrapper(self.recorder):
+            return next(self.content)
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+
+class AsyncRecordedStream(RecordedStream):
+    """
+    RecordedStream for async content. The ORM runs on sync_to_async threads,
+    so the recorder is installed there around each chunk.
+    """
+
+    __iter__ = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        await sync_to_async(add_execute_wrapper)(self.recorder)
+        try:
+            return await anext(self.content)
+        finally:
+            await sync_to_async(remove_execute_wrapper)(self.recorder)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, status and database queries of every request per view
+    (URL name, so label cardinality stays bounded), and logs requests slower
+    than METRICS_SLOW_REQUEST_MS together with their queries. Streaming
+    responses are recorded when they close, so the queries run while their
+    content is produced are included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder(settings.METRICS_SLOW_REQUEST_QUERY_LIMIT)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        return self.finish(request, response, started, recorder)
+
+    async def __acall__(self, request):
+        # The ORM runs on the request's sync_to_async thread, so the wrapper
+        # is installed on that thread's connection.
+        recorder = QueryRecorder(settings.METRICS_SLOW_REQUEST_QUERY_LIMIT)
+        started = time.perf_counter()
+        await sync_to_async(add_execute_wrapper)(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(remove_execute_wrapper)(recorder)
+        return self.finish(request, response, started, recorder)
+
+    def finish(self, request, response, started, recorder):
+        def record():
+            self.record(request, response, time.perf_counter() - started, recorder)
+
+        if response.streaming:
+            stream = AsyncRecordedStream if response.is_async else RecordedStream
+            response.streaming_content = stream(response.streaming_content, recorder, record)
+        else:
+            record()
+        return response
+
+    def record(self, request, response, elapsed, recorder):
+        view = view_label(request)
+        method = request.method
+        metrics.http_requests.inc(view, method, str(response.status_code))
+        metrics.http_request_duration.observe(elapsed, view, method)
+        metrics.db_queries.observe(recorder.count, view, method)
+        metrics.db_duration.observe(recorder.duration, view, method)
+
+        if elapsed * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            metrics.slow_requests.inc(view)
+            self.log_slow_request(request, response, view, elapsed, recorder)
+
+    def log_slow_request(self, request, response, view, elapsed, recorder):
+        queries = "".join(f"\n  {duration * 1000:.1f}ms {sql}" for duration, sql in recorder.queries)
+        if recorder.count > len(recorder.queries):
+            queries += f"\n  ... {recorder.count - len(recorder.queries)} more"
+        logger.warning(
+            "Slow request %s %s (%s) -> %s in %.0fms, %d queries in %.0fms%s",
+            request.method, request.get_full_path(), view, response.status_code,
+            elapsed * 1000, recorder.count, recorder.duration * 1000, queries,
+        )
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_usercurrencyaccount_account_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('rate_id', models.AutoField(primary_key=True, serialize=False)),
+                ('currency', models.CharField(max_length=3)),
+                ('bid', models.DecimalField(decimal_places=6, max_digits=12)),
+                ('ask', models.DecimalField(decimal_places=6, max_digits=12)),
+                ('table_number', models.CharField(max_length=20)),
+                ('effective_date', models.DateField()),
+                ('fetched_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['currency', '-effective_date'], name='exchange_rate_latest_idx')],
+                'constraints': [models.UniqueConstraint(fields=('currency', 'effective_date'), name='unique_currency_effective_date')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_exchangerate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accounthistory',
+            index=models.Index(fields=['user', '-created_at', '-history_id'], name='history_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='accounthistory',
+            index=models.Index(fields=['user', 'currency', '-created_at', '-history_id'], name='history_user_currency_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deposithistory',
+            index=models.Index(fields=['user', '-created_at', '-deposit_id'], name='deposit_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', '-created_at', '-transaction_id'], name='transaction_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['account_created_on', 'user_id'], name='user_created_idx'),
+        ),
+    ]
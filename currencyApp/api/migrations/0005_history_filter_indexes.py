@@ -0,0 +1,25 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deposithistory',
+            index=models.Index(fields=['user_currency_account', '-created_at', '-deposit_id'], name='deposit_account_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'from_currency', '-created_at', '-transaction_id'], name='transaction_user_from_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'to_currency', '-created_at', '-transaction_id'], name='transaction_user_to_idx'),
+        ),
+    ]
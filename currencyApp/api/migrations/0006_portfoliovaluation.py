@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_history_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioValuation',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='portfolio', serialize=False, to='api.user')),
+                ('total_pln', models.DecimalField(decimal_places=8, default=0, max_digits=22)),
+                ('rates_date', models.DateField(null=True)),
+                ('is_stale', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
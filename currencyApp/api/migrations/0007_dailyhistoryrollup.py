@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_portfoliovaluation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyHistoryRollup',
+            fields=[
+                ('rollup_id', models.AutoField(primary_key=True, serialize=False)),
+                ('currency', models.CharField(max_length=3)),
+                ('day', models.DateField()),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='api.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'day'], name='rollup_user_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'currency', 'day'), name='unique_user_currency_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_numbersequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='accounts_version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:43
+
+import uuid
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """
+    Post an opening entry against the bank for every non-zero balance, so
+    existing balances are explained by the ledger.
+    """
+    UserCurrencyAccount = apps.get_model('api', 'UserCurrencyAccount')
+    LedgerEntry = apps.get_model('api', 'LedgerEntry')
+    batch = []
+    accounts = UserCurrencyAccount.objects.exclude(balance=0).values_list('account_id', 'currency_code', 'balance')
+    for account_id, currency, balance in accounts.iterator(chunk_size=2000):
+        posting = uuid.uuid4()
+        batch.append(LedgerEntry(posting=posting, account_id=account_id, currency=currency, amount=balance, kind='opening'))
+        batch.append(LedgerEntry(posting=posting, account_id=None, currency=currency, amount=-balance, kind='opening'))
+        if len(batch) >= 2000:
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+    LedgerEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_checkpoint', serialize=False, to='api.usercurrencyaccount')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('last_entry_id', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('entry_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('posting', models.UUIDField()),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16)),
+                ('kind', models.CharField(choices=[('opening', 'Opening balance'), ('deposit', 'Deposit'), ('conversion', 'Conversion'), ('adjustment', 'Adjustment')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ledger_entries', to='api.usercurrencyaccount')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'entry_id'], name='ledger_account_entry_idx'), models.Index(fields=['posting'], name='ledger_posting_idx')],
+            },
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,19 @@
-import random
 import re
+import threading
+from decimal import Decimal
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from .validation import USER_FIELDS, validate_user
+
+
+CENTS = Decimal('0.01')
+
 
 class User(models.Model):
     user_id = models.AutoField(primary_key=True)
@@ -17,60 +26,147 @@ class User(models.Model):
     account_created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
     last_login = models.DateTimeField(null=True, blank=True)
+    accounts_version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account_created_on', 'user_id'], name='user_created_idx'),
+        ]
 
     def __str__(self):
         return self.username
 
+    @staticmethod
+    def bump_accounts_version(user_ids):
+        """
+        Mark the currency accounts of user_ids as changed, invalidating their
+        cached listings. Call in the transaction that changes the accounts.
+        """
+        User.objects.filter(pk__in=user_ids).update(accounts_version=F('accounts_version') + 1)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # accounts_version only moves through bump_accounts_version; writing back
+            # the value loaded earlier could undo a concurrent bump.
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'accounts_version'
+            ]
+        super().save(*args, **kwargs)
+
     def clean(self):
-        if not self.username or self.username.strip() == "":
-            raise ValidationError("Username is required.")
-        if not re.match(r'^[a-zA-Z0-9_]+$', self.username):
-            raise ValidationError("Username cannot contain special characters.")
-        
-        name_pattern = r'^[A-Z][a-z]+(?: [A-Z][a-z]+)*$'
-        if not self.first_name or self.first_name.strip() == "":
-            raise ValidationError("First name is required.")
-        if not re.match(name_pattern, self.first_name):
-            raise ValidationError("First name must follow the format: Eltun.")
-        
-        if not self.last_name or self.last_name.strip() == "":
-            raise ValidationError("Last name is required.")
-        if not re.match(name_pattern, self.last_name):
-            raise ValidationError("Last name must follow the format: Gasimov.")
-        
-        if not self.phone_number or self.phone_number.strip() == "":
-            raise ValidationError("Phone number is required.")
-        if not re.match(r'^\+48\d{9}$', self.phone_number):
-            raise ValidationError("Phone number must be in the format +48XXXXXXXXX (9 digits after +48).")
-        
-        if not self.email or self.email.strip() == "":
-            raise ValidationError("Email is required.")
-        if not re.match(r'^[^@]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', self.email):
-            raise ValidationError("Email must be valid (e.g., gasimoweltun@gmail.com).")
-        
-        if not self.password or self.password.strip() == "":
-            raise ValidationError("Password is required.")
-        
-        if not (8 <= len(self.password) <= 16):
-            raise ValidationError("Password must be between 8 and 16 characters.")
-        
-        if not re.search(r'[A-Z]', self.password):
-            raise ValidationError("Password must contain at least 1 uppercase letter.")
-        
-        if not re.search(r'\d', self.password):
-            raise ValidationError("Password must contain at least 1 number.")
-        
-        if not re.search(r'[@$!%*?&]', self.password):
-            raise ValidationError("Password must contain at least 1 special character (@, $, !, %, *, ?, &).")
-
-        if self.username and self.password:
-            if any(word in self.password.lower() for word in self.username.lower().split('_')):
-                raise ValidationError("Username and password must not be similar.")
-
-        if self.email and self.password:
-            email_username = self.email.split('@')[0]
-            if email_username in self.password:
-                raise ValidationError("Email and password must not be similar.")
+        errors = validate_user({field: getattr(self, field) for field in USER_FIELDS})
+        if errors:
+            raise ValidationError(errors)
+
+
+def luhn_check_digit(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if position % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str(-total % 10)
+
+
+def format_account_number(serial):
+    """
+    Format a serial as NNNN-NNNN-NNNN: 11 serial digits and a Luhn check digit.
+    These never collide with the older random XXX-XXX-XXX numbers.
+    """
+    digits = f"{serial:011d}"
+    digits += luhn_check_digit(digits)
+    return '-'.join(digits[i:i + 4] for i in range(0, 12, 4))
+
+
+class NumberSequence(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
+    @classmethod
+    def reserve(cls, name, count):
+        """
+        Reserve count consecutive values with one UPDATE and return them as a
+        range. The row stays locked until the surrounding transaction ends.
+        """
+        with transaction.atomic(savepoint=False):
+            if not cls.objects.filter(name=name).update(last_value=F('last_value') + count):
+                cls.objects.get_or_create(name=name)
+                cls.objects.filter(name=name).update(last_value=F('last_value') + count)
+            last_value = cls.objects.filter(name=name).values_list('last_value', flat=True).get()
+        return range(last_value - count + 1, last_value + 1)
+
+    @classmethod
+    def reserve_detached(cls, name, count):
+        """
+        Like reserve(), but with a single autocommitted statement on a
+        connection of its own, so the row is locked only for that statement
+        even when the caller is inside a transaction. The connection is closed
+        again right away; blocks are reserved rarely enough that holding one
+        per thread would cost more. Values reserved for a caller that rolls
+        back are lost.
+        """
+        connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        table = connection.ops.quote_name(cls._meta.db_table)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (name, last_value) VALUES (%s, %s) '
+                    f'ON CONFLICT (name) DO UPDATE SET last_value = {table}.last_value + excluded.last_value '
+                    f'RETURNING last_value',
+                    [name, count],
+                )
+                last_value = cursor.fetchone()[0]
+        finally:
+            connection.close()
+        return range(last_value - count + 1, last_value + 1)
+
+
+class AccountNumberAllocator:
+    """
+    Hands out account numbers without probing for collisions, from blocks of
+    ACCOUNT_NUMBER_BLOCK_SIZE serials reserved and committed ahead of time.
+    Inside a transaction a new block is reserved on a separate connection,
+    so concurrent account creation never waits on the sequence row for the
+    length of another transaction. Numbers of rolled back accounts are
+    skipped, not reused.
+
+    SQLite allows a single writer, so a second connection would wait for the
+    caller's own transaction; there, inside a transaction, exactly the
+    requested serials are reserved as part of it.
+    """
+
+    sequence = 'account_number'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+
+    def allocate(self, count=1):
+        connection = transaction.get_connection()
+        if connection.in_atomic_block and connection.vendor == 'sqlite':
+            serials = NumberSequence.reserve(self.sequence, count)
+        else:
+            with self._lock:
+                if self._end - self._next < count:
+                    size = max(count, settings.ACCOUNT_NUMBER_BLOCK_SIZE)
+                    if connection.in_atomic_block:
+                        block = NumberSequence.reserve_detached(self.sequence, size)
+                    else:
+                        block = NumberSequence.reserve(self.sequence, size)
+                    self._next, self._end = block.start, block.stop
+                serials = range(self._next, self._next + count)
+                self._next += count
+        return [format_account_number(serial) for serial in serials]
+
+    def reset(self):
+        with self._lock:
+            self._next = self._end = 0
+
+
+account_numbers = AccountNumberAllocator()
 
 
 class UserCurrencyAccount(models.Model):
@@ -108,6 +204,16 @@ class UserCurrencyAccount(models.Model):
         if self.balance < 0:
             raise ValidationError("Balance cannot be negative.")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The owner as loaded, so moving the account invalidates both users' listings.
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        # The balance as loaded, so saves that leave it alone skip the ledger's lookup.
+        if 'balance' in instance.__dict__ and 'currency_code' in instance.__dict__:
+            instance._loaded_balance = (instance.currency_code, instance.balance)
+        return instance
+
     def save(self, *args, **kwargs):
         if not self.account_number:
             self.account_number = self.generate_account_number()
@@ -115,13 +221,18 @@ class UserCurrencyAccount(models.Model):
 
     @staticmethod
     def generate_account_number():
+        return account_numbers.allocate()[0]
+
+    @staticmethod
+    def assign_account_numbers(accounts):
         """
-        Generate a random account number in the format XXX-XXX-XXX.
+        Give every account without a number one, using a single allocation.
+        Call before bulk_create, which bypasses save().
         """
-        while True:
-            number = '-'.join(f"{random.randint(100, 999)}" for _ in range(3))
-            if not UserCurrencyAccount.objects.filter(account_number=number).exists():
-                return number
+        missing = [account for account in accounts if not account.account_number]
+        for account, number in zip(missing, account_numbers.allocate(len(missing)) if missing else []):
+            account.account_number = number
+        return accounts
 
 
 @receiver(post_save, sender=User)
@@ -130,6 +241,14 @@ def create_default_currency_account(sender, instance, created, **kwargs):
         UserCurrencyAccount.objects.create(user=instance, currency_code='PLN')
 
 
+@receiver(post_save, sender=UserCurrencyAccount)
+@receiver(post_delete, sender=UserCurrencyAccount)
+def bump_accounts_version(sender, instance, **kwargs):
+    previous_user_id = getattr(instance, '_loaded_user_id', None)
+    User.bump_accounts_version({instance.user_id} | ({previous_user_id} if previous_user_id else set()))
+    instance._loaded_user_id = instance.user_id
+
+
 class Transaction(models.Model):
     transaction_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
@@ -138,6 +257,13 @@ class Transaction(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-transaction_id'], name='transaction_user_created_idx'),
+            models.Index(fields=['user', 'from_currency', '-created_at', '-transaction_id'], name='transaction_user_from_idx'),
+            models.Index(fields=['user', 'to_currency', '-created_at', '-transaction_id'], name='transaction_user_to_idx'),
+        ]
+
     def __str__(self):
         return f"Transaction {self.transaction_id}: {self.user.username} ({self.from_currency} to {self.to_currency}, {self.amount})"
 
@@ -155,6 +281,12 @@ class AccountHistory(models.Model):
     action = models.CharField(max_length=8, choices=ACTION_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-history_id'], name='history_user_created_idx'),
+            models.Index(fields=['user', 'currency', '-created_at', '-history_id'], name='history_user_currency_idx'),
+        ]
+
     def __str__(self):
         return f"History {self.history_id}: {self.user.username} ({self.currency}, {self.action}, {self.amount})"
 
@@ -166,5 +298,142 @@ class DepositHistory(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-deposit_id'], name='deposit_user_created_idx'),
+            models.Index(fields=['user_currency_account', '-created_at', '-deposit_id'], name='deposit_account_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deposit {self.deposit_id} by {self.user.username} to {self.user_currency_account.currency_code} account"
+
+class ExchangeRate(models.Model):
+    rate_id = models.AutoField(primary_key=True)
+    currency = models.CharField(max_length=3)
+    bid = models.DecimalField(max_digits=12, decimal_places=6)
+    ask = models.DecimalField(max_digits=12, decimal_places=6)
+    table_number = models.CharField(max_length=20)
+    effective_date = models.DateField()
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'effective_date'], name='unique_currency_effective_date')
+        ]
+        indexes = [
+            models.Index(fields=['currency', '-effective_date'], name='exchange_rate_latest_idx')
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.effective_date}: bid {self.bid}, ask {self.ask}"
+
+
+class PortfolioValuation(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='portfolio')
+    total_pln = models.DecimalField(max_digits=22, decimal_places=8, default=0)
+    rates_date = models.DateField(null=True)
+    is_stale = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Portfolio of {self.user_id}: {self.total_pln} PLN"
+
+
+class DailyHistoryRollup(models.Model):
+    rollup_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    currency = models.CharField(max_length=3)
+    day = models.DateField()
+    income = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'currency', 'day'], name='unique_user_currency_day')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'day'], name='rollup_user_day_idx'),
+        ]
+
+    @property
+    def net(self):
+        return self.income - self.expense
+
+    def __str__(self):
+        return f"Rollup {self.day} {self.currency} for {self.user_id}: +{self.income} -{self.expense}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Outcome of a request sent with an Idempotency-Key. ``key`` is a digest of
+    the endpoint and the client's key; ``status_code`` stays null while the
+    first request is still running.
+    """
+
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Idempotency record {self.key} ({self.status_code or 'in progress'})"
+
+
+class LedgerEntry(models.Model):
+    """
+    One leg of a double-entry posting. Entries are only ever inserted; the
+    legs of a posting sum to zero per currency. ``account`` is null for the
+    bank's own side (cash in for deposits, the FX desk for conversions), and
+    entries outlive deleted accounts. The ledger is an audit trail next to
+    UserCurrencyAccount.balance, which stays the balance reads and overdraft
+    checks use; the write paths still lock and rewrite the account rows.
+    """
+
+    KIND_CHOICES = [
+        ('opening', 'Opening balance'),
+        ('deposit', 'Deposit'),
+        ('conversion', 'Conversion'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    entry_id = models.BigAutoField(primary_key=True)
+    posting = models.UUIDField()
+    account = models.ForeignKey(
+        UserCurrencyAccount, null=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='ledger_entries'
+    )
+    currency = models.CharField(max_length=3)
+    amount = models.DecimalField(max_digits=16, decimal_places=2)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'entry_id'], name='ledger_account_entry_idx'),
+            models.Index(fields=['posting'], name='ledger_posting_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ledger entry {self.entry_id}: {self.amount} {self.currency} on {self.account_id or 'bank'}"
+
+
+class LedgerCheckpoint(models.Model):
+    """
+    Ledger balance of an account over every entry up to ``last_entry_id``.
+    """
+
+    account = models.OneToOneField(
+        UserCurrencyAccount, on_delete=models.CASCADE, primary_key=True, related_name='ledger_checkpoint'
+    )
+    balance = models.DecimalField(max_digits=16, decimal_places=2)
+    last_entry_id = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return f"Deposit {self.deposit_id} by {self.user.username} to {self.user_currency_account.currency_code} account"
\ No newline at end of file
+        return f"Checkpoint of {self.account_id} at entry {self.last_entry_id}: {self.balance}"
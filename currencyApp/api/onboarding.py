@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q
+
+from .bulk import BulkRowError, chunked
+from .hashing import hash_password
+from .models import User, UserCurrencyAccount
+from .validation import USER_FIELDS, error_messages, validate_users
+
+
+UNIQUE_FIELDS = ('username', 'email', 'phone_number')
+
+
+def parse_user_row(row):
+    """
+    Return the user fields of a row. Field rules are checked afterwards for
+    the whole chunk with validate_users. Raises BulkRowError.
+    """
+    if not isinstance(row, dict):
+        raise BulkRowError("Malformed row")
+    return {field: row.get(field) for field in USER_FIELDS}
+
+
+def validate_user_rows(rows):
+    """
+    Validate a chunk of (ref, row) in batch. Returns (users, rejected) where
+    users is a list of (ref, unsaved User).
+    """
+    users = []
+    rejected = []
+    parsed = []
+    for ref, row in rows:
+        try:
+            parsed.append((ref, parse_user_row(row)))
+        except BulkRowError as e:
+            rejected.append((ref, str(e)))
+    for (ref, values), errors in zip(parsed, validate_users([values for _, values in parsed])):
+        if errors:
+            rejected.append((ref, " ".join(error_messages(errors))))
+        else:
+            users.append((ref, User(**values)))
+    return users, rejected
+
+
+def _init_hash_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def hash_pool(workers):
+    """
+    Process pool for make_password, or None to hash in this process. Workers
+    set Django up themselves, so the pool also works with the spawn start
+    method. Starting one is expensive: create it once per import run, as
+    load_users does, never per request.
+    """
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_hash_worker,
+        initargs=(settings.SETTINGS_MODULE,),
+    )
+
+
+def hash_passwords(passwords, pool=None):
+    """
+    Hash on the given process pool, or else in this thread under the shared
+    password hashing limit, which may raise HashingBusy.
+    """
+    if pool is None:
+        return [hash_password(password) for password in passwords]
+    return list(pool.map(make_password, passwords, chunksize=16))
+
+
+def existing_unique_values(users):
+    """
+    Return {field: set(values)} of unique fields of users that are already
+    taken, in one query.
+    """
+    condition = Q()
+    for field in UNIQUE_FIELDS:
+        condition |= Q(**{f'{field}__in': [getattr(user, field) for user in users]})
+    taken = {field: set() for field in UNIQUE_FIELDS}
+    for row in User.objects.filter(condition).values_list(*UNIQUE_FIELDS):
+        for field, value in zip(UNIQUE_FIELDS, row):
+            taken[field].add(value)
+    return taken
+
+
+def apply_user_chunk(users, pool=None):
+    """
+    Create a list of (ref, User) in one transaction: one query for uniqueness,
+    bulk inserts of users and their default PLN accounts, and a single
+    account number reservation. post_save receivers are not fired. Returns
+    (created, rejected) where rejected is a list of (ref, error).
+    """
+    rejected = []
+    taken = existing_unique_values([user for _, user in users])
+    accepted = []
+    for ref, user in users:
+        conflict = next((field for field in UNIQUE_FIELDS if getattr(user, field) in taken[field]), None)
+        if conflict:
+            rejected.append((ref, f"A user with this {conflict.replace('_', ' ')} already exists."))
+        else:
+            accepted.append((ref, user))
+
+    if not accepted:
+        return [], rejected
+
+    for (_, user), password in zip(accepted, hash_passwords([user.password for _, user in accepted], pool)):
+        user.password = password
+
+    # Numbered before the transaction, so the chunk never holds the sequence row.
+    accounts = UserCurrencyAccount.assign_account_numbers(
+        [UserCurrencyAccount(currency_code='PLN') for _ in accepted]
+    )
+    try:
+        with db_transaction.atomic():
+            created = User.objects.bulk_create([user for _, user in accepted])
+            for account, user in zip(accounts, created):
+                account.user = user
+            UserCurrencyAccount.objects.bulk_create(accounts)
+    except IntegrityError:
+        rejected.extend((ref, "Conflicts with a user created concurrently; retry this row.") for ref, _ in accepted)
+        return [], rejected
+    return created, rejected
+
+
+def onboard_users(rows, chunk_size=1000, pool=None, on_error=None):
+    """
+    Stream users from an iterable of (ref, row_dict) in chunks of chunk_size.
+    Rows are validated a chunk at a time, passwords are hashed on ``pool``
+    (see hash_passwords) and each chunk is committed separately. Duplicates
+    within the input are rejected after their first occurrence. Returns a
+    summary of created and rejected rows; per-row errors are passed to
+    on_error(ref, message).
+    """
+    summary = {"created": 0, "rejected": 0, "chunks": 0}
+    seen = {field: set() for field in UNIQUE_FIELDS}
+
+    def reject(ref, message):
+        summary["rejected"] += 1
+        if on_error:
+            on_error(ref, message)
+
+    for chunk in chunked(rows, chunk_size):
+        users = []
+        candidates, rejected = validate_user_rows(chunk)
+        for ref, message in rejected:
+            reject(ref, message)
+        for ref, user in candidates:
+            duplicate = next((field for field in UNIQUE_FIELDS if getattr(user, field) in seen[field]), None)
+            if duplicate:
+                reject(ref, f"Duplicate {duplicate.replace('_', ' ')} in input.")
+                continue
+            for field in UNIQUE_FIELDS:
+                seen[field].add(getattr(user, field))
+            users.append((ref, user))
+
+        if users:
+            created, rejected = apply_user_chunk(users, pool)
+            summary["created"] += len(created)
+            for ref, message in rejected:
+                reject(ref, message)
+        summary["chunks"] += 1
+
+    return summary
@@ -0,0 +1,132 @@
+import base64
+import json
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    payload = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError
+        return [
+            model._meta.get_field(field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except Exception:
+        raise InvalidQuery("Invalid cursor")
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the WHERE clause selecting rows strictly after ``values`` in
+    ``ordering``, e.g. created_at < x OR (created_at = x AND id < y).
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def page_size(request):
+    limit = request.query_params.get('limit')
+    if limit is None:
+        return settings.LIST_PAGE_SIZE
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidQuery("limit must be an integer")
+    if limit < 1:
+        raise InvalidQuery("limit must be positive")
+    return min(limit, settings.LIST_MAX_PAGE_SIZE)
+
+
+def filter_date_range(params, queryset, field):
+    """
+    Apply inclusive ``date_from``/``date_to`` (YYYY-MM-DD) parameters to a
+    date or datetime field.
+    """
+    is_date = queryset.model._meta.get_field(field).get_internal_type() == 'DateField'
+    for param, lookup, bound in (('date_from', 'gte', time.min), ('date_to', 'lte', time.max)):
+        value = params.get(param)
+        if not value:
+            continue
+        try:
+            day = parse_date(value) if len(value) == 10 else None
+        except ValueError:
+            # Well formed but impossible, such as 2024-02-30.
+            day = None
+        if day is None:
+            raise InvalidQuery(f"{param} must be a date in YYYY-MM-DD format")
+        moment = day if is_date else timezone.make_aware(datetime.combine(day, bound))
+        queryset = queryset.filter(**{f'{field}__{lookup}': moment})
+    return queryset
+
+
+def paginate(request, queryset, ordering, columns=None):
+    """
+    Return (rows, next_cursor) for one page of queryset in keyset order.
+    next_cursor is None on the last page. With columns, rows are
+    values_list() tuples and every ordering field must be one of the columns.
+    """
+    limit = page_size(request)
+    cursor = request.query_params.get('cursor')
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(keyset_filter(ordering, decode_cursor(cursor, queryset.model, ordering)))
+    if columns:
+        queryset = queryset.values_list(*columns)
+
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    if columns:
+        return rows, encode_cursor([last[columns.index(field.lstrip('-'))] for field in ordering])
+    return rows, encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+
+
+def paginated_response(request, data, next_cursor):
+    response = Response(data, status=status.HTTP_200_OK)
+    if next_cursor:
+        query = request.query_params.copy()
+        query['cursor'] = next_cursor
+        response['X-Next-Cursor'] = next_cursor
+        response['Link'] = f'<{request.build_absolute_uri(request.path)}?{query.urlencode()}>; rel="next"'
+    return response
+
+
+def list_response(request, queryset, ordering, serializer_class, date_field=None):
+    """
+    Serialize one cursor page of queryset. The body stays a plain list; the
+    cursor for the next page is returned in the X-Next-Cursor and Link headers.
+    """
+    try:
+        if date_field:
+            queryset = filter_date_range(request.query_params, queryset, date_field)
+        rows, next_cursor = paginate(request, queryset, ordering, getattr(serializer_class, 'columns', None))
+    except InvalidQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = serializer_class(rows, many=True)
+    return paginated_response(request, serializer.data, next_cursor)
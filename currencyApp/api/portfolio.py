@@ -0,0 +1,158 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, Count, DecimalField, F, Q, Sum, Value, When
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ExchangeRate, PortfolioValuation, UserCurrencyAccount
+from .rates import RateFetchError, get_rate_table, rates_refreshed
+
+
+# Balances have 2 decimal places and NBP rates at most 6, so valuations are
+# kept exact at 8 places and incremental updates never drift from a recompute.
+VALUE_FIELD = DecimalField(max_digits=22, decimal_places=8)
+
+
+def stored_valuation_rates():
+    """
+    Return ({currency: bid}, rates_date) from the latest stored rate of every
+    currency younger than EXCHANGE_RATE_MAX_AGE_DAYS. PLN is always 1.
+    """
+    cutoff = timezone.localdate() - timedelta(days=settings.EXCHANGE_RATE_MAX_AGE_DAYS)
+    rates = {'PLN': Decimal(1)}
+    rates_date = None
+    rows = (
+        ExchangeRate.objects.filter(effective_date__gte=cutoff)
+        .order_by('currency', '-effective_date')
+        .values_list('currency', 'bid', 'effective_date')
+    )
+    for currency, bid, effective_date in rows:
+        if currency not in rates:
+            rates[currency] = bid
+            rates_date = max(rates_date or effective_date, effective_date)
+    return rates, rates_date
+
+
+def valuation_rates():
+    """
+    Stored valuation rates, completed from the cached NBP table for currencies
+    that have no stored rate yet.
+    """
+    rates, rates_date = stored_valuation_rates()
+    if len(rates) < len(UserCurrencyAccount.CURRENCY_CHOICES):
+        try:
+            table = get_rate_table()
+        except RateFetchError:
+            return rates, rates_date
+        for currency, (bid, _) in table.rates.items():
+            rates.setdefault(currency, bid)
+        rates_date = rates_date or date.fromisoformat(table.effective_date)
+    return rates, rates_date
+
+
+def rate_case(rates, field):
+    return Case(
+        *[When(**{field: currency}, then=Value(rate)) for currency, rate in rates.items()],
+        output_field=VALUE_FIELD,
+    )
+
+
+def revalue_portfolios(user_ids=None, rates=None, chunk_size=2000):
+    """
+    Recompute the PLN value of every account in a single aggregate query and
+    upsert the PortfolioValuation rows in chunks. Limited to user_ids if given.
+    """
+    if rates is None:
+        rates, rates_date = valuation_rates()
+    else:
+        rates, rates_date = rates
+    accounts = UserCurrencyAccount.objects.all()
+    if user_ids is not None:
+        accounts = accounts.filter(user_id__in=user_ids)
+    totals = (
+        accounts.order_by()
+        .values('user_id')
+        .annotate(
+            total=Sum(F('balance') * rate_case(rates, 'currency_code'), output_field=VALUE_FIELD),
+            unvalued=Count('pk', filter=~Q(currency_code__in=rates) & ~Q(balance=0)),
+        )
+        .values_list('user_id', 'total', 'unvalued')
+    )
+
+    now = timezone.now()
+    batch = []
+    for user_id, total, unvalued in totals.iterator(chunk_size=chunk_size):
+        batch.append(PortfolioValuation(
+            user_id=user_id,
+            total_pln=total or Decimal(0),
+            rates_date=rates_date,
+            is_stale=unvalued > 0,
+            updated_at=now,
+        ))
+        if len(batch) >= chunk_size:
+            upsert_valuations(batch)
+            batch = []
+    if batch:
+        upsert_valuations(batch)
+
+
+def upsert_valuations(valuations):
+    PortfolioValuation.objects.bulk_create(
+        valuations,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['total_pln', 'rates_date', 'is_stale', 'updated_at'],
+    )
+
+
+def apply_balance_changes(changes):
+    """
+    Fold balance deltas, given as (user_id, currency, delta), into the stored
+    valuations with one rate query and one UPDATE. Valuations priced with
+    other rates, or touched by a currency without a stored rate, are marked
+    stale instead and recomputed on the next read. Call inside the
+    transaction that changes the balances.
+    """
+    rates, rates_date = stored_valuation_rates()
+    values = {}
+    stale = set()
+    for user_id, currency, delta in changes:
+        if currency in rates:
+            values[user_id] = values.get(user_id, 0) + delta * rates[currency]
+        else:
+            stale.add(user_id)
+
+    valuations = PortfolioValuation.objects.filter(user_id__in=set(values) | stale)
+    if rates_date is None:
+        valuations.update(is_stale=True)
+        return
+
+    current = Q(rates_date=rates_date)
+    increment = Case(
+        *[When(user_id=user_id, then=Value(value)) for user_id, value in values.items()],
+        default=Value(Decimal(0)),
+        output_field=PortfolioValuation._meta.get_field('total_pln'),
+    )
+    valuations.update(
+        total_pln=Case(When(current, then=F('total_pln') + increment), default=F('total_pln')),
+        is_stale=Case(When(current & ~Q(user_id__in=stale), then=F('is_stale')), default=Value(True)),
+        updated_at=timezone.now(),
+    )
+
+
+def get_portfolio(user_id):
+    """
+    Read a user's valuation, a single row fetch unless it is missing or stale.
+    """
+    valuation = PortfolioValuation.objects.filter(user_id=user_id).first()
+    if valuation is None or valuation.is_stale:
+        revalue_portfolios([user_id])
+        valuation = PortfolioValuation.objects.filter(user_id=user_id).first()
+    return valuation
+
+
+@receiver(rates_refreshed)
+def revalue_on_rates_refresh(sender, **kwargs):
+    revalue_portfolios()
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import metrics
+from .models import ExchangeRate
+from .rates import RateFetchError, RateTable, last_good_table, parse_rate_table
+
+
+class CircuitOpenError(RateFetchError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails fast after ``failure_threshold`` consecutive failures. Once
+    ``reset_timeout`` seconds have passed a single trial call is let through:
+    success closes the circuit again, failure keeps it open for another
+    ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial = False
+
+
+class RateProvider:
+    """
+    Source of whole rate tables. ``fetch`` returns a RateTable or raises
+    RateFetchError; ``afetch`` is its async counterpart.
+    """
+
+    name = None
+    is_fallback = False
+
+    def fetch(self, table):
+        raise NotImplementedError
+
+    def save(self, table):
+        """Keep a copy of a table freshly fetched from NBP; most providers need none."""
+
+    async def afetch(self, table):
+        return await sync_to_async(self.fetch)(table)
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the pooled NBP client of the running event loop. Connections are
+    kept alive between requests and capped at NBP_MAX_CONNECTIONS; callers
+    beyond that wait for a free connection up to NBP_TIMEOUT.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.NBP_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.NBP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.NBP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.NBP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return client
+
+
+async def close_async_client():
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class NBPRateProvider(RateProvider):
+    """
+    The NBP web API. Every attempt is bounded by ``timeout``; failed attempts
+    are retried ``retries`` times with full-jitter exponential backoff, and a
+    circuit breaker skips the API entirely while it keeps failing.
+    """
+
+    name = 'nbp'
+
+    def __init__(self, url=None, timeout=None, retries=1, backoff=0.2, failure_threshold=3, reset_timeout=60):
+        self.url = url or settings.NBP_API_URL
+        self.timeout = settings.NBP_TIMEOUT if timeout is None else timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def table_url(self, table):
+        return f"{self.url}/exchangerates/tables/{table}/?format=json"
+
+    def backoff_delay(self, attempt):
+        return random.uniform(0, self.backoff * 2 ** attempt)
+
+    def check_circuit(self):
+        if not self.breaker.allow():
+            raise CircuitOpenError("NBP API is unavailable; not retrying until the circuit resets.")
+
+    def observe(self, started, outcome):
+        metrics.upstream_duration.observe(time.perf_counter() - started, self.name, outcome)
+
+    def fetch_once(self, table):
+        started = time.perf_counter()
+        try:
+            response = requests.get(self.table_url(table), timeout=self.timeout)
+            response.raise_for_status()
+            result = parse_rate_table(response.json())
+        except requests.exceptions.RequestException as e:
+            self.observe(started, 'error')
+            raise RateFetchError(f"Failed to fetch exchange rate: {str(e)}")
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.observe(started, 'invalid')
+            raise RateFetchError("Invalid response format from NBP API.")
+        self.observe(started, 'ok')
+        return result
+
+    async def afetch_once(self, table):
+        started = time.perf_counter()
+        try:
+            response = await get_async_client().get(self.table_url(table), timeout=self.timeout)
+            response.raise_for_status()
+            result = parse_rate_table(response.json())
+        except httpx.HTTPError as e:
+            self.observe(started, 'error')
+            raise RateFetchError(f"Failed to fetch exchange rate: {str(e)}")
+        except (KeyError, IndexError, TypeError, ValueError):
+            self.observe(started, 'invalid')
+            raise RateFetchError("Invalid response format from NBP API.")
+        self.observe(started, 'ok')
+        return result
+
+    def fetch(self, table):
+        self.check_circuit()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = self.fetch_once(table)
+                    break
+                except RateFetchError:
+                    if attempt == self.retries:
+                        raise
+                    time.sleep(self.backoff_delay(attempt))
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def afetch(self, table):
+        self.check_circuit()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = await self.afetch_once(table)
+                    break
+                except RateFetchError:
+                    if attempt == self.retries:
+                        raise
+                    await asyncio.sleep(self.backoff_delay(attempt))
+        except BaseException:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+class LastKnownGoodRateProvider(RateProvider):
+    """
+    The last table a primary provider returned in this process, or else the
+    most recent stored rate of every currency regardless of its age.
+    """
+
+    name = 'last-known-good'
+    is_fallback = True
+
+    def fetch(self, table):
+        result = last_good_table(table)
+        if result is not None:
+            return RateTable(result.number, result.effective_date, result.rates, fallback_source=self.name)
+
+        rates = {}
+        number = effective_date = None
+        rows = ExchangeRate.objects.order_by('currency', '-effective_date').values_list(
+            'currency', 'bid', 'ask', 'table_number', 'effective_date'
+        )
+        for currency, bid, ask, table_number, row_date in rows:
+            if currency in rates:
+                continue
+            rates[currency] = (bid, ask)
+            if effective_date is None or row_date > effective_date:
+                number, effective_date = table_number, row_date
+        if not rates:
+            raise RateFetchError("No stored exchange rates are available.")
+        return RateTable(number, effective_date.isoformat(), rates, fallback_source=self.name)
+
+
+class FileRateProvider(RateProvider):
+    """
+    A JSON file in the NBP table format, e.g. a saved copy of
+    /exchangerates/tables/c/?format=json. Useful as a last resort and as a
+    local stand-in for NBP. refresh_rates rewrites it after every successful
+    fetch; the repository ships a seed copy.
+    """
+
+    name = 'file'
+    is_fallback = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, table):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                result = parse_rate_table(json.load(f))
+        except OSError as e:
+            raise RateFetchError(f"Cannot read rate file {self.path}: {e.strerror}")
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise RateFetchError(f"Invalid rate file {self.path}.")
+        return RateTable(result.number, result.effective_date, result.rates, fallback_source=self.name)
+
+    def save(self, table):
+        payload = [{
+            "table": "C",
+            "no": table.number,
+            "effectiveDate": str(table.effective_date),
+            "rates": [
+                {"code": code, "bid": float(bid), "ask": float(ask)}
+                for code, (bid, ask) in sorted(table.rates.items())
+            ],
+        }]
+        # Write next to the file and swap it in, so readers never see half a table.
+        partial = f'{self.path}.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+        os.replace(partial, self.path)
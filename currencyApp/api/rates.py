@@ -0,0 +1,397 @@
+import asyncio
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal, receiver
+from django.utils.module_loading import import_string
+from django.utils import timezone
+
+from . import metrics
+from .models import UserCurrencyAccount, ExchangeRate
+
+
+NBP_TIMEZONE = ZoneInfo('Europe/Warsaw')
+
+rates_refreshed = Signal()
+
+
+class RateFetchError(Exception):
+    pass
+
+
+def seconds_until_next_publication(now=None):
+    """
+    NBP publishes table C once per business day, shortly after 8:00 Warsaw time.
+    Returns the number of seconds until the next expected publication.
+    """
+    now = (now or datetime.now(NBP_TIMEZONE)).astimezone(NBP_TIMEZONE)
+    hour, minute = settings.NBP_PUBLICATION_TIME
+    publication = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if publication <= now:
+        publication += timedelta(days=1)
+    while publication.weekday() >= 5:
+        publication += timedelta(days=1)
+    return (publication - now).total_seconds()
+
+
+def last_publication_date(now=None):
+    """
+    Effective date of the newest table C NBP should have published by now.
+    """
+    now = (now or datetime.now(NBP_TIMEZONE)).astimezone(NBP_TIMEZONE)
+    hour, minute = settings.NBP_PUBLICATION_TIME
+    publication = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if publication > now:
+        publication -= timedelta(days=1)
+    while publication.weekday() >= 5:
+        publication -= timedelta(days=1)
+    return publication.date()
+
+
+class RateTable:
+    """
+    Bid/ask rates for every supported currency from a single NBP table C.
+    """
+
+    __slots__ = ('number', 'effective_date', 'rates', 'fallback_source')
+
+    def __init__(self, number, effective_date, rates, fallback_source=None):
+        self.number = number
+        self.effective_date = effective_date
+        self.rates = rates
+        self.fallback_source = fallback_source
+
+    @property
+    def is_fallback(self):
+        return self.fallback_source is not None
+
+    def rate(self, currency_code, rate_type):
+        try:
+            bid, ask = self.rates[currency_code]
+        except KeyError:
+            raise RateFetchError(f"Exchange rate for {currency_code} is not available in NBP table {self.number}.")
+        return ask if rate_type == 'ask' else bid
+
+
+def supported_currencies():
+    return [code for code, _ in UserCurrencyAccount.CURRENCY_CHOICES if code != 'PLN']
+
+
+def parse_rate_table(payload):
+    data = payload[0]
+    supported = set(supported_currencies())
+    rates = {
+        rate['code']: (Decimal(str(rate['bid'])), Decimal(str(rate['ask'])))
+        for rate in data['rates']
+        if rate['code'] in supported
+    }
+    return RateTable(data['no'], data['effectiveDate'], rates)
+
+
+_rate_providers = None
+_last_good_tables = {}
+
+
+def get_rate_providers():
+    """
+    Instantiate settings.RATE_PROVIDERS, a list of (class path, options)
+    pairs in fallback order. Providers keep state such as circuit breakers,
+    so they are built once.
+    """
+    global _rate_providers
+    if _rate_providers is None:
+        _rate_providers = [import_string(path)(**options) for path, options in settings.RATE_PROVIDERS]
+    return _rate_providers
+
+
+@receiver(setting_changed)
+def reset_rate_providers(setting=None, **kwargs):
+    global _rate_providers
+    if setting in (None, 'RATE_PROVIDERS'):
+        _rate_providers = None
+        _last_good_tables.clear()
+
+
+def last_good_table(table):
+    return _last_good_tables.get(table)
+
+
+def _provider_result(provider, table, result):
+    if not provider.is_fallback:
+        _last_good_tables[table] = result
+    return result
+
+
+def _providers_failed(errors):
+    return RateFetchError("No exchange rate provider is available. " + " ".join(errors))
+
+
+def fetch_rate_table(table='c'):
+    """
+    Return the table from the first provider in RATE_PROVIDERS that succeeds.
+    Raises RateFetchError when every provider fails.
+    """
+    errors = []
+    for provider in get_rate_providers():
+        try:
+            return _provider_result(provider, table, provider.fetch(table))
+        except RateFetchError as e:
+            errors.append(f"{provider.name}: {e}")
+    raise _providers_failed(errors)
+
+
+async def afetch_rate_table(table='c'):
+    errors = []
+    for provider in get_rate_providers():
+        try:
+            return _provider_result(provider, table, await provider.afetch(table))
+        except RateFetchError as e:
+            errors.append(f"{provider.name}: {e}")
+    raise _providers_failed(errors)
+
+
+class RateCache:
+    """
+    In-process TTL cache with single-flight refresh and stale-while-revalidate.
+    Values are produced by calling ``fetch(*key)``, or by awaiting
+    ``afetch(*key)`` from ``aget``; both share the same entries.
+
+    A fresh entry is returned as is. An expired entry that is still inside the
+    stale window is returned immediately while one background thread refreshes
+    it; it is also served when the upstream fetch fails. Concurrent misses for
+    the same key wait for a single upstream fetch.
+    """
+
+    def __init__(self, fetch, afetch=None, ttl=None, stale_ttl=None, clock=time.monotonic):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.clock = clock
+        self._entries = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+        self._tasks = set()
+
+    def _ttl(self):
+        ttl = settings.NBP_RATE_CACHE_TTL if self.ttl is None else self.ttl
+        return min(ttl, seconds_until_next_publication())
+
+    def _stale_ttl(self):
+        return settings.NBP_RATE_STALE_TTL if self.stale_ttl is None else self.stale_ttl
+
+    def _lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _store(self, key, value):
+        now = self.clock()
+        # Fallback values are retried soon, so a recovered upstream is picked up quickly.
+        ttl = min(self._ttl(), settings.RATE_FALLBACK_TTL) if getattr(value, 'is_fallback', False) else self._ttl()
+        fresh_until = now + ttl
+        self._entries[key] = (value, fresh_until, fresh_until + self._stale_ttl())
+        return value
+
+    def _refresh(self, key, lock):
+        try:
+            self._store(key, self.fetch(*key))
+        except RateFetchError:
+            pass
+        finally:
+            lock.release()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry and now < entry[1]:
+            metrics.rate_cache_requests.inc('hit')
+            return entry[0]
+
+        lock = self._lock_for(key)
+        if entry and now < entry[2]:
+            metrics.rate_cache_requests.inc('stale')
+            if lock.acquire(blocking=False):
+                threading.Thread(target=self._refresh, args=(key, lock), daemon=True).start()
+            return entry[0]
+
+        metrics.rate_cache_requests.inc('miss')
+        with lock:
+            entry = self._entries.get(key)
+            if entry and self.clock() < entry[1]:
+                return entry[0]
+            try:
+                return self._store(key, self.fetch(*key))
+            except RateFetchError:
+                if entry and self.clock() < entry[2]:
+                    return entry[0]
+                raise
+
+    def _async_lock_for(self, key):
+        loop = asyncio.get_running_loop()
+        with self._guard:
+            return self._async_locks.setdefault(loop, {}).setdefault(key, asyncio.Lock())
+
+    async def _arefresh(self, key, lock):
+        async with lock:
+            entry = self._entries.get(key)
+            if entry and self.clock() < entry[1]:
+                return
+            try:
+                self._store(key, await self.afetch(*key))
+            except RateFetchError:
+                pass
+
+    async def aget(self, key):
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry and now < entry[1]:
+            metrics.rate_cache_requests.inc('hit')
+            return entry[0]
+
+        lock = self._async_lock_for(key)
+        if entry and now < entry[2]:
+            metrics.rate_cache_requests.inc('stale')
+            if not lock.locked():
+                task = asyncio.get_running_loop().create_task(self._arefresh(key, lock))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return entry[0]
+
+        metrics.rate_cache_requests.inc('miss')
+        async with lock:
+            entry = self._entries.get(key)
+            if entry and self.clock() < entry[1]:
+                return entry[0]
+            try:
+                return self._store(key, await self.afetch(*key))
+            except RateFetchError:
+                if entry and self.clock() < entry[2]:
+                    return entry[0]
+                raise
+
+    def fresh_for(self, key):
+        """
+        Seconds the cached entry for key stays fresh, 0 if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0
+        return max(0, entry[1] - self.clock())
+
+    def refresh(self, key):
+        with self._lock_for(key):
+            return self._store(key, self.fetch(*key))
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+rate_cache = RateCache(fetch_rate_table, afetch_rate_table)
+
+RATE_TABLE_KEY = ('c',)
+
+
+def get_rate_table():
+    return rate_cache.get(RATE_TABLE_KEY)
+
+
+async def aget_rate_table():
+    return await rate_cache.aget(RATE_TABLE_KEY)
+
+
+def rate_table_max_age():
+    return int(rate_cache.fresh_for(RATE_TABLE_KEY))
+
+
+def rate_table_etag(table):
+    """
+    Strong ETag of a table; fallback tables get their own tag so clients pick
+    up the real table once NBP is back.
+    """
+    if table.is_fallback:
+        return f'"{table.number}+{table.fallback_source}"'
+    return f'"{table.number}"'
+
+
+def rate_table_last_modified(table):
+    """
+    Publication time of the table as a Unix timestamp.
+    """
+    hour, minute = settings.NBP_PUBLICATION_TIME
+    effective_date = datetime.strptime(table.effective_date, '%Y-%m-%d')
+    return int(effective_date.replace(hour=hour, minute=minute, tzinfo=NBP_TIMEZONE).timestamp())
+
+
+def rate_table_payload(table):
+    return {
+        "table": table.number,
+        "effective_date": table.effective_date,
+        "source": table.fallback_source or "nbp",
+        "rates": {code: {"bid": str(bid), "ask": str(ask)} for code, (bid, ask) in sorted(table.rates.items())},
+    }
+
+
+def store_rate_table(table):
+    ExchangeRate.objects.bulk_create(
+        [
+            ExchangeRate(
+                currency=code,
+                bid=bid,
+                ask=ask,
+                table_number=table.number,
+                effective_date=table.effective_date,
+            )
+            for code, (bid, ask) in table.rates.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['currency', 'effective_date'],
+        update_fields=['bid', 'ask', 'table_number', 'fetched_at'],
+    )
+
+
+def refresh_rate_table():
+    table = rate_cache.refresh(RATE_TABLE_KEY)
+    if table.is_fallback:
+        raise RateFetchError(f"NBP is unavailable; serving {table.fallback_source} rates from table {table.number}.")
+    store_rate_table(table)
+    rates_refreshed.send(sender=RateTable, table=table)
+    return table
+
+
+def save_rate_table(table):
+    """
+    Hand a table fetched from NBP to every provider that keeps a copy, such
+    as the rates_fallback.json of FileRateProvider.
+    """
+    for provider in get_rate_providers():
+        provider.save(table)
+
+
+def latest_stored_rate(currency_code, rate_type):
+    """
+    Return the most recent ingested rate, or None if there is no rate younger
+    than EXCHANGE_RATE_MAX_AGE_DAYS.
+    """
+    field = 'ask' if rate_type == 'ask' else 'bid'
+    row = (
+        ExchangeRate.objects.filter(currency=currency_code)
+        .order_by('-effective_date')
+        .values_list(field, 'effective_date')
+        .first()
+    )
+    if row is None:
+        return None
+    rate, effective_date = row
+    if (timezone.localdate() - effective_date).days > settings.EXCHANGE_RATE_MAX_AGE_DAYS:
+        return None
+    return rate
@@ -0,0 +1,131 @@
+from decimal import Decimal
+
+from django.db import connection, transaction as db_transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .bulk import chunked
+from .models import CENTS, AccountHistory, DailyHistoryRollup, UserCurrencyAccount
+
+
+def rollup_deltas(histories):
+    """
+    Group AccountHistory rows into {(user_id, currency, day): [income, expense, count]}.
+    Days are local dates of created_at, matching TruncDate in rebuild_rollups.
+    """
+    deltas = {}
+    for history in histories:
+        key = (history.user_id, history.currency, timezone.localdate(history.created_at))
+        delta = deltas.setdefault(key, [Decimal(0), Decimal(0), 0])
+        delta[0 if history.action == 'income' else 1] += history.amount
+        delta[2] += 1
+    return deltas
+
+
+def apply_history_rollups(histories):
+    """
+    Add freshly written AccountHistory rows to their daily rollups with a single
+    INSERT ... ON CONFLICT DO UPDATE, so concurrent writers never lose an
+    increment. Must be called after the rows have been saved.
+    """
+    upsert_rollups(rollup_deltas(histories), replace=False)
+
+
+def upsert_rollups(rollups, replace):
+    """
+    Write {(user_id, currency, day): [income, expense, count]} in one
+    INSERT ... ON CONFLICT DO UPDATE, adding to existing rows or, with replace,
+    overwriting them.
+    """
+    if not rollups:
+        return
+
+    ops = connection.ops
+    table = ops.quote_name(DailyHistoryRollup._meta.db_table)
+    amount_field = DailyHistoryRollup._meta.get_field('income')
+    params = []
+    for (user_id, currency, day), (income, expense, count) in rollups.items():
+        params += [
+            user_id,
+            currency,
+            ops.adapt_datefield_value(day),
+            ops.adapt_decimalfield_value(income, amount_field.max_digits, amount_field.decimal_places),
+            ops.adapt_decimalfield_value(expense, amount_field.max_digits, amount_field.decimal_places),
+            count,
+        ]
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(rollups))
+    if replace:
+        updates = ', '.join(f'{column} = excluded.{column}' for column in ('income', 'expense', 'count'))
+    else:
+        updates = ', '.join(f'{column} = {table}.{column} + excluded.{column}' for column in ('income', 'expense', 'count'))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, currency, day, income, expense, count) VALUES {values} '
+            f'ON CONFLICT (user_id, currency, day) DO UPDATE SET {updates}',
+            params,
+        )
+
+
+def rebuild_rollups(user_ids):
+    """
+    Recompute the rollups of the given users from AccountHistory in one
+    aggregate query and overwrite their rows with the totals. Returns the
+    number of rollup rows written.
+
+    The users' accounts are locked first, the same locks conversions hold
+    while writing history and incrementing rollups, so the aggregate sees
+    every committed row and no increment lands between it and the write.
+    Totals replace the stored values rather than adding to them, and days
+    left without history are deleted.
+    """
+    with db_transaction.atomic():
+        list(
+            UserCurrencyAccount.objects.select_for_update()
+            .filter(user_id__in=user_ids)
+            .order_by('account_id')
+            .values_list('pk', flat=True)
+        )
+        rows = (
+            AccountHistory.objects.filter(user_id__in=user_ids)
+            .annotate(day=TruncDate('created_at'))
+            .order_by()
+            .values('user_id', 'currency', 'day')
+            .annotate(
+                income=Sum('amount', filter=Q(action='income')),
+                expense=Sum('amount', filter=Q(action='expense')),
+                count=Count('pk'),
+            )
+        )
+        totals = {
+            (row['user_id'], row['currency'], row['day']): (row['income'] or Decimal(0), row['expense'] or Decimal(0), row['count'])
+            for row in rows
+        }
+        stale = DailyHistoryRollup.objects.filter(user_id__in=user_ids).values_list('pk', 'user_id', 'currency', 'day')
+        DailyHistoryRollup.objects.filter(
+            pk__in=[pk for pk, *key in stale if tuple(key) not in totals]
+        ).delete()
+        for batch in chunked(totals.items(), 1000):
+            upsert_rollups(dict(batch), replace=True)
+    return len(totals)
+
+
+def history_summary(rollups):
+    """
+    Total income, expense, net and count per currency over a rollup queryset.
+    """
+    totals = (
+        rollups.order_by('currency')
+        .values('currency')
+        .annotate(income=Sum('income'), expense=Sum('expense'), count=Sum('count'))
+    )
+    return [
+        {
+            'currency': row['currency'],
+            'income': format(row['income'].quantize(CENTS), 'f'),
+            'expense': format(row['expense'].quantize(CENTS), 'f'),
+            'net': format((row['income'] - row['expense']).quantize(CENTS), 'f'),
+            'count': row['count'],
+        }
+        for row in totals
+    ]
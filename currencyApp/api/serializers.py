@@ -1,10 +1,10 @@
 from rest_framework import serializers
-from .models import User, UserCurrencyAccount, Transaction, DepositHistory, AccountHistory
+from .models import User, UserCurrencyAccount, Transaction, DepositHistory, AccountHistory, PortfolioValuation, DailyHistoryRollup
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = '__all__'
+        exclude = ['accounts_version']
 
 
 class UserCurrencyAccountSerializer(serializers.ModelSerializer):
@@ -13,6 +13,14 @@ class UserCurrencyAccountSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class PortfolioValuationSerializer(serializers.ModelSerializer):
+    total_pln = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = PortfolioValuation
+        fields = ['user', 'total_pln', 'rates_date', 'is_stale', 'updated_at']
+
+
 class TransactionSerializer(serializers.ModelSerializer):
     created_at = serializers.SerializerMethodField()
 
@@ -48,4 +56,99 @@ class AccountHistorySerializer(serializers.ModelSerializer):
         fields = ['history_id', 'currency', 'action', 'amount', 'user', 'created_at']
     
     def get_created_at(self, obj):
-        return obj.created_at.strftime('%d-%m-%Y %H:%M:%S')
\ No newline at end of file
+        return obj.created_at.strftime('%d-%m-%Y %H:%M:%S')
+
+
+def format_datetime(value):
+    return (
+        f"{value.day:02d}-{value.month:02d}-{value.year:04d} "
+        f"{value.hour:02d}:{value.minute:02d}:{value.second:02d}"
+    )
+
+
+class RowSerializer:
+    """
+    Read-only serializer over values_list() tuples for the history endpoints.
+    Produces exactly the same data as the matching ModelSerializer without
+    instantiating models or running per-field serializer methods.
+    Subclasses define ``columns`` (the values_list lookups), ``fields`` (the
+    output keys) and ``to_row``.
+    """
+
+    columns = ()
+    fields = ()
+
+    def __init__(self, rows, many=True):
+        self.rows = rows
+
+    @property
+    def data(self):
+        to_row = self.to_row
+        return [to_row(row) for row in self.rows]
+
+
+class TransactionRowSerializer(RowSerializer):
+    columns = ('transaction_id', 'from_currency', 'to_currency', 'amount', 'user_id', 'created_at')
+    fields = ('transaction_id', 'from_currency', 'to_currency', 'amount', 'user', 'created_at')
+
+    @staticmethod
+    def to_row(row):
+        transaction_id, from_currency, to_currency, amount, user_id, created_at = row
+        return {
+            'transaction_id': transaction_id,
+            'from_currency': from_currency,
+            'to_currency': to_currency,
+            'amount': format(amount, 'f'),
+            'user': user_id,
+            'created_at': format_datetime(created_at),
+        }
+
+
+class DepositHistoryRowSerializer(RowSerializer):
+    columns = ('deposit_id', 'amount', 'created_at', 'user_id', 'user_currency_account__currency_code')
+    fields = ('deposit_id', 'amount', 'created_at', 'user', 'currency_code')
+
+    @staticmethod
+    def to_row(row):
+        deposit_id, amount, created_at, user_id, currency_code = row
+        return {
+            'deposit_id': deposit_id,
+            'amount': format(amount, 'f'),
+            'created_at': format_datetime(created_at),
+            'user': user_id,
+            'currency_code': currency_code,
+        }
+
+
+class AccountHistoryRowSerializer(RowSerializer):
+    columns = ('history_id', 'currency', 'action', 'amount', 'user_id', 'created_at')
+    fields = ('history_id', 'currency', 'action', 'amount', 'user', 'created_at')
+
+    @staticmethod
+    def to_row(row):
+        history_id, currency, action, amount, user_id, created_at = row
+        return {
+            'history_id': history_id,
+            'currency': currency,
+            'action': action,
+            'amount': format(amount, 'f'),
+            'user': user_id,
+            'created_at': format_datetime(created_at),
+        }
+
+
+class DailyHistoryRollupRowSerializer(RowSerializer):
+    columns = ('rollup_id', 'day', 'currency', 'income', 'expense', 'count')
+    fields = ('day', 'currency', 'income', 'expense', 'net', 'count')
+
+    @staticmethod
+    def to_row(row):
+        _, day, currency, income, expense, count = row
+        return {
+            'day': day.isoformat(),
+            'currency': currency,
+            'income': format(income, 'f'),
+            'expense': format(expense, 'f'),
+            'net': format(income - expense, 'f'),
+            'count': count,
+        }
@@ -1,11 +1,125 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+import httpx
+import requests
+from django.contrib.auth.models import User as AuthUser
+from django.core.cache import caches
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, transaction
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from django.contrib.auth.hashers import make_password
-from .models import User, UserCurrencyAccount, DepositHistory, AccountHistory
+from rest_framework.renderers import JSONRenderer
+from django.contrib.auth.hashers import make_password, check_password
+from .models import (User, UserCurrencyAccount, DepositHistory, AccountHistory, ExchangeRate, Transaction,
+                     PortfolioValuation, DailyHistoryRollup, NumberSequence, account_numbers,
+                     format_account_number, luhn_check_digit, IdempotencyRecord, LedgerCheckpoint, LedgerEntry
+)
+from .rates import (RateCache, RateFetchError, NBP_TIMEZONE, seconds_until_next_publication,
+                    fetch_rate_table, rate_cache, refresh_rate_table, aget_rate_table, reset_rate_providers,
+                    supported_currencies, last_publication_date, RATE_TABLE_KEY
+)
+from .providers import (CircuitBreaker, CircuitOpenError, NBPRateProvider, FileRateProvider,
+                        get_async_client, close_async_client
+)
+from .exports import export_rows, stream_export
+from .utils import get_exchange_rate, aconvert_currency, convert_currency, deposit_to_account
+from .portfolio import stored_valuation_rates
+from .bulk import apply_deposits
+from .rollups import rebuild_rollups
+from .idempotency import claim
+from .ledger import UnbalancedPosting, checkpoint_accounts, deposit_legs, ledger_balance, post
+from .onboarding import hash_passwords, hash_pool, onboard_users
+from .hashing import HashingBusy, HashingLimiter, get_hashing_limiter
+from .validation import validate_user, validate_users
+from . import metrics
+from .middleware import RequestMetricsMiddleware
+from .serializers import (TransactionSerializer, DepositHistorySerializer, AccountHistorySerializer,
+                          TransactionRowSerializer, DepositHistoryRowSerializer, AccountHistoryRowSerializer
+)
 
-class CurrencyAppAPITests(APITestCase):
+
+NBP_TABLE_C = [{
+    "table": "C",
+    "no": "236/C/NBP/2024",
+    "tradingDate": "2024-12-05",
+    "effectiveDate": "2024-12-06",
+    "rates": [
+        {"currency": "dolar amerykański", "code": "USD", "bid": 4.0123, "ask": 4.0933},
+        {"currency": "euro", "code": "EUR", "bid": 4.2312, "ask": 4.3166},
+        {"currency": "jen (Japonia)", "code": "JPY", "bid": 0.026701, "ask": 0.027241},
+        {"currency": "funt szterling", "code": "GBP", "bid": 5.1034, "ask": 5.2064},
+        {"currency": "dolar australijski", "code": "AUD", "bid": 2.5702, "ask": 2.6222},
+        {"currency": "dolar kanadyjski", "code": "CAD", "bid": 2.8511, "ask": 2.9087},
+        {"currency": "frank szwajcarski", "code": "CHF", "bid": 4.5401, "ask": 4.6319},
+        {"currency": "korona szwedzka", "code": "SEK", "bid": 0.3678, "ask": 0.3752},
+        {"currency": "korona czeska", "code": "CZK", "bid": 0.1685, "ask": 0.1719},
+    ],
+}]
+
+
+def mock_nbp_response(payload=NBP_TABLE_C):
+    response = mock.Mock()
+    response.json.return_value = payload
+    response.raise_for_status.return_value = None
+    return response
+
+
+_phone_numbers = itertools.count(123400000)
+
+
+def create_user(username, password="Test@1234", **fields):
+    """Create a User called username, filling in the other required fields unless given."""
+    fields.setdefault("first_name", username.capitalize())
+    fields.setdefault("last_name", "User")
+    fields.setdefault("phone_number", f"+48{next(_phone_numbers)}")
+    fields.setdefault("email", f"{username}@example.com")
+    return User.objects.create(username=username, password=make_password(password), **fields)
+
+
+def with_rate_file(path):
+    """The configured RATE_PROVIDERS with FileRateProvider reading and writing path."""
+    return [
+        (provider, dict(options, path=path) if provider.endswith(".FileRateProvider") else options)
+        for provider, options in settings.RATE_PROVIDERS
+    ]
+
+
+class NBPMockMixin:
     def setUp(self):
+        rate_cache.invalidate()
+        reset_rate_providers()
+        patcher = mock.patch("api.providers.requests.get", return_value=mock_nbp_response())
+        self.nbp_get = patcher.start()
+        self.addCleanup(patcher.stop)
+        backoff = mock.patch.object(NBPRateProvider, "backoff_delay", return_value=0)
+        backoff.start()
+        self.addCleanup(backoff.stop)
+        self.addCleanup(rate_cache.invalidate)
+        self.addCleanup(reset_rate_providers)
+        super().setUp()
+
+class CurrencyAppAPITests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
         self.user = User.objects.create(
             username="testuser",
             password=make_password("Test@1234"),
@@ -81,6 +195,20 @@ class CurrencyAppAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data["error"], "Insufficient balance in USD account.")
 
+    def test_conversion_amount_must_be_positive_and_finite(self):
+        for amount, error in [
+            ("-100", "Conversion amount must be greater than zero."),
+            ("0.001", "Conversion amount must be greater than zero."),
+            ("nan", "Invalid amount"),
+            ("Infinity", "Invalid amount"),
+            ("ten", "Invalid amount"),
+        ]:
+            response = self.client.post(self.convert_url, {"from_currency": "PLN", "to_currency": "USD", "amount": amount})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, amount)
+            self.assertEqual(response.data["error"], error)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(self.user.currency_accounts.filter(balance__lt=0).exists())
+
     def test_get_deposit_history(self):
         DepositHistory.objects.create(
             user=self.user,
@@ -102,3 +230,1641 @@ class CurrencyAppAPITests(APITestCase):
         response = self.client.get(history_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertGreater(len(response.data), 0)
+
+
+class RateCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.calls = []
+
+    def fetch(self, currency_code, rate_type):
+        self.calls.append((currency_code, rate_type))
+        return Decimal("4.0")
+
+    def make_cache(self, fetch=None):
+        return RateCache(fetch or self.fetch, ttl=60, stale_ttl=120, clock=lambda: self.now)
+
+    def test_fresh_entry_is_served_from_cache(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.get(("USD", "ask")), Decimal("4.0"))
+        self.assertEqual(cache.get(("USD", "ask")), Decimal("4.0"))
+        self.assertEqual(self.calls, [("USD", "ask")])
+
+    def test_stale_entry_is_served_when_upstream_fails(self):
+        def failing_fetch(currency_code, rate_type):
+            raise RateFetchError("Failed to fetch exchange rate: timeout")
+
+        cache = self.make_cache()
+        cache.get(("USD", "ask"))
+        cache.fetch = failing_fetch
+        self.now = 90.0
+        cache._lock_for(("USD", "ask")).acquire()
+        self.assertEqual(cache.get(("USD", "ask")), Decimal("4.0"))
+
+        self.now = 500.0
+        cache._lock_for(("USD", "ask")).release()
+        with self.assertRaises(RateFetchError):
+            cache.get(("USD", "ask"))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        started = threading.Event()
+
+        def slow_fetch(currency_code, rate_type):
+            started.set()
+            time.sleep(0.05)
+            return self.fetch(currency_code, rate_type)
+
+        cache = self.make_cache(slow_fetch)
+        threads = [threading.Thread(target=cache.get, args=(("EUR", "bid"),)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, [("EUR", "bid")])
+
+    def test_ttl_ends_at_next_publication(self):
+        before = datetime(2024, 12, 6, 7, 0, tzinfo=NBP_TIMEZONE)
+        self.assertEqual(seconds_until_next_publication(before), 75 * 60)
+        friday_after = datetime(2024, 12, 6, 9, 15, tzinfo=NBP_TIMEZONE)
+        self.assertEqual(seconds_until_next_publication(friday_after), (3 * 24 - 1) * 60 * 60)
+
+    def test_last_publication_date_skips_weekends(self):
+        monday_before = datetime(2024, 12, 9, 8, 0, tzinfo=NBP_TIMEZONE)
+        self.assertEqual(last_publication_date(monday_before), datetime(2024, 12, 6).date())
+        monday_after = datetime(2024, 12, 9, 8, 15, tzinfo=NBP_TIMEZONE)
+        self.assertEqual(last_publication_date(monday_after), datetime(2024, 12, 9).date())
+
+
+class RateTableTests(NBPMockMixin, TestCase):
+    def test_table_keeps_only_supported_currencies(self):
+        table = fetch_rate_table()
+        self.assertEqual(table.number, "236/C/NBP/2024")
+        self.assertEqual(table.rates["USD"], (Decimal("4.0123"), Decimal("4.0933")))
+        self.assertNotIn("CZK", table.rates)
+        self.assertEqual(len(table.rates), 8)
+
+    def test_rates_for_all_currencies_cost_one_request(self):
+        self.assertEqual(get_exchange_rate("USD", "ask"), Decimal("4.0933"))
+        self.assertEqual(get_exchange_rate("EUR", "bid"), Decimal("4.2312"))
+        self.assertEqual(get_exchange_rate("JPY", "ask"), Decimal("0.027241"))
+        self.nbp_get.assert_called_once()
+        self.assertIn("/exchangerates/tables/c/", self.nbp_get.call_args.args[0])
+
+    @override_settings(RATE_PROVIDERS=with_rate_file(os.devnull))
+    def test_invalid_payload_is_reported(self):
+        self.nbp_get.return_value = mock_nbp_response([{"rates": []}])
+        with self.assertRaises(RateFetchError):
+            fetch_rate_table()
+
+    def test_refresh_loop_polls_until_the_expected_table_appears(self):
+        delays = []
+
+        def sleep(seconds):
+            delays.append(seconds)
+            if len(delays) == 1:
+                self.nbp_get.return_value = mock_nbp_response([dict(NBP_TABLE_C[0], effectiveDate="2024-12-09")])
+            else:
+                raise KeyboardInterrupt
+
+        command = "api.management.commands.refresh_rates"
+        rate_file = os.path.join(tempfile.mkdtemp(), "rates.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(rate_file))
+        with override_settings(RATE_PROVIDERS=with_rate_file(rate_file)), \
+                mock.patch(f"{command}.last_publication_date", return_value=datetime(2024, 12, 9).date()), \
+                mock.patch(f"{command}.seconds_until_next_publication", return_value=3600), \
+                mock.patch(f"{command}.time.sleep", side_effect=sleep), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command("refresh_rates", "--loop", "--retry-interval", "60", stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(delays, [60, 3600])
+        self.assertTrue(ExchangeRate.objects.filter(effective_date="2024-12-09").exists())
+
+
+class RateProviderTests(NBPMockMixin, TestCase):
+    def nbp_down(self):
+        self.nbp_get.return_value = None
+        self.nbp_get.side_effect = requests.exceptions.ConnectionError("connection refused")
+
+    def test_retries_transient_failures(self):
+        self.nbp_get.side_effect = [requests.exceptions.ConnectionError("reset"), mock_nbp_response()]
+        table = fetch_rate_table()
+        self.assertFalse(table.is_fallback)
+        self.assertEqual(self.nbp_get.call_count, 2)
+        self.assertEqual(self.nbp_get.call_args.kwargs["timeout"], 5)
+
+    def test_circuit_breaker_fails_fast_then_probes(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        now[0] = 30.0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        now[0] = 60.0
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+    def test_open_circuit_skips_nbp(self):
+        self.nbp_down()
+        provider = NBPRateProvider(retries=0, failure_threshold=1)
+        with self.assertRaises(RateFetchError):
+            provider.fetch("c")
+        with self.assertRaises(CircuitOpenError):
+            provider.fetch("c")
+        self.assertEqual(self.nbp_get.call_count, 1)
+
+    def test_falls_back_to_last_known_good_table(self):
+        fetch_rate_table()
+        self.nbp_down()
+        table = fetch_rate_table()
+        self.assertEqual(table.fallback_source, "last-known-good")
+        self.assertEqual(table.rates["USD"], (Decimal("4.0123"), Decimal("4.0933")))
+
+    def test_falls_back_to_old_stored_rates(self):
+        ExchangeRate.objects.create(
+            currency="USD", bid=Decimal("3.9000"), ask=Decimal("3.9800"),
+            table_number="1/C/NBP/2020", effective_date=datetime(2020, 1, 2).date(),
+        )
+        self.nbp_down()
+        self.assertEqual(get_exchange_rate("USD", "ask"), Decimal("3.9800"))
+
+    def test_falls_back_to_rate_file(self):
+        self.nbp_down()
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump(NBP_TABLE_C, f)
+        self.addCleanup(os.remove, f.name)
+        providers = [
+            ("api.providers.NBPRateProvider", {"retries": 0}),
+            ("api.providers.LastKnownGoodRateProvider", {}),
+            ("api.providers.FileRateProvider", {"path": f.name}),
+        ]
+        with override_settings(RATE_PROVIDERS=providers):
+            table = fetch_rate_table()
+            self.assertEqual(table.fallback_source, "file")
+            with self.assertRaises(RateFetchError):
+                refresh_rate_table()
+        self.assertFalse(ExchangeRate.objects.exists())
+
+    def test_configured_chain_falls_back_to_shipped_rate_file(self):
+        self.nbp_down()
+        table = fetch_rate_table()
+        self.assertEqual(table.fallback_source, "file")
+        self.assertEqual(set(table.rates), set(supported_currencies()))
+
+    def test_refresh_rates_saves_the_rate_file(self):
+        rate_file = os.path.join(tempfile.mkdtemp(), "rates.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(rate_file))
+        with override_settings(RATE_PROVIDERS=with_rate_file(rate_file)):
+            call_command("refresh_rates", stdout=io.StringIO())
+        table = FileRateProvider(rate_file).fetch(RATE_TABLE_KEY)
+        self.assertEqual(table.fallback_source, "file")
+        self.assertEqual(table.number, "236/C/NBP/2024")
+        self.assertEqual(table.rates["JPY"], (Decimal("0.026701"), Decimal("0.027241")))
+
+    @override_settings(RATE_PROVIDERS=with_rate_file(os.devnull))
+    def test_outage_without_fallback_is_service_unavailable(self):
+        self.nbp_down()
+        response = get_exchange_rate("USD", "ask")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("nbp: Failed to fetch exchange rate", response.data["error"])
+
+
+class ExchangeRateIngestionTests(NBPMockMixin, TestCase):
+    def test_refresh_stores_one_row_per_currency(self):
+        refresh_rate_table()
+        refresh_rate_table()
+        self.assertEqual(ExchangeRate.objects.count(), 8)
+        usd = ExchangeRate.objects.get(currency="USD")
+        self.assertEqual(usd.ask, Decimal("4.0933"))
+        self.assertEqual(usd.table_number, "236/C/NBP/2024")
+
+    def test_conversions_use_the_rate_the_rates_endpoint_shows(self):
+        ExchangeRate.objects.create(
+            currency="USD", bid=Decimal("3.9"), ask=Decimal("4.1"),
+            table_number="1/C/NBP/2025", effective_date=timezone.localdate(),
+        )
+        self.assertEqual(get_exchange_rate("USD", "ask"), Decimal("4.0933"))
+        listed = self.client.get(reverse("rates")).json()
+        self.assertEqual(Decimal(listed["rates"]["USD"]["ask"]), Decimal("4.0933"))
+
+    @override_settings(RATE_PROVIDERS=[("api.providers.NBPRateProvider", {"retries": 0})])
+    def test_stored_rate_is_used_when_no_provider_answers(self):
+        ExchangeRate.objects.create(
+            currency="USD", bid=Decimal("3.9"), ask=Decimal("4.1"),
+            table_number="1/C/NBP/2025", effective_date=timezone.localdate(),
+        )
+        self.nbp_get.side_effect = requests.exceptions.ConnectionError("down")
+        self.assertEqual(get_exchange_rate("USD", "ask"), Decimal("4.1"))
+
+    def test_outdated_stored_rate_falls_back_to_nbp(self):
+        ExchangeRate.objects.create(
+            currency="USD", bid=Decimal("3.9"), ask=Decimal("4.1"),
+            table_number="1/C/NBP/2024", effective_date="2024-01-02",
+        )
+        self.assertEqual(get_exchange_rate("USD", "ask"), Decimal("4.0933"))
+
+
+class ConvertCurrencyTests(NBPMockMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("converter")
+        self.pln = self.user.currency_accounts.get(currency_code="PLN")
+        self.pln.balance = Decimal("1000.00")
+        self.pln.save()
+        self.usd = UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("50.00"))
+        table = dict(NBP_TABLE_C[0], rates=[{"currency": "dolar amerykański", "code": "USD", "bid": 4.0, "ask": 4.1}])
+        self.nbp_get.return_value = mock_nbp_response([table])
+
+    def test_pln_to_foreign_uses_ask_rate(self):
+        response = convert_currency(self.user, "PLN", "USD", 100)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.pln.refresh_from_db()
+        self.usd.refresh_from_db()
+        self.assertEqual(self.pln.balance, Decimal("590.00"))
+        self.assertEqual(self.usd.balance, Decimal("150.00"))
+        self.assertEqual(
+            list(AccountHistory.objects.filter(user=self.user).order_by("history_id").values_list("currency", "amount", "action")),
+            [("PLN", Decimal("410.00"), "expense"), ("USD", Decimal("100.00"), "income")],
+        )
+
+    def test_insufficient_balance_leaves_accounts_untouched(self):
+        response = convert_currency(self.user, "USD", "PLN", 50.01)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.usd.refresh_from_db()
+        self.pln.refresh_from_db()
+        self.assertEqual(self.usd.balance, Decimal("50.00"))
+        self.assertEqual(self.pln.balance, Decimal("1000.00"))
+        self.assertFalse(AccountHistory.objects.filter(user=self.user).exists())
+
+    def test_sequential_debits_never_overdraw(self):
+        for _ in range(3):
+            convert_currency(self.user, "USD", "PLN", 20)
+        self.usd.refresh_from_db()
+        self.assertEqual(self.usd.balance, Decimal("10.00"))
+        self.assertEqual(AccountHistory.objects.filter(user=self.user, action="expense").count(), 2)
+
+    def test_conversion_query_count(self):
+        # lock, debit, credit, accounts version bump, ledger, valuation rates
+        # and update, history, rollup upsert, transaction + savepoint pair
+        with self.assertNumQueries(12):
+            convert_currency(self.user, "USD", "PLN", 10)
+
+
+class ConvertCurrencyBatchTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("treasury")
+        self.user.currency_accounts.filter(currency_code="PLN").update(balance=Decimal("1000.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("10.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="EUR", balance=Decimal("0.00"))
+        refresh_rate_table()
+        self.url = reverse("convert-currency-batch", kwargs={"user_id": self.user.user_id})
+
+    def balances(self):
+        return dict(self.user.currency_accounts.values_list("currency_code", "balance"))
+
+    def test_batch_applies_all_conversions(self):
+        data = {"conversions": [
+            {"from_currency": "PLN", "to_currency": "USD", "amount": "10"},
+            {"from_currency": "PLN", "to_currency": "EUR", "amount": "20"},
+            {"from_currency": "USD", "to_currency": "PLN", "amount": "15"},
+        ]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertTrue(all("transaction_id" in result for result in response.data["results"]))
+        self.assertEqual(self.balances(), {
+            "PLN": Decimal("1000.00") - Decimal("40.93") - Decimal("86.33") + Decimal("60.18"),
+            "USD": Decimal("5.00"),
+            "EUR": Decimal("20.00"),
+        })
+        self.assertEqual(AccountHistory.objects.filter(user=self.user).count(), 6)
+
+    def test_failed_item_rolls_back_whole_batch(self):
+        data = {"conversions": [
+            {"from_currency": "PLN", "to_currency": "USD", "amount": "10"},
+            {"from_currency": "EUR", "to_currency": "PLN", "amount": "5"},
+        ]}
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["results"][1]["error"], "Insufficient balance in EUR account.")
+        self.assertNotIn("error", response.data["results"][0])
+        self.assertEqual(self.balances()["PLN"], Decimal("1000.00"))
+        self.assertFalse(AccountHistory.objects.filter(user=self.user).exists())
+
+    def test_batch_query_count_does_not_grow_with_items(self):
+        data = {"conversions": [{"from_currency": "PLN", "to_currency": "USD", "amount": "1"}] * 20}
+        # user, lock, balances, accounts version bump, ledger, valuation rates
+        # and update, history, rollup upsert, transactions + savepoint pair
+        with self.assertNumQueries(12):
+            response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class BulkDepositTests(APITestCase):
+    def setUp(self):
+        self.users = [
+            create_user(f"payroll{i}")
+            for i in range(3)
+        ]
+        UserCurrencyAccount.objects.create(user=self.users[0], currency_code="EUR")
+        self.url = reverse("deposit-bulk")
+
+    def balance(self, user, currency_code="PLN"):
+        return user.currency_accounts.get(currency_code=currency_code).balance
+
+    def test_deposits_are_aggregated_per_account(self):
+        deposits = [
+            {"user_id": user.user_id, "currency_code": "PLN", "amount": "10.50"}
+            for user in self.users for _ in range(4)
+        ]
+        deposits.append({"user_id": self.users[0].user_id, "currency_code": "EUR", "amount": "5"})
+        response = self.client.post(self.url, {"deposits": deposits}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["applied"], 13)
+        self.assertEqual(self.balance(self.users[1]), Decimal("42.00"))
+        self.assertEqual(self.balance(self.users[0], "EUR"), Decimal("5.00"))
+        self.assertEqual(DepositHistory.objects.count(), 13)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        deposits = [
+            {"user_id": self.users[0].user_id, "currency_code": "PLN", "amount": "-1"},
+            {"user_id": self.users[0].user_id, "currency_code": "USD", "amount": "1"},
+            {"user_id": self.users[0].user_id, "currency_code": "PLN", "amount": "1"},
+            {"user_id": self.users[0].user_id, "currency_code": "PLN", "amount": "0.001"},
+        ]
+        response = self.client.post(self.url, {"deposits": deposits}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["applied"], 1)
+        self.assertEqual(sorted(error["row"] for error in response.data["errors"]), [0, 1, 3])
+        self.assertEqual(self.balance(self.users[0]), Decimal("1.00"))
+        self.assertEqual(DepositHistory.objects.count(), 1)
+
+    @override_settings(MAX_BULK_DEPOSITS=2)
+    def test_oversized_loads_are_rejected(self):
+        deposits = [{"user_id": user.user_id, "currency_code": "PLN", "amount": "1"} for user in self.users]
+        response = self.client.post(self.url, {"deposits": deposits}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("load_deposits", response.data["error"])
+        self.assertFalse(DepositHistory.objects.exists())
+
+    def test_chunk_costs_constant_queries(self):
+        rows = enumerate(
+            {"user_id": user.user_id, "currency_code": "PLN", "amount": "1"}
+            for user in self.users for _ in range(50)
+        )
+        # per chunk: savepoint pair, account lookup, balance update, history
+        # insert, ledger insert, valuation rates and update, accounts version bump
+        with self.assertNumQueries(9 * 3):
+            summary = apply_deposits(rows, chunk_size=50)
+        self.assertEqual(summary, {"applied": 150, "rejected": 0, "chunks": 3})
+
+    def test_command_streams_csv(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as handle:
+            handle.write("user_id,currency_code,amount\n")
+            for user in self.users:
+                handle.write(f"{user.user_id},PLN,2.25\n")
+            handle.write(f"{self.users[0].user_id},PLN,abc\n")
+        self.addCleanup(os.remove, handle.name)
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("load_deposits", handle.name, "--chunk-size", "2", stdout=stdout, stderr=stderr)
+        self.assertIn("Applied 3 deposits in 2 chunks, rejected 1.", stdout.getvalue())
+        self.assertIn("line 5: Invalid user_id or amount", stderr.getvalue())
+        self.assertEqual(self.balance(self.users[2]), Decimal("2.25"))
+
+    def test_api_accepts_jsonl_upload(self):
+        lines = "".join(
+            json.dumps({"user_id": user.user_id, "currency_code": "PLN", "amount": 3}) + "\n"
+            for user in self.users
+        )
+        upload = SimpleUploadedFile("deposits.jsonl", lines.encode())
+        response = self.client.post(self.url, {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["applied"], 3)
+
+
+class CursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = create_user("pager")
+        for i in range(5):
+            AccountHistory.objects.create(user=self.user, currency="USD" if i % 2 else "PLN", amount=i + 1, action="income")
+        same_moment = timezone.make_aware(datetime(2024, 12, 6, 12, 0))
+        AccountHistory.objects.filter(user=self.user).update(created_at=same_moment)
+        AccountHistory.objects.create(user=self.user, currency="PLN", amount=10, action="expense")
+        self.url = reverse("account-history", kwargs={"user_id": self.user.user_id})
+
+    def test_cursor_walks_every_row_once_in_order(self):
+        seen = []
+        params = {"limit": 2}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(row["history_id"] for row in response.data)
+            if "X-Next-Cursor" not in response:
+                break
+            self.assertIn('rel="next"', response["Link"])
+            params["cursor"] = response["X-Next-Cursor"]
+        expected = list(AccountHistory.objects.order_by("-created_at", "-history_id").values_list("history_id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_filters_by_currency_and_date_range(self):
+        response = self.client.get(self.url, {"currency": "USD", "date_from": "2024-12-06", "date_to": "2024-12-06"})
+        self.assertEqual([row["amount"] for row in response.data], ["4.00", "2.00"])
+        response = self.client.get(self.url, {"date_to": "2024-12-05"})
+        self.assertEqual(response.data, [])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({"cursor": "not-a-cursor"}, {"limit": "0"}, {"date_from": "06-12-2024"},
+                       {"date_from": "2024-13-45"}, {"date_to": "2024-02-30"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_page_size_is_capped(self):
+        with self.settings(LIST_PAGE_SIZE=3):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 3)
+        self.assertIn("X-Next-Cursor", response)
+
+
+class QueryPlanTests(APITestCase):
+    """
+    Run every list endpoint, EXPLAIN the query that reads the listed table and
+    fail if the plan scans the whole table or sorts outside an index.
+    """
+
+    def setUp(self):
+        self.user = create_user("planner")
+        self.account = UserCurrencyAccount.objects.create(user=self.user, currency_code="USD")
+        AccountHistory.objects.create(user=self.user, currency="USD", amount=1, action="income")
+        Transaction.objects.create(user=self.user, from_currency="PLN", to_currency="USD", amount=1)
+        DepositHistory.objects.create(user=self.user, user_currency_account=self.account, amount=1)
+
+    def list_query(self, url, params, table):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        selects = [
+            query["sql"] for query in queries.captured_queries
+            if query["sql"].startswith("SELECT") and f'FROM "{table}"' in query["sql"]
+        ]
+        self.assertTrue(selects, f"no query read {table}")
+        return selects[-1]
+
+    def assert_index_plan(self, sql, table, index=None):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                self.assertNotIn(f"Seq Scan on {table}", plan, plan)
+                if index:
+                    self.assertIn(index, plan, plan)
+                self.assertNotRegex(plan, r"^\s*Sort\b|->\s+Sort\b", plan)
+                return
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+        self.assertRegex(plan, rf"SEARCH {table} USING (COVERING )?INDEX {index or ''}", plan)
+        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan, plan)
+
+    def test_list_endpoints_use_indexes(self):
+        user_id = self.user.user_id
+        cases = [
+            ("account-history", {}, "api_accounthistory", "history_user_created_idx"),
+            ("account-history", {"currency": "USD"}, "api_accounthistory", "history_user_currency_idx"),
+            ("account-history", {"date_from": "2024-01-01"}, "api_accounthistory", "history_user_created_idx"),
+            ("convert-currency", {}, "api_transaction", "transaction_user_created_idx"),
+            ("convert-currency", {"from_currency": "PLN"}, "api_transaction", "transaction_user_from_idx"),
+            ("convert-currency", {"to_currency": "USD"}, "api_transaction", "transaction_user_to_idx"),
+            ("deposit-to-account", {}, "api_deposithistory", "deposit_user_created_idx"),
+            ("deposit-to-account", {"currency_code": "USD"}, "api_deposithistory", "deposit_account_created_idx"),
+            ("user-currency-accounts", {}, "api_usercurrencyaccount", None),
+        ]
+        for name, params, table, index in cases:
+            with self.subTest(endpoint=name, params=params):
+                sql = self.list_query(reverse(name, kwargs={"user_id": user_id}), params, table)
+                self.assert_index_plan(sql, table, index)
+
+    def test_cursor_pages_use_indexes(self):
+        url = reverse("account-history", kwargs={"user_id": self.user.user_id})
+        AccountHistory.objects.create(user=self.user, currency="USD", amount=2, action="income")
+        cursor = self.client.get(url, {"limit": 1})["X-Next-Cursor"]
+        sql = self.list_query(url, {"limit": 1, "cursor": cursor}, "api_accounthistory")
+        self.assert_index_plan(sql, "api_accounthistory")
+
+
+class QueryCountTests(APITestCase):
+    """
+    Every list endpoint and admin changelist must cost the same number of
+    queries for one row as for many.
+    """
+
+    def setUp(self):
+        self.user = create_user("counter")
+        self.account = UserCurrencyAccount.objects.create(user=self.user, currency_code="USD")
+        self.admin_user = AuthUser.objects.create_superuser("admin", "admin@example.com", "Admin@1234")
+
+    def add_rows(self, count):
+        for _ in range(count):
+            other = User.objects.create(
+                username=f"other{User.objects.count()}",
+                password="x",
+                first_name="Other",
+                last_name="User",
+                phone_number=f"+48{User.objects.count():09d}",
+                email=f"other{User.objects.count()}@example.com",
+            )
+            AccountHistory.objects.create(user=other, currency="PLN", amount=1, action="income")
+            AccountHistory.objects.create(user=self.user, currency="USD", amount=1, action="income")
+            Transaction.objects.create(user=self.user, from_currency="PLN", to_currency="USD", amount=1)
+            DepositHistory.objects.create(user=self.user, user_currency_account=self.account, amount=1)
+            DepositHistory.objects.create(user=other, user_currency_account=other.currency_accounts.get(), amount=1)
+
+    def count_queries(self, url, params=None):
+        caches["default"].clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def assert_constant_queries(self, urls):
+        self.add_rows(1)
+        before = {url: self.count_queries(url) for url in urls}
+        self.add_rows(10)
+        after = {url: self.count_queries(url) for url in urls}
+        self.assertEqual(before, after)
+
+    def test_api_list_endpoints(self):
+        user_id = self.user.user_id
+        self.assert_constant_queries([
+            reverse("user-list"),
+            reverse("currency-account-list"),
+            reverse("user-currency-accounts", kwargs={"user_id": user_id}),
+            reverse("convert-currency", kwargs={"user_id": user_id}),
+            reverse("deposit-to-account", kwargs={"user_id": user_id}),
+            reverse("deposit-to-account", kwargs={"user_id": user_id}) + "?currency_code=USD",
+            reverse("account-history", kwargs={"user_id": user_id}),
+        ])
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.admin_user)
+        self.assert_constant_queries([
+            reverse("admin:api_user_changelist"),
+            reverse("admin:api_usercurrencyaccount_changelist"),
+            reverse("admin:api_transaction_changelist"),
+            reverse("admin:api_accounthistory_changelist"),
+            reverse("admin:api_deposithistory_changelist"),
+        ])
+
+    def test_admin_user_change_form(self):
+        self.client.force_login(self.admin_user)
+        url = reverse("admin:api_user_change", args=[self.user.user_id])
+        self.count_queries(url)
+        before = self.count_queries(url)
+        for code in ("EUR", "GBP", "JPY"):
+            UserCurrencyAccount.objects.create(user=self.user, currency_code=code)
+        self.assertEqual(self.count_queries(url), before)
+
+
+class RowSerializerTests(TestCase):
+    def setUp(self):
+        self.user = create_user("rows")
+        account = UserCurrencyAccount.objects.create(user=self.user, currency_code="EUR")
+        for amount in ("0", "0.10", "12345678.99", "7"):
+            Transaction.objects.create(user=self.user, from_currency="PLN", to_currency="EUR", amount=amount)
+            AccountHistory.objects.create(user=self.user, currency="EUR", amount=amount, action="income")
+            DepositHistory.objects.create(user=self.user, user_currency_account=account, amount=amount)
+        AccountHistory.objects.update(created_at=timezone.make_aware(datetime(2024, 1, 2, 3, 4, 5, 678)))
+
+    def assert_same_bytes(self, queryset, serializer_class, row_serializer_class):
+        renderer = JSONRenderer()
+        expected = renderer.render(serializer_class(queryset, many=True).data)
+        rows = queryset.values_list(*row_serializer_class.columns)
+        self.assertEqual(renderer.render(row_serializer_class(rows, many=True).data), expected)
+
+    def test_output_matches_model_serializers(self):
+        self.assert_same_bytes(Transaction.objects.order_by("-transaction_id"), TransactionSerializer, TransactionRowSerializer)
+        self.assert_same_bytes(DepositHistory.objects.order_by("-deposit_id"), DepositHistorySerializer, DepositHistoryRowSerializer)
+        self.assert_same_bytes(AccountHistory.objects.order_by("-history_id"), AccountHistorySerializer, AccountHistoryRowSerializer)
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = create_user("auditor")
+        account = self.user.currency_accounts.get()
+        for i in range(5):
+            AccountHistory.objects.create(user=self.user, currency="PLN", amount=i, action="income")
+            DepositHistory.objects.create(user=self.user, user_currency_account=account, amount=i)
+
+    def read(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_export_streams_every_row(self):
+        url = reverse("export-history", kwargs={"kind": "history"})
+        response = self.client.get(url, {"user_id": self.user.user_id})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = self.read(response).splitlines()
+        self.assertEqual(lines[0], "history_id,currency,action,amount,user,created_at")
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[1].split(",")[1:5], ["PLN", "income", "0.00", str(self.user.user_id)])
+
+    def test_ndjson_export_matches_list_format(self):
+        url = reverse("export-history", kwargs={"kind": "deposits"})
+        body = self.read(self.client.get(url, {"export_format": "ndjson"}))
+        rows = [json.loads(line) for line in body.splitlines()]
+        listed = self.client.get(reverse("deposit-to-account", kwargs={"user_id": self.user.user_id})).json()
+        self.assertEqual(rows, listed[::-1])
+
+    def test_json_export_streams_an_array_rendered_like_the_list(self):
+        url = reverse("export-history", kwargs={"kind": "history"})
+        response = self.client.get(url, {"export_format": "json"})
+        self.assertEqual(response["Content-Type"], "application/json")
+        body = self.read(response)
+        listed = self.client.get(reverse("account-history", kwargs={"user_id": self.user.user_id}))
+        self.assertEqual(body.encode(), JSONRenderer().render(listed.json()[::-1]))
+
+        chunks = list(stream_export("history", export_rows("history", {}), "json", batch_size=2))
+        self.assertEqual(json.loads("".join(chunks)), json.loads(body))
+        self.assertEqual(list(stream_export("history", iter(()), "json")), ["[", "]"])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse("export-history", kwargs={"kind": "users"})).status_code, 404)
+        url = reverse("export-history", kwargs={"kind": "history"})
+        self.assertEqual(self.client.get(url, {"export_format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"date_from": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"date_from": "2024-02-30"}).status_code, 400)
+
+    def test_command_writes_ndjson(self):
+        stdout = io.StringIO()
+        call_command("export_history", "transactions", "--format", "ndjson", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "")
+        call_command("export_history", "history", "--format", "ndjson", "--chunk-size", "2", stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 5)
+
+
+class PortfolioTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        self.nbp_get.return_value = mock_nbp_response([dict(NBP_TABLE_C[0], effectiveDate=self.today.isoformat())])
+        refresh_rate_table()
+        self.user = create_user("investor")
+        self.user.currency_accounts.update(balance=Decimal("100.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("10.00"))
+        self.url = reverse("user-portfolio", kwargs={"pk": self.user.user_id})
+
+    def expected_total(self):
+        rates, _ = stored_valuation_rates()
+        return sum(
+            (balance * rates[code] for code, balance in self.user.currency_accounts.values_list("currency_code", "balance")),
+            Decimal(0),
+        )
+
+    def test_read_is_a_single_row_fetch_once_computed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["total_pln"], "140.12")
+        self.assertEqual(response.data["rates_date"], self.today.isoformat())
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["total_pln"], "140.12")
+
+    def test_balance_changes_update_valuation_incrementally(self):
+        self.client.get(self.url)
+        convert_currency(self.user, "PLN", "USD", 5)
+        deposit_to_account(self.user, "USD", 2.5)
+        apply_deposits(enumerate([{"user_id": self.user.user_id, "currency_code": "PLN", "amount": "7.77"}]))
+
+        valuation = PortfolioValuation.objects.get(user=self.user)
+        self.assertFalse(valuation.is_stale)
+        self.assertEqual(valuation.total_pln, self.expected_total())
+
+    def test_account_update_revalues_owner(self):
+        self.client.get(self.url)
+        usd = self.user.currency_accounts.get(currency_code="USD")
+        self.client.put(reverse("currency-account-detail", kwargs={"pk": usd.account_id}), {"balance": "20.00"})
+        self.assertEqual(PortfolioValuation.objects.get(user=self.user).total_pln, self.expected_total())
+
+    def test_rate_refresh_revalues_every_portfolio(self):
+        self.client.get(self.url)
+        table = dict(NBP_TABLE_C[0], effectiveDate=self.today.isoformat(), rates=[
+            dict(rate, bid=rate["bid"] * 2) for rate in NBP_TABLE_C[0]["rates"]
+        ])
+        self.nbp_get.return_value = mock_nbp_response([table])
+        refresh_rate_table()
+        self.assertEqual(PortfolioValuation.objects.get(user=self.user).total_pln, Decimal("180.246"))
+
+    def test_missing_rates_mark_valuation_stale(self):
+        self.client.get(self.url)
+        ExchangeRate.objects.all().delete()
+        deposit_to_account(self.user, "USD", 1)
+        self.assertTrue(PortfolioValuation.objects.get(user=self.user).is_stale)
+
+    def test_unknown_user(self):
+        response = self.client.get(reverse("user-portfolio", kwargs={"pk": 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DailyRollupTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("reporter")
+        self.user.currency_accounts.update(balance=Decimal("1000.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("100.00"))
+        self.today = timezone.localdate()
+
+    def rollups(self):
+        return {
+            (rollup.currency, rollup.day): (rollup.income, rollup.expense, rollup.count)
+            for rollup in DailyHistoryRollup.objects.filter(user=self.user)
+        }
+
+    def test_conversions_update_rollups_incrementally(self):
+        convert_currency(self.user, "PLN", "USD", 10)
+        convert_currency(self.user, "USD", "PLN", 5)
+        self.client.post(
+            reverse("convert-currency-batch", kwargs={"user_id": self.user.user_id}),
+            {"conversions": [{"from_currency": "USD", "to_currency": "PLN", "amount": "1"}] * 3},
+            format="json",
+        )
+
+        expected = {}
+        for history in AccountHistory.objects.filter(user=self.user):
+            income, expense, count = expected.get((history.currency, self.today), (0, 0, 0))
+            if history.action == "income":
+                income += history.amount
+            else:
+                expense += history.amount
+            expected[(history.currency, self.today)] = (income, expense, count + 1)
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(self.rollups()[("USD", self.today)], (Decimal("10.00"), Decimal("8.00"), 5))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        convert_currency(self.user, "PLN", "USD", 10)
+        convert_currency(self.user, "USD", "PLN", 5)
+        earlier = timezone.now() - timezone.timedelta(days=3)
+        AccountHistory.objects.create(user=self.user, currency="PLN", amount=Decimal("7.00"), action="income")
+        AccountHistory.objects.filter(amount=Decimal("7.00")).update(created_at=earlier)
+        incremental = self.rollups()
+
+        DailyHistoryRollup.objects.update(income=0, expense=0, count=0)
+        call_command("rebuild_rollups", "--chunk-size", "1", stdout=io.StringIO())
+        rebuilt = self.rollups()
+
+        self.assertEqual(rebuilt.pop(("PLN", timezone.localdate(earlier))), (Decimal("7.00"), Decimal("0.00"), 1))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_rebuild_overwrites_rollups_with_totals(self):
+        convert_currency(self.user, "PLN", "USD", 10)
+        counted = DailyHistoryRollup.objects.get(user=self.user, currency="USD")
+        DailyHistoryRollup.objects.filter(pk=counted.pk).update(income=Decimal("20.00"), count=2)
+        orphan = DailyHistoryRollup.objects.create(
+            user=self.user, currency="USD", day=self.today - timezone.timedelta(days=5), income=Decimal("1.00"), count=1,
+        )
+
+        self.assertEqual(rebuild_rollups([self.user.user_id]), 2)
+
+        self.assertEqual(self.rollups()[("USD", self.today)], (Decimal("10.00"), Decimal("0.00"), 1))
+        self.assertTrue(DailyHistoryRollup.objects.filter(pk=counted.pk).exists())
+        self.assertFalse(DailyHistoryRollup.objects.filter(pk=orphan.pk).exists())
+
+    def test_daily_endpoint_serves_time_series_from_rollups(self):
+        for day, income in ((1, "5.00"), (2, "7.50"), (3, "1.25")):
+            DailyHistoryRollup.objects.create(
+                user=self.user, currency="PLN", day=self.today.replace(day=day),
+                income=Decimal(income), expense=Decimal("2.00"), count=2,
+            )
+        url = reverse("account-history-daily", kwargs={"user_id": self.user.user_id})
+        first = self.today.replace(day=1).isoformat()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {"date_to": self.today.replace(day=2).isoformat(), "limit": 1})
+        self.assertEqual(response.json(), [
+            {"day": first, "currency": "PLN", "income": "5.00", "expense": "2.00", "net": "3.00", "count": 2},
+        ])
+        response = self.client.get(url, {"date_to": self.today.replace(day=2).isoformat(), "cursor": response["X-Next-Cursor"]})
+        self.assertEqual([row["net"] for row in response.json()], ["5.50"])
+        self.assertNotIn("X-Next-Cursor", response)
+
+        response = self.client.get(
+            reverse("account-history-summary", kwargs={"user_id": self.user.user_id}), {"date_from": first}
+        )
+        self.assertEqual(response.json(), [
+            {"currency": "PLN", "income": "13.75", "expense": "6.00", "net": "7.75", "count": 6},
+        ])
+
+    def test_invalid_date_filter(self):
+        url = reverse("account-history-summary", kwargs={"user_id": self.user.user_id})
+        for value in ("yesterday", "2024-02-30"):
+            response = self.client.get(url, {"date_to": value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncConversionTests(TestCase):
+    def setUp(self):
+        rate_cache.invalidate()
+        reset_rate_providers()
+        self.addCleanup(rate_cache.invalidate)
+        self.addCleanup(reset_rate_providers)
+        self.nbp_requests = []
+        self.nbp_status = 200
+        patcher = mock.patch("api.providers.get_async_client", side_effect=lambda: httpx.AsyncClient(
+            transport=httpx.MockTransport(self.nbp_handler)
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = create_user("asyncuser")
+        self.user.currency_accounts.update(balance=Decimal("1000.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("50.00"))
+        self.url = reverse("convert-currency-async", kwargs={"user_id": self.user.user_id})
+
+    async def nbp_handler(self, request):
+        self.nbp_requests.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(self.nbp_status, json=NBP_TABLE_C)
+
+    async def test_async_conversion_fetches_rate_without_blocking(self):
+        response = await self.async_client.post(
+            self.url, {"from_currency": "PLN", "to_currency": "USD", "amount": "10"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("transaction_id", response.json())
+        usd = await UserCurrencyAccount.objects.aget(user=self.user, currency_code="USD")
+        self.assertEqual(usd.balance, Decimal("60.00"))
+        self.assertEqual(await AccountHistory.objects.filter(user=self.user).acount(), 2)
+
+    async def test_async_conversion_honours_idempotency_keys(self):
+        data = {"from_currency": "PLN", "to_currency": "USD", "amount": "10"}
+        first = await self.async_client.post(self.url, data, content_type="application/json", headers={"Idempotency-Key": "a"})
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        replayed = await self.async_client.post(self.url, data, content_type="application/json", headers={"Idempotency-Key": "a"})
+        self.assertEqual(replayed.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replayed.json(), first.json())
+        self.assertEqual(replayed["Idempotent-Replayed"], "true")
+        self.assertEqual(await Transaction.objects.filter(user=self.user).acount(), 1)
+
+        response = await self.async_client.post(
+            self.url, dict(data, amount="11"), content_type="application/json", headers={"Idempotency-Key": "a"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    async def test_async_owner_of_a_taken_over_claim_does_not_commit(self):
+        def take_over():
+            IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+            record = IdempotencyRecord.objects.get()
+            claim(record.key, record.fingerprint)
+
+        async def slow_conversion(*args):
+            response = await aconvert_currency(*args)
+            await sync_to_async(take_over)()
+            return response
+
+        with mock.patch("api.views.aconvert_currency", side_effect=slow_conversion):
+            response = await self.async_client.post(
+                self.url, {"from_currency": "PLN", "to_currency": "USD", "amount": "10"},
+                content_type="application/json", headers={"Idempotency-Key": "b"},
+            )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(await Transaction.objects.filter(user=self.user).aexists())
+
+    async def test_concurrent_misses_share_one_upstream_request(self):
+        tables = await asyncio.gather(*[aget_rate_table() for _ in range(10)])
+        self.assertEqual(len(self.nbp_requests), 1)
+        self.assertEqual({table.number for table in tables}, {NBP_TABLE_C[0]["no"]})
+
+    @override_settings(RATE_PROVIDERS=with_rate_file(os.devnull))
+    async def test_async_errors_match_sync_endpoint(self):
+        self.nbp_status = 503
+        response = await self.async_client.post(
+            self.url, {"from_currency": "PLN", "to_currency": "USD", "amount": "10"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn("Failed to fetch exchange rate", response.json()["error"])
+
+        response = await self.async_client.post(self.url, {"from_currency": "PLN"}, content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.post(
+            self.url, {"from_currency": "PLN", "to_currency": "USD", "amount": "-100"}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["error"], "Conversion amount must be greater than zero.")
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_pooled_client_is_reused_within_a_loop(self):
+        async def clients():
+            client = get_async_client()
+            reused = client is get_async_client()
+            await close_async_client()
+            return reused, client.is_closed
+
+        self.assertEqual(asyncio.run(clients()), (True, True))
+
+
+class AccountNumberTests(TransactionTestCase):
+    def setUp(self):
+        account_numbers.reset()
+        self.addCleanup(account_numbers.reset)
+
+    def test_numbers_carry_a_luhn_check_digit(self):
+        self.assertEqual(format_account_number(1), "0000-0000-0018")
+        number = create_user("numbered1").currency_accounts.get().account_number
+        digits = number.replace("-", "")
+        self.assertEqual(len(number), 14)
+        self.assertEqual(luhn_check_digit(digits[:-1]), digits[-1])
+
+    def test_allocation_reserves_blocks_without_probing(self):
+        with CaptureQueriesContext(connection) as queries:
+            for index in range(5):
+                create_user(f"numbered{index}")
+        self.assertFalse([q for q in queries.captured_queries if '"account_number" =' in q["sql"]])
+        self.assertEqual(NumberSequence.objects.get(name="account_number").last_value, 100)
+        numbers = list(UserCurrencyAccount.objects.order_by("account_id").values_list("account_number", flat=True))
+        self.assertEqual(numbers, [format_account_number(serial) for serial in range(1, 6)])
+
+    def test_bulk_allocation_inside_transaction_takes_one_reservation(self):
+        users = [create_user(f"numbered{index}") for index in range(3)]
+        accounts = [UserCurrencyAccount(user=user, currency_code=code) for user in users for code in ("USD", "EUR")]
+        with transaction.atomic():
+            with self.assertNumQueries(2):
+                UserCurrencyAccount.assign_account_numbers(accounts)
+            UserCurrencyAccount.objects.bulk_create(accounts)
+        self.assertEqual(len({account.account_number for account in accounts}), 6)
+        self.assertEqual(NumberSequence.objects.get(name="account_number").last_value, 106)
+
+    def test_rolled_back_reservation_is_returned(self):
+        user = create_user("numbered1")
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            UserCurrencyAccount.objects.create(user=user, currency_code="USD")
+            raise RuntimeError
+        self.assertEqual(NumberSequence.objects.get(name="account_number").last_value, 100)
+
+    def test_blocks_inside_transactions_are_reserved_on_a_separate_connection(self):
+        user = create_user("numbered1")
+        account_numbers.reset()
+        opened = []
+        create_connection = connections.create_connection
+
+        def track(alias):
+            opened.append(create_connection(alias))
+            # SQLite keeps in-memory test databases open, so watch close() itself.
+            opened[-1].close = mock.Mock(wraps=opened[-1].close)
+            return opened[-1]
+
+        with mock.patch.object(connection, "vendor", "postgresql"), \
+                mock.patch.object(connections, "create_connection", side_effect=track):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                UserCurrencyAccount.objects.create(user=user, currency_code="USD")
+                raise RuntimeError
+            self.assertEqual(NumberSequence.objects.get(name="account_number").last_value, 200)
+            with transaction.atomic():
+                usd = UserCurrencyAccount.objects.create(user=user, currency_code="USD")
+        self.assertEqual(usd.account_number, format_account_number(102))
+        self.assertEqual(len(opened), 1)
+        opened[0].close.assert_called_once()
+
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class BulkOnboardingTests(APITestCase):
+    def row(self, index, **overrides):
+        row = {
+            "username": f"partner{index}",
+            "password": f"Part@{index:04d}x",
+            "first_name": "Part",
+            "last_name": "Ner",
+            "phone_number": f"+4860000{index:04d}",
+            "email": f"partner{index}@example.com",
+        }
+        row.update(overrides)
+        return row
+
+    def test_users_and_pln_accounts_are_bulk_created(self):
+        User.objects.create(username="partner9", password="x", first_name="A", last_name="B",
+                            phone_number="+48600009999", email="taken@example.com")
+        users = [self.row(i) for i in range(3)]
+        users += [self.row(4, phone_number="123"), self.row(5, email=users[0]["email"]), self.row(9)]
+
+        with mock.patch("api.onboarding.ProcessPoolExecutor") as process_pool:
+            response = self.client.post(reverse("user-bulk"), {"users": users}, format="json")
+        process_pool.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 3)
+        self.assertEqual([error["row"] for error in response.data["errors"]], [3, 4, 5])
+        self.assertIn("already exists", response.data["errors"][2]["error"])
+
+        user = User.objects.get(username="partner1")
+        self.assertTrue(check_password("Part@0001x", user.password))
+        account = user.currency_accounts.get()
+        self.assertEqual((account.currency_code, len(account.account_number)), ("PLN", 14))
+
+    @override_settings(MAX_BULK_USERS=2)
+    def test_oversized_loads_are_rejected(self):
+        response = self.client.post(reverse("user-bulk"), {"users": [self.row(i) for i in range(3)]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("load_users", response.data["error"])
+
+        upload = SimpleUploadedFile("users.jsonl", "".join(json.dumps(self.row(i)) + "\n" for i in range(3)).encode())
+        response = self.client.post(reverse("user-bulk"), {"file": upload}, format="multipart")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(User.objects.exists())
+
+    def test_chunk_cost_does_not_grow_with_users(self):
+        rows = enumerate([self.row(i) for i in range(50)])
+        NumberSequence.objects.create(name="account_number")
+        # uniqueness check, savepoint pair, users, number reservation (2), accounts
+        with self.assertNumQueries(7):
+            summary = onboard_users(rows, chunk_size=50)
+        self.assertEqual(summary, {"created": 50, "rejected": 0, "chunks": 1})
+        self.assertEqual(UserCurrencyAccount.objects.filter(currency_code="PLN").count(), 50)
+
+    def test_load_users_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            for i in range(5):
+                f.write(json.dumps(self.row(i)) + "\n")
+            f.write("not json\n")
+        self.addCleanup(os.remove, f.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command("load_users", f.name, "--chunk-size", "2", "--workers", "1", stdout=out, stderr=err)
+        self.assertIn("Created 5 users in 3 chunks, rejected 1.", out.getvalue())
+        self.assertIn("line 6: Malformed row", err.getvalue())
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        pool = hash_pool(2)
+        try:
+            hashes = hash_passwords(["Pool@1234", "Pool@5678"], pool)
+        finally:
+            pool.shutdown()
+        self.assertTrue(check_password("Pool@5678", hashes[1]))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class PasswordHashingTests(APITestCase):
+    def setUp(self):
+        self.user = create_user("hasher", password="Hash@1234")
+
+    def login(self):
+        return self.client.post(reverse("login"), {"username": "hasher", "password": "Hash@1234"})
+
+    def test_login_upgrades_hash_when_policy_changes(self):
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$1000$"))
+
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+    def test_work_runs_under_the_limit_and_is_counted(self):
+        before = get_hashing_limiter().metrics()["completed"]
+        self.client.post(reverse("register"), {
+            "username": "pooled", "password": "Pool@1234", "first_name": "Pool", "last_name": "Ed",
+            "phone_number": "+48123456783", "email": "pooled@example.com",
+        })
+        self.login()
+        metrics = get_hashing_limiter().metrics()
+        self.assertEqual(metrics["completed"] - before, 2)
+        self.assertEqual(metrics["in_flight"], 0)
+        self.assertTrue(User.objects.get(username="pooled").password.startswith("pbkdf2_sha256$1000$"))
+
+    def test_saturated_limiter_sheds_load(self):
+        limiter = HashingLimiter(limit=1, timeout=0.01)
+        release = threading.Event()
+        blocker = threading.Thread(target=limiter.run, args=(release.wait,))
+        blocker.start()
+        time.sleep(0.05)
+        with self.assertRaises(HashingBusy):
+            limiter.run(make_password, "Busy@1234")
+        release.set()
+        blocker.join()
+        self.assertEqual(limiter.metrics()["rejected"], 1)
+        self.assertTrue(limiter.run(check_password, "Free@1234", make_password("Free@1234")))
+
+        with mock.patch("api.hashing.get_hashing_limiter", return_value=limiter), \
+                mock.patch.object(limiter, "run", side_effect=HashingBusy("busy")):
+            response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response["Retry-After"], "1")
+
+
+class UserValidationTests(SimpleTestCase):
+    valid = {
+        "username": "anna_nowak",
+        "password": "Secret@123",
+        "first_name": "Anna",
+        "last_name": "Van Nowak",
+        "phone_number": "+48500100200",
+        "email": "a.nowak@example.com",
+    }
+
+    def test_valid_user_has_no_errors(self):
+        self.assertEqual(validate_user(self.valid), {})
+        User(**self.valid).clean()
+
+    def test_every_error_is_reported_at_once(self):
+        row = dict(self.valid, username="anna!", first_name="anna", phone_number="", password="anna")
+        self.assertEqual(validate_user(row), {
+            "username": ["Username cannot contain special characters."],
+            "first_name": ["First name must follow the format: Eltun."],
+            "phone_number": ["Phone number is required."],
+            "password": [
+                "Password must be between 8 and 16 characters.",
+                "Password must contain at least 1 uppercase letter.",
+                "Password must contain at least 1 number.",
+                "Password must contain at least 1 special character (@, $, !, %, *, ?, &).",
+            ],
+        })
+
+        with self.assertRaises(ValidationError) as raised:
+            User(**row).clean()
+        self.assertEqual(set(raised.exception.message_dict), {"username", "first_name", "phone_number", "password"})
+
+    def test_similarity_rules(self):
+        self.assertEqual(validate_user(dict(self.valid, password="Nowak@1234"))["password"],
+                         ["Username and password must not be similar."])
+        self.assertEqual(validate_user(dict(self.valid, email="ecret@example.com", password="Secret@123")),
+                         {"password": ["Email and password must not be similar."]})
+        self.assertEqual(validate_user(dict(self.valid, password="   ")), {"password": ["Password is required."]})
+
+    def test_batch_mode_matches_per_record(self):
+        rows = [
+            self.valid,
+            dict(self.valid, email="not-an-email", last_name=None),
+            dict(self.valid, password="Toolongpassword@123"),
+            {},
+        ]
+        self.assertEqual(validate_users(rows), [validate_user(row) for row in rows])
+        self.assertEqual(validate_users([]), [])
+
+
+class RequestMetricsTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        create_user("metered")
+
+    def test_request_latency_and_queries_are_recorded_per_view(self):
+        self.client.get(reverse("user-list"))
+        self.client.get(reverse("user-detail", args=[999999]))
+
+        self.assertEqual(metrics.http_requests.value("user-list", "GET", "200"), 1)
+        self.assertEqual(metrics.http_requests.value("user-detail", "GET", "404"), 1)
+        self.assertEqual(metrics.http_request_duration.count("user-list", "GET"), 1)
+        self.assertEqual(metrics.db_queries.count("user-list", "GET"), 1)
+        self.assertGreaterEqual(metrics.db_queries.total("user-list", "GET"), 1)
+
+    def test_metrics_endpoint_renders_prometheus_text(self):
+        self.client.get(reverse("user-list"))
+        rate_cache.get(("c",))
+        rate_cache.get(("c",))
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn('http_requests_total{view="user-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="user-list",method="GET",le="+Inf"} 1', body)
+        self.assertIn('rate_cache_requests_total{result="miss"} 1', body)
+        self.assertIn('rate_cache_requests_total{result="hit"} 1', body)
+        self.assertIn('rate_upstream_request_duration_seconds_count{provider="nbp",outcome="ok"} 1', body)
+        self.assertIn('rate_provider_circuit_open{provider="nbp"} 0', body)
+        self.assertIn('password_hashing{stat="limit"}', body)
+
+    def test_upstream_failures_are_recorded(self):
+        self.nbp_get.side_effect = requests.exceptions.ConnectionError("down")
+        with self.assertRaises(RateFetchError):
+            NBPRateProvider(retries=0).fetch("c")
+        self.assertEqual(metrics.upstream_duration.count("nbp", "error"), 1)
+
+    async def test_async_requests_stay_async_and_count_queries(self):
+        async def view(request):
+            await User.objects.acount()
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(RequestFactory().get("/async/"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.http_requests.value("<unmatched>", "GET", "200"), 1)
+        self.assertEqual(metrics.db_queries.total("<unmatched>", "GET"), 1)
+        self.assertFalse(iscoroutinefunction(RequestMetricsMiddleware(lambda request: HttpResponse())))
+
+    def test_streamed_responses_are_recorded_with_their_queries_when_closed(self):
+        user = create_user("exported")
+        for i in range(3):
+            AccountHistory.objects.create(user=user, currency="PLN", amount=i, action="income")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("export-history", kwargs={"kind": "history"}), {"export_format": "ndjson"})
+            self.assertEqual(metrics.http_requests.value("export-history", "GET", "200"), 0)
+            self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+        self.assertEqual(metrics.http_requests.value("export-history", "GET", "200"), 1)
+        self.assertEqual(metrics.db_queries.count("export-history", "GET"), 1)
+        self.assertEqual(metrics.db_queries.total("export-history", "GET"), len(queries))
+
+    async def test_async_streamed_responses_count_queries_run_while_streaming(self):
+        async def rows():
+            yield str(await User.objects.acount())
+            yield str(await User.objects.acount())
+
+        async def view(request):
+            return StreamingHttpResponse(rows())
+
+        response = await RequestMetricsMiddleware(view)(RequestFactory().get("/async/"))
+        self.assertEqual(metrics.db_queries.count("<unmatched>", "GET"), 0)
+        self.assertEqual(b"".join([part async for part in response]), b"11")
+        await sync_to_async(response.close)()
+
+        self.assertEqual(metrics.http_requests.value("<unmatched>", "GET", "200"), 1)
+        self.assertEqual(metrics.db_queries.total("<unmatched>", "GET"), 2)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_REQUEST_QUERY_LIMIT=1)
+    def test_slow_requests_are_logged_with_their_queries(self):
+        with self.assertLogs("api.middleware", "WARNING") as logs:
+            self.client.get(reverse("user-list"))
+        self.assertEqual(metrics.slow_requests.value("user-list"), 1)
+        self.assertIn("Slow request GET /api/users/ (user-list) -> 200", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+
+class RatesEndpointTests(NBPMockMixin, APITestCase):
+    def test_serves_every_currency_with_validators(self):
+        response = self.client.get(reverse("rates"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["table"], "236/C/NBP/2024")
+        self.assertEqual(response.data["source"], "nbp")
+        self.assertEqual(response.data["rates"]["USD"], {"bid": "4.0123", "ask": "4.0933"})
+        self.assertEqual(sorted(response.data["rates"]), sorted(supported_currencies()))
+        self.assertEqual(response["ETag"], '"236/C/NBP/2024"')
+        self.assertEqual(response["Last-Modified"], "Fri, 06 Dec 2024 07:15:00 GMT")
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age=", response["Cache-Control"])
+
+    def test_unchanged_polls_get_304_without_queries_or_nbp_calls(self):
+        etag = self.client.get(reverse("rates"))["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("rates"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.nbp_get.call_count, 1)
+
+        response = self.client.get(reverse("rates"), HTTP_IF_NONE_MATCH='"235/C/NBP/2024"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_fallback_table_has_its_own_etag(self):
+        self.nbp_get.side_effect = requests.exceptions.ConnectionError("down")
+        ExchangeRate.objects.create(
+            currency="USD", bid=Decimal("4.0000"), ask=Decimal("4.1000"),
+            table_number="1/C/NBP/2025", effective_date=datetime(2025, 1, 2).date(),
+        )
+        response = self.client.get(reverse("rates"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["source"], "last-known-good")
+        self.assertEqual(response["ETag"], '"1/C/NBP/2025+last-known-good"')
+
+
+class AccountListCacheTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        caches["default"].clear()
+        self.user = create_user("cached")
+        self.pln = self.user.currency_accounts.get(currency_code="PLN")
+        self.url = reverse("user-currency-accounts", kwargs={"user_id": self.user.user_id})
+
+    def balances(self, response):
+        return {row["currency_code"]: row["balance"] for row in response.data}
+
+    def test_repeat_reads_are_served_from_cache_and_revalidated(self):
+        with self.assertNumQueries(2):
+            first = self.client.get(self.url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertIn("no-cache", first["Cache-Control"])
+        etag = first["ETag"]
+
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.data, first.data)
+        self.assertEqual(cached["ETag"], etag)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_updating_the_user_keeps_a_concurrent_version_bump(self):
+        first = self.client.get(self.url)
+        stale = User.objects.get(pk=self.user.pk)
+        User.bump_accounts_version([self.user.pk])
+
+        with mock.patch("api.utils.User.objects.get", return_value=stale):
+            response = self.client.put(
+                reverse("user-detail", kwargs={"pk": self.user.pk}), {"first_name": "Renamed"}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.accounts_version), ("Renamed", stale.accounts_version + 1))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, status.HTTP_200_OK)
+
+    def test_every_write_path_invalidates(self):
+        writes = [
+            lambda: deposit_to_account(self.user, "PLN", 100),
+            lambda: UserCurrencyAccount.objects.create(user=self.user, currency_code="USD"),
+            lambda: convert_currency(self.user, "PLN", "USD", 10),
+            lambda: self.client.post(
+                reverse("convert-currency-batch", kwargs={"user_id": self.user.user_id}),
+                {"conversions": [{"from_currency": "PLN", "to_currency": "USD", "amount": "1"}]},
+                format="json",
+            ),
+            lambda: apply_deposits(enumerate([{"user_id": self.user.user_id, "currency_code": "PLN", "amount": "5"}])),
+            lambda: self.user.currency_accounts.get(currency_code="USD").delete(),
+        ]
+        response = self.client.get(self.url)
+        for write in writes:
+            etag = response["ETag"]
+            write()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(
+                self.balances(response),
+                {account.currency_code: str(account.balance) for account in self.user.currency_accounts.all()},
+            )
+
+    def test_moving_an_account_invalidates_both_owners(self):
+        other = create_user("cached2")
+        other_url = reverse("user-currency-accounts", kwargs={"user_id": other.user_id})
+        usd = UserCurrencyAccount.objects.create(user=self.user, currency_code="USD")
+        mine, theirs = self.client.get(self.url), self.client.get(other_url)
+        self.assertEqual(set(self.balances(mine)), {"PLN", "USD"})
+
+        response = self.client.put(
+            reverse("currency-account-detail", args=[usd.pk]), {"user": other.user_id}, format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=mine["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(self.balances(response)), {"PLN"})
+        response = self.client.get(other_url, HTTP_IF_NONE_MATCH=theirs["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(self.balances(response)), {"PLN", "USD"})
+
+    def test_unknown_user_and_no_accounts(self):
+        missing = reverse("user-currency-accounts", kwargs={"user_id": self.user.user_id + 1000})
+        self.assertEqual(self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND)
+        self.pln.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_version_is_not_exposed(self):
+        response = self.client.get(reverse("user-detail", args=[self.user.user_id]))
+        self.assertNotIn("accounts_version", response.data)
+
+
+class IdempotencyTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("retrier")
+        self.user.currency_accounts.filter(currency_code="PLN").update(balance=Decimal("1000.00"))
+        UserCurrencyAccount.objects.create(user=self.user, currency_code="USD")
+        self.convert_url = reverse("convert-currency", kwargs={"user_id": self.user.user_id})
+        self.deposit_url = reverse("deposit-to-account", kwargs={"user_id": self.user.user_id})
+        self.data = {"from_currency": "PLN", "to_currency": "USD", "amount": "10"}
+
+    def post(self, url, data, key="key-1"):
+        return self.client.post(url, data, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_stored_response_without_executing(self):
+        first = self.post(self.convert_url, self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        replayed = self.post(self.convert_url, self.data)
+        self.assertEqual(replayed.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(replayed["Idempotent-Replayed"], "true")
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.nbp_get.call_count, 1)
+
+        self.post(self.convert_url, self.data, key="key-2")
+        self.client.post(self.convert_url, self.data, format="json")
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 3)
+
+    def test_keys_are_scoped_per_endpoint_and_bound_to_the_body(self):
+        self.post(self.convert_url, self.data)
+        response = self.post(self.deposit_url, {"user_currency_account_code": "PLN", "amount": "5"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.post(self.convert_url, dict(self.data, amount="11"))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+        response = self.post(self.convert_url, self.data, key="x" * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_client_errors_are_replayed(self):
+        data = {"from_currency": "USD", "to_currency": "PLN", "amount": "10"}
+        first = self.post(self.convert_url, data)
+        self.assertEqual(first.status_code, status.HTTP_400_BAD_REQUEST)
+        UserCurrencyAccount.objects.filter(user=self.user, currency_code="USD").update(balance=Decimal("100.00"))
+        replayed = self.post(self.convert_url, data)
+        self.assertEqual(replayed.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(replayed.data, first.data)
+
+    @override_settings(RATE_PROVIDERS=[("api.providers.NBPRateProvider", {"retries": 0})])
+    def test_server_errors_release_the_key(self):
+        self.nbp_get.side_effect = requests.exceptions.ConnectionError("down")
+        response = self.post(self.convert_url, self.data)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+        self.nbp_get.side_effect = None
+        response = self.post(self.convert_url, self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_rates_are_fetched_before_the_transaction_opens(self):
+        depth = len(connection.atomic_blocks)
+        depths = []
+
+        def fetch(*args, **kwargs):
+            depths.append(len(connection.atomic_blocks))
+            return mock_nbp_response()
+
+        self.nbp_get.side_effect = fetch
+        response = self.post(self.convert_url, self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(depths, [depth])
+
+    def test_duplicate_waits_for_the_running_request(self):
+        first = self.post(self.convert_url, self.data)
+        record = IdempotencyRecord.objects.get()
+        IdempotencyRecord.objects.update(status_code=None, response=None)
+
+        def finish(seconds):
+            IdempotencyRecord.objects.update(status_code=record.status_code, response=record.response)
+
+        with mock.patch("api.idempotency.time.sleep", side_effect=finish) as sleep:
+            replayed = self.post(self.convert_url, self.data)
+        sleep.assert_called_once()
+        self.assertEqual(replayed.data, first.data)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 1)
+
+        IdempotencyRecord.objects.update(status_code=None, response=None)
+        with override_settings(IDEMPOTENCY_WAIT=0):
+            response = self.post(self.convert_url, self.data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_expired_records_are_replaced_and_purged(self):
+        self.post(self.convert_url, self.data)
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.post(self.convert_url, self.data)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+
+        IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        stdout = io.StringIO()
+        call_command("purge_idempotency_keys", stdout=stdout)
+        self.assertIn("Deleted 1 expired idempotency records.", stdout.getvalue())
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+
+    def test_claim_retries_when_the_conflicting_record_vanishes(self):
+        create = IdempotencyRecord.objects.create
+
+        def racing_create(**fields):
+            if not IdempotencyRecord.objects.exists():
+                return create(**fields)
+            IdempotencyRecord.objects.all().delete()
+            raise IntegrityError
+
+        IdempotencyRecord.objects.create(key="k", fingerprint="f", expires_at=timezone.now())
+        with mock.patch.object(IdempotencyRecord.objects, "create", side_effect=racing_create):
+            claimed_until, record = claim("k", "f")
+        self.assertIsNone(record)
+        self.assertEqual(IdempotencyRecord.objects.get().expires_at, claimed_until)
+
+    def test_owner_of_a_taken_over_claim_does_not_commit(self):
+        def slow_conversion(*args):
+            response = convert_currency(*args)
+            # The claim times out while the view runs and a retry takes it over.
+            IdempotencyRecord.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+            self.assertIsNone(claim(IdempotencyRecord.objects.get().key, IdempotencyRecord.objects.get().fingerprint)[1])
+            return response
+
+        with mock.patch("api.views.convert_currency", side_effect=slow_conversion):
+            response = self.post(self.convert_url, self.data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertIsNone(IdempotencyRecord.objects.get().status_code)
+
+
+class LedgerTests(NBPMockMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = create_user("ledgered")
+        self.pln = self.user.currency_accounts.get(currency_code="PLN")
+        self.usd = UserCurrencyAccount.objects.create(user=self.user, currency_code="USD", balance=Decimal("20.00"))
+
+    def reconcile(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("reconcile_ledger", "--chunk-size", "2", stdout=stdout, stderr=stderr)
+        return stdout.getvalue()
+
+    def exercise(self):
+        deposit_to_account(self.user, "PLN", 500)
+        convert_currency(self.user, "PLN", "USD", 10)
+        convert_currency(self.user, "USD", "PLN", 5)
+        self.client.post(
+            reverse("convert-currency-batch", kwargs={"user_id": self.user.user_id}),
+            {"conversions": [{"from_currency": "PLN", "to_currency": "USD", "amount": "1"}] * 3},
+            format="json",
+        )
+        apply_deposits(enumerate([{"user_id": self.user.user_id, "currency_code": "USD", "amount": "2.50"}] * 2))
+
+    def test_every_write_path_posts_balanced_entries(self):
+        self.exercise()
+        self.client.put(reverse("currency-account-detail", args=[self.usd.pk]), {"balance": "99.99"}, format="json")
+        eur = self.client.post(
+            reverse("currency-account-list"),
+            {"user": self.user.user_id, "currency_code": "EUR", "balance": "7.00"},
+            format="json",
+        ).data["account_id"]
+        self.client.put(reverse("currency-account-detail", args=[eur]), {"currency_code": "GBP"}, format="json")
+
+        self.assertIn("Ledger reconciles with all account balances.", self.reconcile())
+        for account in self.user.currency_accounts.all():
+            self.assertEqual(ledger_balance(account.pk), account.balance)
+        self.assertEqual(
+            set(LedgerEntry.objects.values_list("kind", flat=True)),
+            {"opening", "deposit", "conversion", "adjustment"},
+        )
+
+    def test_checkpoints_keep_balances_exact(self):
+        self.exercise()
+        self.assertEqual(checkpoint_accounts(chunk_size=1, lag=0), 2)
+        self.assertEqual(
+            LedgerCheckpoint.objects.get(account=self.usd).last_entry_id,
+            LedgerEntry.objects.order_by("-entry_id").values_list("entry_id", flat=True).first(),
+        )
+        self.assertEqual(checkpoint_accounts(lag=0), 0)
+
+        convert_currency(self.user, "USD", "PLN", 3)
+        self.usd.refresh_from_db()
+        self.assertEqual(ledger_balance(self.usd.pk), self.usd.balance)
+        self.assertEqual(checkpoint_accounts(lag=0), 2)
+        self.assertEqual(LedgerCheckpoint.objects.get(account=self.usd).balance, self.usd.balance)
+        self.assertIn("Ledger reconciles", self.reconcile())
+
+    def test_direct_saves_post_adjustments(self):
+        self.usd.balance = Decimal("50.00")
+        self.usd.save()
+        self.pln.balance = 12
+        self.pln.save(update_fields=["balance"])
+        self.pln.is_active = False
+        self.pln.save(update_fields=["is_active"])
+
+        self.assertEqual(ledger_balance(self.usd.pk), Decimal("50.00"))
+        self.assertEqual(ledger_balance(self.pln.pk), Decimal("12.00"))
+        self.assertEqual(LedgerEntry.objects.filter(kind="adjustment").count(), 4)
+        self.assertIn("Ledger reconciles", self.reconcile())
+
+    def test_saves_that_keep_the_balance_skip_the_ledger(self):
+        account = UserCurrencyAccount.objects.get(pk=self.usd.pk)
+        account.is_active = False
+        with CaptureQueriesContext(connection) as queries:
+            account.save()
+        self.assertFalse([q["sql"] for q in queries if "ledger" in q["sql"] or q["sql"].startswith("SELECT")])
+
+        account.balance = Decimal("25.00")
+        account.save()
+        self.assertEqual(ledger_balance(self.usd.pk), Decimal("25.00"))
+        self.assertIn("Ledger reconciles", self.reconcile())
+
+    def test_reconcile_reports_drift(self):
+        UserCurrencyAccount.objects.filter(pk=self.usd.pk).update(balance=Decimal("21.00"))
+        stderr = io.StringIO()
+        with self.assertRaisesMessage(CommandError, "Ledger does not reconcile: 1 problems."):
+            call_command("reconcile_ledger", stdout=io.StringIO(), stderr=stderr)
+        self.assertIn(f"Account {self.usd.pk}: balance 21.00, ledger 20.00", stderr.getvalue())
+
+    def test_postings_must_balance_and_outlive_accounts(self):
+        with self.assertRaises(UnbalancedPosting):
+            post([("adjustment", [(self.usd.pk, "USD", Decimal("1.00")), (None, "USD", Decimal("-0.50"))])])
+
+        post([("adjustment", deposit_legs(self.usd.pk, "USD", Decimal("-20.00")))])
+        UserCurrencyAccount.objects.filter(pk=self.usd.pk).update(balance=0)
+        self.usd.delete()
+        self.assertEqual(LedgerEntry.objects.filter(account_id=self.usd.pk).count(), 2)
+        self.assertIn("Ledger reconciles", self.reconcile())
+        self.assertEqual(checkpoint_accounts(lag=0), 0)
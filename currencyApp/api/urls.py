@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import (getUsers, getUser, getCurrencyAccountsView, 
+from .views import (getUsers, createUsersBulk, getUser, getUserPortfolio, getCurrencyAccountsView, 
                     getCurrencyAccountView, getUserCurrencyAccountsView, 
-                    convertCurrency, depositToAccount, getAccountHistory,
-                    register_user, login_user, logout_user,
+                    getRatesView, convertCurrency, convertCurrencyAsync, convertCurrencyBatch, depositToAccount, depositBulk, getAccountHistory,
+                    getDailyHistory, getHistorySummary,
+                    exportHistory, register_user, login_user, logout_user,
 )
 
 
@@ -14,14 +15,23 @@ urlpatterns = [
     path('logout/', logout_user, name='logout'),
 
     path('users/', getUsers, name='user-list'),
+    path('users/bulk/', createUsersBulk, name='user-bulk'),
     path('users/<int:pk>/', getUser, name='user-detail'),
+    path('users/<int:pk>/portfolio/', getUserPortfolio, name='user-portfolio'),
     path('currency-accounts/', getCurrencyAccountsView, name='currency-account-list'),
     path('currency-accounts/<int:pk>/', getCurrencyAccountView, name='currency-account-detail'),
     path('currency-accounts/user/<int:user_id>/', getUserCurrencyAccountsView, name='user-currency-accounts'),
 
+    path('rates/', getRatesView, name='rates'),
     path('currency-accounts/convert/<int:user_id>/', convertCurrency, name='convert-currency'),
+    path('currency-accounts/convert/async/<int:user_id>/', convertCurrencyAsync, name='convert-currency-async'),
+    path('currency-accounts/convert/batch/<int:user_id>/', convertCurrencyBatch, name='convert-currency-batch'),
     path('currency-accounts/deposit/<int:user_id>/', depositToAccount, name='deposit-to-account'),
+    path('currency-accounts/deposit/bulk/', depositBulk, name='deposit-bulk'),
     path('currency-accounts/history/<int:user_id>/', getAccountHistory, name='account-history'),
+    path('currency-accounts/history/<int:user_id>/daily/', getDailyHistory, name='account-history-daily'),
+    path('currency-accounts/history/<int:user_id>/summary/', getHistorySummary, name='account-history-summary'),
+    path('export/<str:kind>/', exportHistory, name='export-history'),
 
 
 ]
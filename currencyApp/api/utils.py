@@ -1,18 +1,31 @@
-import requests
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
 from django.db import IntegrityError
+from asgiref.sync import sync_to_async
 from rest_framework.response import Response
 from rest_framework import status
-from .models import User, UserCurrencyAccount, Transaction, AccountHistory, DepositHistory
+from .models import CENTS, User, UserCurrencyAccount, Transaction, AccountHistory, DepositHistory
 from .serializers import UserSerializer, UserCurrencyAccountSerializer
+from .pagination import list_response
+from .ledger import conversion_legs, deposit_legs, post
+from .portfolio import apply_balance_changes, revalue_portfolios
+from .rollups import apply_history_rollups
+from .hashing import HashingBusy, hash_password
+from .rates import (aget_rate_table, get_rate_table, latest_stored_rate, RateFetchError, rate_table_etag,
+                    rate_table_last_modified, rate_table_max_age, rate_table_payload)
 from django.db import transaction as db_transaction
-from decimal import Decimal
-from django.contrib.auth.hashers import make_password
+from decimal import Decimal, InvalidOperation
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 
 def getUsersList(request):
     users = User.objects.all()
-    serializer = UserSerializer(users, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return list_response(request, users, ('account_created_on', 'user_id'), UserSerializer, date_field='account_created_on')
 
 def createUser(request):
     serializer = UserSerializer(data=request.data)
@@ -38,7 +51,10 @@ def updateUser(request, pk):
     
     data = request.data
     if "password" in data:
-        data["password"] = make_password(data["password"])
+        try:
+            data["password"] = hash_password(data["password"])
+        except HashingBusy as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
     
     serializer = UserSerializer(user, data=data, partial=True)
     if serializer.is_valid():
@@ -58,14 +74,19 @@ def deleteUser(request, pk):
 
 def getCurrencyAccounts(request):
     accounts = UserCurrencyAccount.objects.all()
-    serializer = UserCurrencyAccountSerializer(accounts, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    currency_code = request.query_params.get('currency_code')
+    if currency_code:
+        accounts = accounts.filter(currency_code=currency_code)
+    return list_response(request, accounts, ('account_id',), UserCurrencyAccountSerializer)
 
 def createCurrencyAccount(request):
     serializer = UserCurrencyAccountSerializer(data=request.data)
     if serializer.is_valid():
         try:
-            serializer.save()
+            with db_transaction.atomic():
+                account = serializer.save()
+                if account.balance:
+                    apply_balance_changes([(account.user_id, account.currency_code, account.balance)])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except IntegrityError:
             return Response({"error": "Account with this currency already exists for this user."}, status=status.HTTP_400_BAD_REQUEST)
@@ -88,7 +109,12 @@ def updateCurrencyAccount(request, pk):
 
     serializer = UserCurrencyAccountSerializer(account, data=request.data, partial=True)
     if serializer.is_valid():
-        serializer.save()
+        previous_user_id = account.user_id
+        with db_transaction.atomic():
+            # save() posts the balance adjustment to the ledger.
+            serializer.save()
+            if {'balance', 'currency_code', 'user'} & set(serializer.validated_data):
+                revalue_portfolios({previous_user_id, account.user_id})
         return Response(serializer.data, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -108,74 +134,238 @@ def deleteCurrencyAccount(request, pk):
     return Response({"message": "Currency account deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
 
+def accounts_cache_key(user_id, created_on, version):
+    # The creation time keeps a reused user_id from hitting a deleted user's entries.
+    return f"accounts:{user_id}:{created_on.timestamp()}:{version}"
+
+
 def getUserCurrencyAccounts(request, user_id):
-    try:
-        accounts = UserCurrencyAccount.objects.filter(user_id=user_id)
-        if not accounts.exists():
-            return Response({"error": "No accounts found for this user"}, status=status.HTTP_404_NOT_FOUND)
-        
-        serializer = UserCurrencyAccountSerializer(accounts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-    except User.DoesNotExist:
-        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+    """
+    A user's accounts, cached per accounts_version. Every change to the
+    user's accounts bumps the version in the same transaction, so a read
+    costs one query for the version and never returns stale balances.
+    """
+    row = User.objects.filter(pk=user_id).values_list('account_created_on', 'accounts_version').first()
+    if row is None:
+        return Response({"error": "No accounts found for this user"}, status=status.HTTP_404_NOT_FOUND)
+
+    key = accounts_cache_key(user_id, *row)
+    etag = f'"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    cache = caches[settings.ACCOUNT_LIST_CACHE]
+    data = cache.get(key)
+    if data is None:
+        data = UserCurrencyAccountSerializer(UserCurrencyAccount.objects.filter(user_id=user_id), many=True).data
+        cache.set(key, data, settings.ACCOUNT_LIST_CACHE_TTL)
+    if not data:
+        return Response({"error": "No accounts found for this user"}, status=status.HTTP_404_NOT_FOUND)
+
+    response = Response(data, status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def get_exchange_rate(currency_code, rate_type):
-    url = f"https://api.nbp.pl/api/exchangerates/rates/c/{currency_code}/?format=json"
+    """
+    The rate from the cached table, the same one /api/rates/ shows. The
+    stored rates are only used when no rate provider can supply it.
+    """
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        rate = data['rates'][0][rate_type]
-        return Decimal(rate)
-    except requests.exceptions.RequestException as e:
-        return Response({"error": f"Failed to fetch exchange rate: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    except KeyError:
-        return Response({"error": f"Invalid response format from NBP API."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return get_rate_table().rate(currency_code, rate_type)
+    except RateFetchError as e:
+        rate = latest_stored_rate(currency_code, rate_type)
+        if rate is not None:
+            return rate
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
 
-def convert_currency(user, from_currency, to_currency, amount):
+def get_conversion_rate(from_currency, to_currency):
+    if from_currency == 'PLN':
+        return get_exchange_rate(to_currency, 'ask')
+    return get_exchange_rate(from_currency, 'bid')
+
+
+async def aget_exchange_rate(currency_code, rate_type):
     try:
-        from_account = UserCurrencyAccount.objects.get(user=user, currency_code=from_currency)
-        to_account = UserCurrencyAccount.objects.get(user=user, currency_code=to_currency)
-    except UserCurrencyAccount.DoesNotExist:
-        return Response({"error": "One or both currency accounts do not exist for this user."}, status=status.HTTP_400_BAD_REQUEST)
+        return (await aget_rate_table()).rate(currency_code, rate_type)
+    except RateFetchError as e:
+        rate = await sync_to_async(latest_stored_rate)(currency_code, rate_type)
+        if rate is not None:
+            return rate
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+async def aget_conversion_rate(from_currency, to_currency):
+    if from_currency == 'PLN':
+        return await aget_exchange_rate(to_currency, 'ask')
+    return await aget_exchange_rate(from_currency, 'bid')
+
+
+def prefetch_rate_table(request):
+    """
+    Load the rate table before a conversion's transaction opens, so a slow
+    NBP fetch never runs with the write transaction open. Returns the 503
+    response when no provider has rates.
+    """
+    try:
+        get_rate_table()
+    except RateFetchError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return None
 
-    amount = Decimal(amount)
 
-    with db_transaction.atomic():
-        if from_currency == 'PLN':
-            rate = get_exchange_rate(to_currency, 'ask')
-            if isinstance(rate, Response):
-                return rate
-            
-            if from_account.balance < amount * rate:
-                return Response({"error": "Insufficient balance in PLN account."}, status=status.HTTP_400_BAD_REQUEST)
-    
-            from_account.balance -= amount * rate
-            from_account.save()
+async def aprefetch_rate_table(request):
+    try:
+        await aget_rate_table()
+    except RateFetchError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return None
 
-            to_account.balance += amount
-            to_account.save()
 
-            AccountHistory.objects.create(user=user, currency=from_currency, amount=amount * rate, action='expense')
-            AccountHistory.objects.create(user=user, currency=to_currency, amount=amount, action='income')
-        else:
-            rate = get_exchange_rate(from_currency, 'bid')
-            if isinstance(rate, Response):
-                return rate
-            
-            if from_account.balance < amount:
-                return Response({"error": f"Insufficient balance in {from_currency} account."}, status=status.HTTP_400_BAD_REQUEST)
+def getRates(request):
+    """
+    Bid/ask of every supported currency from the cached NBP table. Unchanged
+    polls get a 304 without touching the database or NBP.
+    """
+    try:
+        table = get_rate_table()
+    except RateFetchError as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    etag = rate_table_etag(table)
+    last_modified = rate_table_last_modified(table)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = Response(rate_table_payload(table), status=status.HTTP_200_OK)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=rate_table_max_age())
+    return response
+
+
+def conversion_amounts(from_currency, amount, rate):
+    """
+    Return the (debited, credited) amounts for a conversion, rounded to the
+    precision of UserCurrencyAccount.balance.
+    """
+    if from_currency == 'PLN':
+        return (amount * rate).quantize(CENTS), amount.quantize(CENTS)
+    return amount.quantize(CENTS), (amount * rate).quantize(CENTS)
+
+
+def lock_currency_accounts(user, currency_codes):
+    """
+    Lock the user's accounts for the given currencies in primary key order, so
+    concurrent conversions touching the same accounts cannot deadlock.
+    Must be called inside a transaction.
+    """
+    accounts = (
+        UserCurrencyAccount.objects.select_for_update()
+        .filter(user=user, currency_code__in=set(currency_codes))
+        .order_by('account_id')
+    )
+    return {account.currency_code: account for account in accounts}
+
+
+def debit_account(account, amount):
+    """
+    Subtract amount from the balance in a single conditional UPDATE.
+    Returns False, leaving the row untouched, if the balance is insufficient.
+    """
+    return UserCurrencyAccount.objects.filter(pk=account.pk, balance__gte=amount).update(
+        balance=F('balance') - amount,
+        updated_at=timezone.now(),
+    ) == 1
+
+
+def credit_account(account, amount):
+    account.balance = F('balance') + amount
+    account.save(update_fields=['balance', 'updated_at'])
+
+
+def validate_conversion(from_currency, to_currency):
+    currency_codes = {code for code, _ in UserCurrencyAccount.CURRENCY_CHOICES}
+    if from_currency not in currency_codes or to_currency not in currency_codes:
+        return Response({"error": "One or both currency accounts do not exist for this user."}, status=status.HTTP_400_BAD_REQUEST)
+    if from_currency == to_currency:
+        return Response({"error": "Cannot convert a currency to itself."}, status=status.HTTP_400_BAD_REQUEST)
+    return None
+
 
-            from_account.balance -= amount
-            from_account.save()
+def parse_conversion_amount(amount):
+    """
+    Return (amount, None) with amount as a Decimal rounded to cents, or
+    (None, message) unless it is a finite number greater than zero.
+    """
+    try:
+        amount = Decimal(str(amount))
+    except InvalidOperation:
+        return None, "Invalid amount"
+    if not amount.is_finite():
+        return None, "Invalid amount"
+    amount = amount.quantize(CENTS)
+    if amount <= 0:
+        return None, "Conversion amount must be greater than zero."
+    return amount, None
 
-            to_account.balance += amount * rate
-            to_account.save()
 
-            AccountHistory.objects.create(user=user, currency=from_currency, amount=amount, action='expense')
-            AccountHistory.objects.create(user=user, currency=to_currency, amount=amount * rate, action='income')
+def convert_currency(user, from_currency, to_currency, amount):
+    amount, error = parse_conversion_amount(amount)
+    if error:
+        return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+    error = validate_conversion(from_currency, to_currency)
+    if error:
+        return error
+
+    rate = get_conversion_rate(from_currency, to_currency)
+    if isinstance(rate, Response):
+        return rate
+    return apply_conversion(user, from_currency, to_currency, amount, rate)
+
+
+async def aconvert_currency(user, from_currency, to_currency, amount):
+    """
+    Async variant of convert_currency: the rate is resolved without blocking
+    the event loop and only the short database transaction runs in a thread.
+    """
+    amount, error = parse_conversion_amount(amount)
+    if error:
+        return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+    error = validate_conversion(from_currency, to_currency)
+    if error:
+        return error
+
+    rate = await aget_conversion_rate(from_currency, to_currency)
+    if isinstance(rate, Response):
+        return rate
+    return await sync_to_async(apply_conversion)(user, from_currency, to_currency, amount, rate)
+
+
+def apply_conversion(user, from_currency, to_currency, amount, rate):
+    debited, credited = conversion_amounts(from_currency, amount, rate)
+
+    with db_transaction.atomic():
+        accounts = lock_currency_accounts(user, [from_currency, to_currency])
+        if from_currency not in accounts or to_currency not in accounts:
+            return Response({"error": "One or both currency accounts do not exist for this user."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not debit_account(accounts[from_currency], debited):
+            return Response({"error": f"Insufficient balance in {from_currency} account."}, status=status.HTTP_400_BAD_REQUEST)
+        credit_account(accounts[to_currency], credited)
+        post([('conversion', conversion_legs(
+            accounts[from_currency].pk, from_currency, debited, accounts[to_currency].pk, to_currency, credited,
+        ))])
+        apply_balance_changes([(user.user_id, from_currency, -debited), (user.user_id, to_currency, credited)])
+
+        apply_history_rollups(AccountHistory.objects.bulk_create([
+            AccountHistory(user=user, currency=from_currency, amount=debited, action='expense'),
+            AccountHistory(user=user, currency=to_currency, amount=credited, action='income'),
+        ]))
 
         transaction = Transaction.objects.create(
             user=user,
@@ -188,6 +378,105 @@ def convert_currency(user, from_currency, to_currency, amount):
 
 
 
+def convert_currency_batch(user, conversions):
+    """
+    Apply many conversions for one user in a single transaction. Rates are
+    resolved once per currency, every affected account is locked once and all
+    writes are batched. If any item fails, nothing is applied.
+    """
+    currency_codes = {code for code, _ in UserCurrencyAccount.CURRENCY_CHOICES}
+    rates = {}
+    results = []
+    planned = []
+
+    for index, item in enumerate(conversions):
+        from_currency = item.get('from_currency')
+        to_currency = item.get('to_currency')
+        amount = item.get('amount')
+        result = {"index": index}
+        results.append(result)
+
+        if not all([from_currency, to_currency, amount]):
+            result["error"] = "Missing required fields"
+            continue
+        amount, error = parse_conversion_amount(amount)
+        if error:
+            result["error"] = error
+            continue
+        if from_currency not in currency_codes or to_currency not in currency_codes:
+            result["error"] = "One or both currency accounts do not exist for this user."
+            continue
+        if from_currency == to_currency:
+            result["error"] = "Cannot convert a currency to itself."
+            continue
+
+        rate_key = (to_currency, 'ask') if from_currency == 'PLN' else (from_currency, 'bid')
+        if rate_key not in rates:
+            rates[rate_key] = get_exchange_rate(*rate_key)
+        rate = rates[rate_key]
+        if isinstance(rate, Response):
+            result["error"] = rate.data["error"]
+            continue
+
+        debited, credited = conversion_amounts(from_currency, amount, rate)
+        planned.append((result, from_currency, to_currency, amount, debited, credited))
+
+    if len(planned) < len(results):
+        return Response({"error": "Batch conversion failed; no conversions were applied.", "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+    with db_transaction.atomic():
+        accounts = lock_currency_accounts(user, [code for _, from_code, to_code, *_ in planned for code in (from_code, to_code)])
+        balances = {code: account.balance for code, account in accounts.items()}
+        original_balances = dict(balances)
+
+        histories = []
+        transactions = []
+        postings = []
+        for result, from_currency, to_currency, amount, debited, credited in planned:
+            if from_currency not in accounts or to_currency not in accounts:
+                result["error"] = "One or both currency accounts do not exist for this user."
+                continue
+            if balances[from_currency] < debited:
+                result["error"] = f"Insufficient balance in {from_currency} account."
+                continue
+
+            balances[from_currency] -= debited
+            balances[to_currency] += credited
+            histories.append(AccountHistory(user=user, currency=from_currency, amount=debited, action='expense'))
+            histories.append(AccountHistory(user=user, currency=to_currency, amount=credited, action='income'))
+            transactions.append(Transaction(user=user, from_currency=from_currency, to_currency=to_currency, amount=amount))
+            postings.append(('conversion', conversion_legs(
+                accounts[from_currency].pk, from_currency, debited, accounts[to_currency].pk, to_currency, credited,
+            )))
+
+        if len(transactions) < len(planned):
+            return Response({"error": "Batch conversion failed; no conversions were applied.", "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        changed = []
+        for code, account in accounts.items():
+            if balances[code] != account.balance:
+                account.balance = balances[code]
+                account.updated_at = now
+                changed.append(account)
+        UserCurrencyAccount.objects.bulk_update(changed, ['balance', 'updated_at'])
+        User.bump_accounts_version([user.user_id])
+        post(postings)
+        apply_balance_changes(
+            (user.user_id, code, balances[code] - balance)
+            for code, balance in original_balances.items()
+            if balances[code] != balance
+        )
+        apply_history_rollups(AccountHistory.objects.bulk_create(histories))
+        Transaction.objects.bulk_create(transactions)
+
+    for (result, *_), transaction in zip(planned, transactions):
+        result["transaction_id"] = transaction.transaction_id
+
+    return Response({"message": "Batch conversion successful.", "results": results}, status=status.HTTP_201_CREATED)
+
+
+
 def deposit_to_account(user, user_currency_account_code, amount):
     try:
         account = UserCurrencyAccount.objects.get(currency_code=user_currency_account_code, user=user)
@@ -200,8 +489,10 @@ def deposit_to_account(user, user_currency_account_code, amount):
         return Response({"error": "Deposit amount must be greater than zero."}, status=status.HTTP_400_BAD_REQUEST)
 
     with db_transaction.atomic():
-        account.balance += amount
-        account.save()
+        account.balance = F('balance') + amount
+        account.save(update_fields=['balance', 'updated_at'])
+        post([('deposit', deposit_legs(account.pk, account.currency_code, amount))])
+        apply_balance_changes([(user.user_id, account.currency_code, amount)])
 
         deposit = DepositHistory.objects.create(
             user=user,
@@ -0,0 +1,99 @@
+import re
+
+
+USERNAME_RE = re.compile(r'^[a-zA-Z0-9_]+$')
+NAME_RE = re.compile(r'^[A-Z][a-z]+(?: [A-Z][a-z]+)*$')
+PHONE_RE = re.compile(r'^\+48\d{9}$')
+EMAIL_RE = re.compile(r'^[^@]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+UPPERCASE_RE = re.compile(r'[A-Z]')
+DIGIT_RE = re.compile(r'\d')
+SPECIAL_RE = re.compile(r'[@$!%*?&]')
+# All password rules at once, so a valid password costs a single match.
+STRONG_PASSWORD_RE = re.compile(r'(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&]).{8,16}\Z', re.DOTALL)
+
+# (field, pattern, message when missing, message when the pattern does not match).
+# No pattern matches a blank value, so blankness is only checked after a failed match.
+FIELD_RULES = (
+    ('username', USERNAME_RE, "Username is required.", "Username cannot contain special characters."),
+    ('first_name', NAME_RE, "First name is required.", "First name must follow the format: Eltun."),
+    ('last_name', NAME_RE, "Last name is required.", "Last name must follow the format: Gasimov."),
+    ('phone_number', PHONE_RE, "Phone number is required.",
+     "Phone number must be in the format +48XXXXXXXXX (9 digits after +48)."),
+    ('email', EMAIL_RE, "Email is required.", "Email must be valid (e.g., gasimoweltun@gmail.com)."),
+)
+
+USER_FIELDS = ('username', 'password', 'first_name', 'last_name', 'phone_number', 'email')
+
+
+def is_blank(value):
+    return value.__class__ is not str or not value.strip()
+
+
+def password_errors(password, username, email):
+    if password.__class__ is str and STRONG_PASSWORD_RE.match(password) is not None:
+        errors = []
+    elif is_blank(password):
+        return ["Password is required."]
+    else:
+        errors = password_rule_errors(password)
+    if username.__class__ is str and username:
+        lowered = password.lower()
+        if any(word in lowered for word in username.lower().split('_')):
+            errors.append("Username and password must not be similar.")
+    if email.__class__ is str and email and email.split('@')[0] in password:
+        errors.append("Email and password must not be similar.")
+    return errors
+
+
+def password_rule_errors(password):
+    errors = []
+    if not 8 <= len(password) <= 16:
+        errors.append("Password must be between 8 and 16 characters.")
+    if UPPERCASE_RE.search(password) is None:
+        errors.append("Password must contain at least 1 uppercase letter.")
+    if DIGIT_RE.search(password) is None:
+        errors.append("Password must contain at least 1 number.")
+    if SPECIAL_RE.search(password) is None:
+        errors.append("Password must contain at least 1 special character (@, $, !, %, *, ?, &).")
+    return errors
+
+
+def validate_user(values):
+    """
+    Check a mapping of user fields against every rule in one pass. Returns
+    {field: [messages]}, empty when the values are valid.
+    """
+    errors = {}
+    for field, pattern, required, invalid in FIELD_RULES:
+        value = values.get(field)
+        if value.__class__ is str and pattern.match(value) is not None:
+            continue
+        errors[field] = [required] if is_blank(value) else [invalid]
+    messages = password_errors(values.get('password'), values.get('username'), values.get('email'))
+    if messages:
+        errors['password'] = messages
+    return errors
+
+
+def validate_users(rows):
+    """
+    Batch form of validate_user for imports: each rule runs over a whole
+    column at a time. Returns one error dict per row, in order.
+    """
+    results = [{} for _ in rows]
+    for field, pattern, required, invalid in FIELD_RULES:
+        match = pattern.match
+        for errors, value in zip(results, [row.get(field) for row in rows]):
+            if value.__class__ is str and match(value) is not None:
+                continue
+            errors[field] = [required] if is_blank(value) else [invalid]
+
+    for errors, row in zip(results, rows):
+        messages = password_errors(row.get('password'), row.get('username'), row.get('email'))
+        if messages:
+            errors['password'] = messages
+    return results
+
+
+def error_messages(errors):
+    return [message for messages in errors.values() for message in messages]
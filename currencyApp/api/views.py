@@ -1,17 +1,35 @@
+import io
+import json
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .models import User, Transaction, DepositHistory, AccountHistory
-from .serializers import TransactionSerializer, DepositHistorySerializer, AccountHistorySerializer, UserSerializer
-from django.contrib.auth.hashers import make_password, check_password
+from django.db.models import Subquery
+from .models import User, UserCurrencyAccount, Transaction, DepositHistory, AccountHistory, DailyHistoryRollup
+from .serializers import (UserSerializer, PortfolioValuationSerializer, TransactionRowSerializer, DepositHistoryRowSerializer,
+                          AccountHistoryRowSerializer, DailyHistoryRollupRowSerializer
+)
+from .bulk import apply_deposits, capped, read_rows
+from . import metrics
+from .idempotency import idempotent
+from .hashing import HashingBusy, hash_password, verify_password
+from .onboarding import onboard_users
+from .exports import CONTENT_TYPES, EXPORTS, export_rows, stream_export
+from .pagination import InvalidQuery, filter_date_range, list_response
+from .portfolio import get_portfolio
+from .rollups import history_summary
 
 
 from .utils import (
     getUsersList, createUser, getUserDetail, updateUser, deleteUser,
     getCurrencyAccounts, createCurrencyAccount, getCurrencyAccountDetail,
-    updateCurrencyAccount, deleteCurrencyAccount, getUserCurrencyAccounts,
-    convert_currency, deposit_to_account
+    updateCurrencyAccount, deleteCurrencyAccount, getUserCurrencyAccounts, getRates,
+    convert_currency, aconvert_currency, convert_currency_batch, deposit_to_account,
+    prefetch_rate_table, aprefetch_rate_table
 )
 
 
@@ -22,6 +40,39 @@ def getUsers(request):
     elif request.method == 'POST':
         return createUser(request)
 
+@api_view(['POST'])
+def createUsersBulk(request):
+    upload = request.FILES.get('file')
+    if upload is not None:
+        file_format = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in ('csv', 'jsonl'):
+            return Response({"error": "format must be csv or jsonl"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = read_rows(io.TextIOWrapper(upload.file, encoding='utf-8'), file_format)
+    else:
+        users = request.data.get('users')
+        if not isinstance(users, list) or not users:
+            return Response({"error": "users must be a non-empty list or a csv/jsonl file"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = enumerate(users)
+
+    rows = capped(rows, settings.MAX_BULK_USERS)
+    if rows is None:
+        return Response(
+            {"error": f"At most {settings.MAX_BULK_USERS} users per request; use the load_users command for larger loads"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    errors = []
+    try:
+        summary = onboard_users(
+            rows,
+            chunk_size=settings.BULK_USER_CHUNK_SIZE,
+            on_error=lambda ref, message: errors.append({"row": ref, "error": message}),
+        )
+    except HashingBusy as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+    summary["errors"] = errors
+    return Response(summary, status=status.HTTP_201_CREATED if summary["created"] else status.HTTP_400_BAD_REQUEST)
+
 @api_view(['GET', 'PUT', 'DELETE'])
 def getUser(request, pk):
     if request.method == 'GET':
@@ -47,17 +98,35 @@ def getCurrencyAccountView(request, pk):
     elif request.method == 'DELETE':
         return deleteCurrencyAccount(request, pk)
 
+@api_view(['GET'])
+def getUserPortfolio(request, pk):
+    valuation = get_portfolio(pk)
+    if valuation is None:
+        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = PortfolioValuationSerializer(valuation)
+    return Response(serializer.data, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 def getUserCurrencyAccountsView(request, user_id):
     return getUserCurrencyAccounts(request, user_id)
 
 
+@api_view(['GET'])
+def getRatesView(request):
+    return getRates(request)
+
+
 @api_view(['GET', 'POST'])
+@idempotent(prepare=prefetch_rate_table)
 def convertCurrency(request, user_id):
     if request.method == 'GET':
         transactions = Transaction.objects.filter(user_id=user_id)
-        serializer = TransactionSerializer(transactions, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        for param in ('from_currency', 'to_currency'):
+            if request.GET.get(param):
+                transactions = transactions.filter(**{param: request.GET[param]})
+
+        return list_response(request, transactions, ('-created_at', '-transaction_id'), TransactionRowSerializer, date_field='created_at')
 
     if request.method == 'POST':
         try:
@@ -72,27 +141,67 @@ def convertCurrency(request, user_id):
         if not all([from_currency, to_currency, amount]):
             return Response({"error": "Missing required fields"}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            amount = float(amount)
-        except ValueError:
-            return Response({"error": "Invalid amount"}, status=status.HTTP_400_BAD_REQUEST)
-
         return convert_currency(user, from_currency, to_currency, amount)
 
 
+@csrf_exempt
+@require_POST
+@idempotent(prepare=aprefetch_rate_table)
+async def convertCurrencyAsync(request, user_id):
+    # DRF views are sync only, so this ASGI endpoint parses and renders JSON itself.
+    try:
+        data = json.loads(request.body) if request.content_type == 'application/json' else request.POST
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        user = await User.objects.aget(pk=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    from_currency = data.get('from_currency')
+    to_currency = data.get('to_currency')
+    amount = data.get('amount')
+
+    if not all([from_currency, to_currency, amount]):
+        return JsonResponse({"error": "Missing required fields"}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = await aconvert_currency(user, from_currency, to_currency, amount)
+    return JsonResponse(response.data, status=response.status_code)
+
+
+@api_view(['POST'])
+@idempotent(prepare=prefetch_rate_table)
+def convertCurrencyBatch(request, user_id):
+    try:
+        user = User.objects.get(pk=user_id)
+    except User.DoesNotExist:
+        return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    conversions = request.data.get('conversions')
+    if not isinstance(conversions, list) or not conversions:
+        return Response({"error": "conversions must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(conversions) > settings.MAX_BATCH_CONVERSIONS:
+        return Response({"error": f"A batch may contain at most {settings.MAX_BATCH_CONVERSIONS} conversions"}, status=status.HTTP_400_BAD_REQUEST)
+    if not all(isinstance(item, dict) for item in conversions):
+        return Response({"error": "Each conversion must be an object"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return convert_currency_batch(user, conversions)
+
+
 @api_view(['GET', 'POST'])
+@idempotent
 def depositToAccount(request, user_id):
     if request.method == 'GET':
         currency_code = request.GET.get('currency_code')
 
-        deposits = DepositHistory.objects.filter(user_id=user_id)
         if currency_code:
-            deposits = deposits.filter(user_currency_account__currency_code=currency_code)
-
-        deposits = deposits.order_by('-created_at')
+            account = UserCurrencyAccount.objects.filter(user_id=user_id, currency_code=currency_code).values('account_id')
+            deposits = DepositHistory.objects.filter(user_currency_account=Subquery(account))
+        else:
+            deposits = DepositHistory.objects.filter(user_id=user_id)
 
-        serializer = DepositHistorySerializer(deposits, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return list_response(request, deposits, ('-created_at', '-deposit_id'), DepositHistoryRowSerializer, date_field='created_at')
 
     if request.method == 'POST':
         try:
@@ -116,19 +225,96 @@ def depositToAccount(request, user_id):
         
 
 
+@api_view(['POST'])
+def depositBulk(request):
+    upload = request.FILES.get('file')
+    if upload is not None:
+        file_format = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in ('csv', 'jsonl'):
+            return Response({"error": "format must be csv or jsonl"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = read_rows(io.TextIOWrapper(upload.file, encoding='utf-8'), file_format)
+    else:
+        deposits = request.data.get('deposits')
+        if not isinstance(deposits, list) or not deposits:
+            return Response({"error": "deposits must be a non-empty list or a csv/jsonl file"}, status=status.HTTP_400_BAD_REQUEST)
+        rows = enumerate(deposits)
+
+    rows = capped(rows, settings.MAX_BULK_DEPOSITS)
+    if rows is None:
+        return Response(
+            {"error": f"At most {settings.MAX_BULK_DEPOSITS} deposits per request; use the load_deposits command for larger loads"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    errors = []
+    summary = apply_deposits(
+        rows,
+        chunk_size=settings.BULK_DEPOSIT_CHUNK_SIZE,
+        on_error=lambda ref, message: errors.append({"row": ref, "error": message}),
+    )
+    summary["errors"] = errors
+    return Response(summary, status=status.HTTP_201_CREATED if summary["applied"] else status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(['GET'])
 def getAccountHistory(request, user_id):
-    histories = AccountHistory.objects.filter(user_id=user_id).order_by('-created_at')
-    serializer = AccountHistorySerializer(histories, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    histories = AccountHistory.objects.filter(user_id=user_id)
+    for param in ('currency', 'action'):
+        if request.GET.get(param):
+            histories = histories.filter(**{param: request.GET[param]})
+
+    return list_response(request, histories, ('-created_at', '-history_id'), AccountHistoryRowSerializer, date_field='created_at')
+
+
+@api_view(['GET'])
+def getDailyHistory(request, user_id):
+    rollups = DailyHistoryRollup.objects.filter(user_id=user_id)
+    if request.GET.get('currency'):
+        rollups = rollups.filter(currency=request.GET['currency'])
+
+    return list_response(request, rollups, ('day', 'rollup_id'), DailyHistoryRollupRowSerializer, date_field='day')
+
+
+@api_view(['GET'])
+def getHistorySummary(request, user_id):
+    try:
+        rollups = filter_date_range(request.GET, DailyHistoryRollup.objects.filter(user_id=user_id), 'day')
+    except InvalidQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(history_summary(rollups), status=status.HTTP_200_OK)
 
 
 
+@api_view(['GET'])
+def exportHistory(request, kind):
+    if kind not in EXPORTS:
+        return Response({"error": f"Unknown export. Choose one of: {', '.join(EXPORTS)}"}, status=status.HTTP_404_NOT_FOUND)
+
+    export_format = request.GET.get('export_format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        return Response({"error": f"export_format must be one of: {', '.join(CONTENT_TYPES)}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    params = request.GET.dict()
+    try:
+        rows = export_rows(kind, params)
+    except InvalidQuery as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(stream_export(kind, rows, export_format), content_type=CONTENT_TYPES[export_format])
+    scope = f"user-{params['user_id']}" if params.get('user_id') else 'all'
+    response['Content-Disposition'] = f'attachment; filename="{kind}-{scope}.{export_format}"'
+    return response
+
+
 @api_view(['POST'])
 def register_user(request):
     data = request.data.copy()
-    data['password'] = make_password(data.get('password'))
-    
+    try:
+        data['password'] = hash_password(data.get('password'))
+    except HashingBusy as e:
+        return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+
     serializer = UserSerializer(data=data)
     if serializer.is_valid():
         serializer.save()
@@ -148,7 +334,14 @@ def login_user(request):
 
     try:
         user = User.objects.get(username=username)
-        if check_password(password, user.password):
+        try:
+            valid, upgraded_password = verify_password(password, user.password)
+        except HashingBusy as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "1"})
+        if valid:
+            if upgraded_password:
+                user.password = upgraded_password
+                user.save(update_fields=['password'])
             login(request, user)
             user_data = {
                 "user_id": user.user_id,
@@ -168,4 +361,8 @@ def login_user(request):
 @api_view(['POST'])
 def logout_user(request):
     logout(request)
-    return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
+
+@require_GET
+def metricsView(request):
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,136 @@
+"""
+Generate users with funded currency accounts and history for the load benchmarks.
+
+    python -m benchmarks.data --users 1000 --history 50
+
+Run standalone it fills a throwaway test database and reports the row counts
+and time taken; benchmarks.load calls generate() directly.
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarks.common import report, setup, test_database
+
+
+PASSWORD = 'Bench@1234'
+CURRENCIES = ('PLN', 'USD', 'EUR', 'GBP', 'CHF')
+HISTORY_DAYS = 30
+
+
+def generate(users, history=20, accounts=3, seed=0, chunk_size=1000):
+    """
+    Create ``users`` users sharing one password hash (PASSWORD), each with
+    ``accounts`` funded currency accounts, PLN first, and ``history`` rows of
+    account history, transactions and deposits spread over the last
+    HISTORY_DAYS days. Opening balances are posted to the ledger and the daily
+    rollups rebuilt, as the write paths would have. Returns the user ids.
+    """
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction as db_transaction
+
+    from api import ledger
+    from api.models import AccountHistory, DepositHistory, Transaction, User, UserCurrencyAccount
+    from api.rollups import rebuild_rollups
+
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    currencies = CURRENCIES[:max(1, min(accounts, len(CURRENCIES)))]
+    first = User.objects.count()
+
+    def amount(low, high):
+        return Decimal(rng.randrange(low * 100, high * 100)) / 100
+
+    user_ids = []
+    for offset in range(0, users, chunk_size):
+        with db_transaction.atomic():
+            created = User.objects.bulk_create(
+                User(
+                    username=f'bench{n}', password=password, first_name='Bench', last_name=f'User{n}',
+                    phone_number=f'+48{500000000 + n}', email=f'bench{n}@example.com',
+                )
+                for n in range(first + offset, first + min(offset + chunk_size, users))
+            )
+            funded = UserCurrencyAccount.objects.bulk_create(UserCurrencyAccount.assign_account_numbers([
+                UserCurrencyAccount(user=user, currency_code=currency, balance=amount(1000, 100000))
+                for user in created
+                for currency in currencies
+            ]))
+            ledger.post(
+                ('opening', ledger.deposit_legs(account.pk, account.currency_code, account.balance))
+                for account in funded
+            )
+
+            by_user = {}
+            for account in funded:
+                by_user.setdefault(account.user_id, []).append(account)
+            histories, transactions, deposits = [], [], []
+            for user in created:
+                for _ in range(history):
+                    account = rng.choice(by_user[user.pk])
+                    histories.append(AccountHistory(
+                        user=user, currency=account.currency_code, amount=amount(1, 1000),
+                        action=rng.choice(('income', 'expense')),
+                    ))
+                    transactions.append(Transaction(
+                        user=user, from_currency='PLN', to_currency=rng.choice(currencies), amount=amount(1, 1000),
+                    ))
+                    deposits.append(DepositHistory(user=user, user_currency_account=account, amount=amount(1, 1000)))
+            AccountHistory.objects.bulk_create(histories, batch_size=chunk_size)
+            Transaction.objects.bulk_create(transactions, batch_size=chunk_size)
+            DepositHistory.objects.bulk_create(deposits, batch_size=chunk_size)
+
+            ids = [user.pk for user in created]
+            for model in (AccountHistory, Transaction, DepositHistory):
+                spread_over_days(model.objects.filter(user_id__in=ids))
+            rebuild_rollups(ids)
+        user_ids += ids
+    return user_ids
+
+
+def spread_over_days(queryset):
+    """
+    Move rows back by 0 to HISTORY_DAYS - 1 days, by primary key, so history
+    and daily rollups cover a realistic range. created_at is auto_now_add,
+    which bulk_create cannot override.
+    """
+    from django.db.models import F
+    from django.db.models.functions import Mod
+
+    rows = queryset.annotate(days_ago=Mod('pk', HISTORY_DAYS))
+    for days in range(1, HISTORY_DAYS):
+        rows.filter(days_ago=days).update(created_at=F('created_at') - timedelta(days=days))
+
+
+def run(users, history, accounts):
+    from api.models import AccountHistory, DailyHistoryRollup, DepositHistory, LedgerEntry, Transaction
+
+    started = time.perf_counter()
+    generate(users, history, accounts)
+    elapsed = time.perf_counter() - started
+    return {
+        'users': users,
+        'seconds': elapsed,
+        'rows': {
+            model.__name__: model.objects.count()
+            for model in (AccountHistory, Transaction, DepositHistory, DailyHistoryRollup, LedgerEntry)
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=20, help="Rows of each history kind per user.")
+    parser.add_argument('--accounts', type=int, default=3, help="Currency accounts per user, PLN first.")
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        report(run(args.users, args.history, args.accounts))
+
+
+if __name__ == '__main__':
+    main()
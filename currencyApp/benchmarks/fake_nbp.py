@@ -0,0 +1,151 @@
+"""
+Local stand-in for the NBP web API with configurable latency and failures.
+
+    python -m benchmarks.fake_nbp --port 8765 --latency 0.05 --failure-rate 0.1
+
+Then point NBP_API_URL at http://127.0.0.1:8765/api. Serves table C at
+/api/exchangerates/tables/c/ and single rates at /api/exchangerates/rates/c/<code>/.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CURRENCIES = {
+    'USD': 4.0123, 'EUR': 4.2312, 'JPY': 0.026701, 'GBP': 5.1034,
+    'AUD': 2.5702, 'CAD': 2.8511, 'CHF': 4.5401, 'SEK': 0.3678, 'CZK': 0.1685,
+}
+SPREAD = 1.02
+
+
+def rate_table(number=1, effective_date=None):
+    effective_date = (effective_date or date.today()).isoformat()
+    return [{
+        'table': 'C',
+        'no': f'{number}/C/NBP/{effective_date[:4]}',
+        'tradingDate': effective_date,
+        'effectiveDate': effective_date,
+        'rates': [
+            {'currency': code, 'code': code, 'bid': bid, 'ask': round(bid * SPREAD, 6)}
+            for code, bid in CURRENCIES.items()
+        ],
+    }]
+
+
+class FakeNBPServer:
+    """
+    Threaded HTTP server answering like NBP after ``latency`` seconds (plus
+    up to ``jitter``), failing a ``failure_rate`` fraction of requests with
+    503. Use as a context manager or call start()/stop().
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def _decide(self):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        return delay, failed
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                delay, failed = server._decide()
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    return self.respond(503, {'error': 'injected failure'})
+
+                parts = [part for part in self.path.split('?')[0].split('/') if part]
+                if parts[:4] == ['api', 'exchangerates', 'tables', 'c']:
+                    return self.respond(200, rate_table())
+                if parts[:4] == ['api', 'exchangerates', 'rates', 'c'] and len(parts) > 4:
+                    code = parts[4].upper()
+                    if code in CURRENCIES:
+                        table = rate_table()[0]
+                        rate = next(rate for rate in table['rates'] if rate['code'] == code)
+                        return self.respond(200, {
+                            'table': 'C', 'currency': code, 'code': code,
+                            'rates': [{'no': table['no'], 'effectiveDate': table['effectiveDate'],
+                                       'bid': rate['bid'], 'ask': rate['ask']}],
+                        })
+                self.respond(404, {'error': 'Not Found'})
+
+            def respond(self, code, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds, uniformly.")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FakeNBPServer(args.host, args.port, args.latency, args.jitter, args.failure_rate, args.seed)
+    print(f"Serving fake NBP API at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
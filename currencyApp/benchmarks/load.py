@@ -0,0 +1,254 @@
+"""
+Drive scripted workloads through the full middleware stack against a local
+NBP stand-in and report latency percentiles, throughput and queries per endpoint.
+
+    python -m benchmarks.load --users 200 --iterations 100 --output run.json
+    python -m benchmarks.load --workload convert,deposit --nbp-latency 0.05 --baseline run.json
+
+Each endpoint's numbers come from django.test.Client requests, so routing,
+middleware, serialization and the database are included but the network and
+WSGI server are not. With --baseline the report adds the difference of every
+percentile and query mean against an earlier report.
+"""
+import argparse
+import json
+import threading
+import time
+
+from benchmarks.common import report, setup, summarize, test_database
+
+
+def login(client, user_id, username):
+    from benchmarks.data import PASSWORD
+
+    return client.post('/api/login/', {'username': username, 'password': PASSWORD})
+
+
+def accounts(client, user_id, username):
+    return client.get(f'/api/currency-accounts/user/{user_id}/')
+
+
+def rates(client, user_id, username):
+    return client.get('/api/rates/')
+
+
+def convert(client, user_id, username):
+    return client.post(
+        f'/api/currency-accounts/convert/{user_id}/', {'from_currency': 'PLN', 'to_currency': 'USD', 'amount': '1.00'},
+    )
+
+
+def deposit(client, user_id, username):
+    return client.post(
+        f'/api/currency-accounts/deposit/{user_id}/', {'user_currency_account_code': 'PLN', 'amount': '10.00'},
+    )
+
+
+def history(client, user_id, username):
+    return client.get(f'/api/currency-accounts/history/{user_id}/')
+
+
+def daily(client, user_id, username):
+    return client.get(f'/api/currency-accounts/history/{user_id}/daily/')
+
+
+def summary(client, user_id, username):
+    return client.get(f'/api/currency-accounts/history/{user_id}/summary/')
+
+
+WORKLOADS = {
+    'login': login,
+    'accounts': accounts,
+    'rates': rates,
+    'convert': convert,
+    'deposit': deposit,
+    'history': history,
+    'daily': daily,
+    'summary': summary,
+}
+
+
+def parse_workload(value):
+    if value == 'all':
+        return list(WORKLOADS)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"Unknown workload {', '.join(unknown)}; choose from {', '.join(WORKLOADS)} or all.")
+    return names
+
+
+def nbp_settings(url, nbp_only, rate_ttl=None):
+    """
+    RATE_PROVIDERS with the NBP provider pointed at url, optionally without
+    the fallbacks so upstream failures reach the client. A rate_ttl replaces
+    the rate cache's TTL and drops its stale window, so the NBP latency and
+    failures show up in the requests instead of being absorbed by the cache.
+    """
+    from django.conf import settings
+
+    providers = []
+    for path, options in settings.RATE_PROVIDERS:
+        if path.endswith('.NBPRateProvider'):
+            providers.append((path, dict(options, url=url)))
+        elif not nbp_only:
+            providers.append((path, options))
+    overrides = {'NBP_API_URL': url, 'RATE_PROVIDERS': providers}
+    if rate_ttl is not None:
+        overrides.update(NBP_RATE_CACHE_TTL=rate_ttl, NBP_RATE_STALE_TTL=0)
+    return overrides
+
+
+def worker(user_ids, usernames, workload, iterations, samples, lock):
+    from django.db import connection
+    from django.test import Client
+
+    from api.middleware import QueryRecorder
+
+    # Errors, such as SQLite lock timeouts under concurrency, are counted as 500s.
+    client = Client(raise_request_exception=False)
+    for i in range(iterations):
+        user_id = user_ids[i % len(user_ids)]
+        for name in workload:
+            recorder = QueryRecorder(0)
+            started = time.perf_counter()
+            with connection.execute_wrapper(recorder):
+                response = WORKLOADS[name](client, user_id, usernames[user_id])
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.setdefault(name, []).append((elapsed, recorder.count, response.status_code))
+
+
+def threaded_worker(*args):
+    from django.db import connection
+
+    try:
+        worker(*args)
+    finally:
+        connection.close()
+
+
+def endpoint_stats(samples):
+    """
+    Latency summary, statuses and queries of one endpoint. Its throughput is
+    requests per second of time spent serving it, so endpoints in a mixed
+    workload can be compared.
+    """
+    latencies = [elapsed for elapsed, _, _ in samples]
+    queries = [count for _, count, _ in samples]
+    statuses = {}
+    for _, _, status_code in samples:
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+    return {
+        **summarize(latencies),
+        'throughput_rps': len(samples) / sum(latencies),
+        'mean_queries': sum(queries) / len(queries),
+        'max_queries': max(queries),
+        'statuses': statuses,
+    }
+
+
+def compare(results, baseline):
+    """
+    Per endpoint difference (current - baseline) of latency percentiles,
+    throughput and mean queries, for endpoints present in both reports.
+    """
+    keys = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'mean_queries')
+    return {
+        name: {key: stats[key] - baseline['endpoints'][name][key] for key in keys}
+        for name, stats in results['endpoints'].items()
+        if name in baseline.get('endpoints', {})
+    }
+
+
+def run(users, iterations, workload, concurrency=1, history=20, nbp_latency=0.0, nbp_jitter=0.0,
+        nbp_failure_rate=0.0, nbp_only=False, rate_ttl=None, seed=0):
+    from django.test.utils import override_settings
+
+    from api.models import User
+    from api.rates import rate_cache, reset_rate_providers
+    from benchmarks.data import generate
+    from benchmarks.fake_nbp import FakeNBPServer
+
+    user_ids = generate(users, history, seed=seed)
+    usernames = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'username'))
+    shards = [user_ids[i::concurrency] for i in range(concurrency)]
+
+    samples = {}
+    lock = threading.Lock()
+    with FakeNBPServer(latency=nbp_latency, jitter=nbp_jitter, failure_rate=nbp_failure_rate, seed=seed) as server:
+        with override_settings(**nbp_settings(server.url, nbp_only, rate_ttl)):
+            rate_cache.invalidate()
+            try:
+                started = time.perf_counter()
+                if concurrency == 1:
+                    worker(user_ids, usernames, workload, iterations, samples, lock)
+                else:
+                    threads = [
+                        threading.Thread(target=threaded_worker, args=(shard, usernames, workload, iterations, samples, lock))
+                        for shard in shards
+                        if shard
+                    ]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                wall = time.perf_counter() - started
+            finally:
+                rate_cache.invalidate()
+                reset_rate_providers()
+
+    total = sum(len(endpoint) for endpoint in samples.values())
+    return {
+        'users': users,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'workload': workload,
+        'nbp': {
+            'latency': nbp_latency, 'jitter': nbp_jitter, 'failure_rate': nbp_failure_rate, 'nbp_only': nbp_only,
+            'rate_ttl': rate_ttl, 'requests': server.requests, 'failures': server.failures,
+        },
+        'seconds': wall,
+        'requests': total,
+        'throughput_rps': total / wall if wall else 0.0,
+        'endpoints': {name: endpoint_stats(samples[name]) for name in workload if name in samples},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--history', type=int, default=20, help="Rows of each history kind per user.")
+    parser.add_argument('--iterations', type=int, default=50, help="Passes over the workload per worker.")
+    parser.add_argument('--workload', type=parse_workload, default='all',
+                        help=f"Comma separated endpoints out of {', '.join(WORKLOADS)}, or all.")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Worker threads. The SQLite test database locks whole tables, so concurrent writes fail with 500s.")
+    parser.add_argument('--nbp-latency', type=float, default=0.0, help="Seconds the NBP stand-in waits per request.")
+    parser.add_argument('--nbp-jitter', type=float, default=0.0)
+    parser.add_argument('--nbp-failure-rate', type=float, default=0.0, help="Fraction of NBP requests failing with 503.")
+    parser.add_argument('--nbp-only', action='store_true', help="Drop the fallback rate providers.")
+    parser.add_argument('--rate-ttl', type=float, help="Rate cache TTL in seconds, without a stale window; 0 goes upstream every time.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="Earlier report to compare against.")
+    parser.add_argument('--output', help="Write the report here instead of stdout.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    setup()
+    with test_database():
+        results = run(
+            args.users, args.iterations, args.workload, max(1, args.concurrency), args.history,
+            args.nbp_latency, args.nbp_jitter, args.nbp_failure_rate, args.nbp_only, args.rate_ttl, args.seed,
+        )
+    if baseline is not None:
+        results['baseline_delta'] = compare(results, baseline)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
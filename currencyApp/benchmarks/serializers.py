@@ -0,0 +1,75 @@
+"""
+Compare the ModelSerializer and values_list() row serializers used by the
+history endpoints.
+
+    python -m benchmarks.serializers --rows 1000 --repeat 20
+"""
+import argparse
+
+from benchmarks.common import report, setup, summarize, test_database, timeit
+
+
+def populate(rows):
+    from api.models import AccountHistory, DepositHistory, Transaction, User, UserCurrencyAccount
+
+    user = User.objects.create(
+        username='bench', password='x', first_name='Bench', last_name='User',
+        phone_number='+48100000000', email='bench@example.com',
+    )
+    account = UserCurrencyAccount.objects.get(user=user, currency_code='PLN')
+    Transaction.objects.bulk_create(
+        Transaction(user=user, from_currency='PLN', to_currency='USD', amount=i % 1000 + 0.5) for i in range(rows)
+    )
+    AccountHistory.objects.bulk_create(
+        AccountHistory(user=user, currency='USD', amount=i % 1000 + 0.5, action='income') for i in range(rows)
+    )
+    DepositHistory.objects.bulk_create(
+        DepositHistory(user=user, user_currency_account=account, amount=i % 1000 + 0.5) for i in range(rows)
+    )
+
+
+def run(rows, repeat):
+    from rest_framework.renderers import JSONRenderer
+
+    from api import serializers
+    from api.models import AccountHistory, DepositHistory, Transaction
+
+    populate(rows)
+    renderer = JSONRenderer()
+    cases = [
+        ('transactions', Transaction.objects.order_by('-created_at', '-transaction_id'),
+         serializers.TransactionSerializer, serializers.TransactionRowSerializer),
+        ('deposits', DepositHistory.objects.select_related('user_currency_account').order_by('-created_at', '-deposit_id'),
+         serializers.DepositHistorySerializer, serializers.DepositHistoryRowSerializer),
+        ('account_history', AccountHistory.objects.order_by('-created_at', '-history_id'),
+         serializers.AccountHistorySerializer, serializers.AccountHistoryRowSerializer),
+    ]
+
+    results = {'rows': rows, 'cases': {}}
+    for name, queryset, model_serializer, row_serializer in cases:
+        model_samples = timeit(lambda: renderer.render(model_serializer(list(queryset), many=True).data), repeat)
+        row_samples = timeit(
+            lambda: renderer.render(row_serializer(list(queryset.values_list(*row_serializer.columns))).data), repeat
+        )
+        model_stats, row_stats = summarize(model_samples), summarize(row_samples)
+        results['cases'][name] = {
+            'model_serializer': model_stats,
+            'row_serializer': row_stats,
+            'speedup': model_stats['p50_ms'] / row_stats['p50_ms'],
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        report(run(args.rows, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import requests
+from django.core.cache import caches
+from django.test import TestCase, override_settings, tag
+
+from api.models import DailyHistoryRollup, User
+from api.rates import parse_rate_table, supported_currencies
+from benchmarks import load as load_benchmark
+from benchmarks.fake_nbp import FakeNBPServer
+
+
+@tag("benchmark")
+class BenchmarkSuiteTests(TestCase):
+    def test_fake_nbp_serves_rate_tables_and_injects_failures(self):
+        with FakeNBPServer() as server:
+            response = requests.get(f"{server.url}/exchangerates/tables/c/?format=json", timeout=5)
+            self.assertEqual(response.status_code, 200)
+            table = parse_rate_table(response.json())
+            self.assertEqual(set(table.rates), set(supported_currencies()))
+            self.assertEqual(requests.get(f"{server.url}/exchangerates/rates/c/xyz/", timeout=5).status_code, 404)
+
+        with FakeNBPServer(failure_rate=1) as server:
+            self.assertEqual(requests.get(f"{server.url}/exchangerates/tables/c/", timeout=5).status_code, 503)
+            self.assertEqual((server.requests, server.failures), (1, 1))
+
+    @override_settings(PASSWORD_HASH_ITERATIONS=1000)
+    def test_load_run_reports_every_endpoint(self):
+        self.addCleanup(caches["default"].clear)
+        results = load_benchmark.run(users=2, iterations=2, workload=list(load_benchmark.WORKLOADS), history=3)
+
+        self.assertEqual(User.objects.count(), 2)
+        self.assertTrue(DailyHistoryRollup.objects.exists())
+        self.assertEqual(results["requests"], 2 * len(load_benchmark.WORKLOADS))
+        self.assertEqual(results["nbp"]["requests"], 1)
+        for name, stats in results["endpoints"].items():
+            self.assertEqual(stats["runs"], 2, name)
+            self.assertTrue(all(code < "400" for code in stats["statuses"]), (name, stats["statuses"]))
+            self.assertGreaterEqual(stats["p99_ms"], stats["p50_ms"])
+        self.assertGreater(results["endpoints"]["deposit"]["mean_queries"], 0)
+
+        delta = load_benchmark.compare(results, results)
+        self.assertEqual(delta["convert"]["mean_queries"], 0)
@@ -0,0 +1,128 @@
+"""
+Compare the per-record cost of the previous User.clean with the compiled
+validation engine, per instance and in batch mode.
+
+    python -m benchmarks.validation --rows 5000 --repeat 20
+"""
+import argparse
+import random
+import re
+
+from benchmarks.common import report, setup, summarize, timeit
+
+
+def legacy_clean(user):
+    """User.clean before api.validation, kept as the baseline."""
+    from django.core.exceptions import ValidationError
+
+    if not user.username or user.username.strip() == "":
+        raise ValidationError("Username is required.")
+    if not re.match(r'^[a-zA-Z0-9_]+$', user.username):
+        raise ValidationError("Username cannot contain special characters.")
+
+    name_pattern = r'^[A-Z][a-z]+(?: [A-Z][a-z]+)*$'
+    if not user.first_name or user.first_name.strip() == "":
+        raise ValidationError("First name is required.")
+    if not re.match(name_pattern, user.first_name):
+        raise ValidationError("First name must follow the format: Eltun.")
+
+    if not user.last_name or user.last_name.strip() == "":
+        raise ValidationError("Last name is required.")
+    if not re.match(name_pattern, user.last_name):
+        raise ValidationError("Last name must follow the format: Gasimov.")
+
+    if not user.phone_number or user.phone_number.strip() == "":
+        raise ValidationError("Phone number is required.")
+    if not re.match(r'^\+48\d{9}$', user.phone_number):
+        raise ValidationError("Phone number must be in the format +48XXXXXXXXX (9 digits after +48).")
+
+    if not user.email or user.email.strip() == "":
+        raise ValidationError("Email is required.")
+    if not re.match(r'^[^@]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$', user.email):
+        raise ValidationError("Email must be valid (e.g., gasimoweltun@gmail.com).")
+
+    if not user.password or user.password.strip() == "":
+        raise ValidationError("Password is required.")
+    if not (8 <= len(user.password) <= 16):
+        raise ValidationError("Password must be between 8 and 16 characters.")
+    if not re.search(r'[A-Z]', user.password):
+        raise ValidationError("Password must contain at least 1 uppercase letter.")
+    if not re.search(r'\d', user.password):
+        raise ValidationError("Password must contain at least 1 number.")
+    if not re.search(r'[@$!%*?&]', user.password):
+        raise ValidationError("Password must contain at least 1 special character (@, $, !, %, *, ?, &).")
+
+    if user.username and user.password:
+        if any(word in user.password.lower() for word in user.username.lower().split('_')):
+            raise ValidationError("Username and password must not be similar.")
+    if user.email and user.password:
+        if user.email.split('@')[0] in user.password:
+            raise ValidationError("Email and password must not be similar.")
+
+
+def candidates(rows, invalid_ratio):
+    generator = random.Random(0)
+    result = []
+    for i in range(rows):
+        row = {
+            'username': f'user_{i}',
+            'password': f'Secret@{i % 1000:03d}x',
+            'first_name': 'Anna',
+            'last_name': 'Nowak',
+            'phone_number': f'+48{500000000 + i}',
+            'email': f'anna{i}@example.com',
+        }
+        if generator.random() < invalid_ratio:
+            row[generator.choice(['first_name', 'phone_number', 'email', 'password'])] = 'bad value'
+        result.append(row)
+    return result
+
+
+def run(rows, repeat, invalid_ratio):
+    from django.core.exceptions import ValidationError
+
+    from api.models import User
+    from api.validation import validate_user, validate_users
+
+    data = candidates(rows, invalid_ratio)
+    users = [User(**row) for row in data]
+
+    def each(check):
+        def loop():
+            for user in users:
+                try:
+                    check(user)
+                except ValidationError:
+                    pass
+        return loop
+
+    cases = {
+        'legacy_clean': each(legacy_clean),
+        'clean': each(User.clean),
+        'validate_user': lambda: [validate_user(row) for row in data],
+        'validate_users': lambda: validate_users(data),
+    }
+    results = {'rows': rows, 'invalid_ratio': invalid_ratio, 'cases': {}}
+    for name, func in cases.items():
+        stats = summarize(timeit(func, repeat))
+        stats['per_record_us'] = stats['p50_ms'] * 1000 / rows
+        results['cases'][name] = stats
+    baseline = results['cases']['legacy_clean']['p50_ms']
+    for stats in results['cases'].values():
+        stats['speedup'] = baseline / stats['p50_ms']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--invalid-ratio', type=float, default=0.1)
+    args = parser.parse_args()
+
+    setup()
+    report(run(args.rows, args.repeat, args.invalid_ratio))
+
+
+if __name__ == '__main__':
+    main()
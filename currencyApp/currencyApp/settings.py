@@ -23,6 +23,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -114,3 +115,58 @@ REST_FRAMEWORK = {
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+NBP_API_URL = 'https://api.nbp.pl/api'
+NBP_TIMEOUT = 5
+NBP_MAX_CONNECTIONS = 20
+NBP_MAX_KEEPALIVE_CONNECTIONS = 10
+NBP_KEEPALIVE_EXPIRY = 30
+NBP_PUBLICATION_TIME = (8, 15)
+NBP_RATE_CACHE_TTL = 60 * 60
+NBP_RATE_STALE_TTL = 24 * 60 * 60
+RATE_PROVIDERS = [
+    ('api.providers.NBPRateProvider', {'retries': 1, 'backoff': 0.2, 'failure_threshold': 3, 'reset_timeout': 60}),
+    ('api.providers.LastKnownGoodRateProvider', {}),
+    ('api.providers.FileRateProvider', {'path': BASE_DIR / 'rates_fallback.json'}),
+]
+RATE_FALLBACK_TTL = 60
+EXCHANGE_RATE_MAX_AGE_DAYS = 4
+MAX_BATCH_CONVERSIONS = 1000
+BULK_DEPOSIT_CHUNK_SIZE = 1000
+MAX_BULK_DEPOSITS = 10000
+BULK_USER_CHUNK_SIZE = 1000
+# Every row is hashed in the request thread, so API loads stay small.
+MAX_BULK_USERS = 100
+LIST_PAGE_SIZE = 100
+LIST_MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+ACCOUNT_NUMBER_BLOCK_SIZE = 100
+
+PASSWORD_HASHERS = [
+    'api.hashing.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = 870000
+PASSWORD_HASH_CONCURRENCY = 4
+PASSWORD_HASH_TIMEOUT = 2
+
+METRICS_SLOW_REQUEST_MS = 500
+METRICS_SLOW_REQUEST_QUERY_LIMIT = 50
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000, 'CULL_FREQUENCY': 4},
+    },
+}
+ACCOUNT_LIST_CACHE = 'default'
+ACCOUNT_LIST_CACHE_TTL = 10 * 60
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+IDEMPOTENCY_WAIT = 5
+
+LEDGER_CHECKPOINT_LAG = 60
@@ -40,38 +40,15 @@ const ExchangeScreen = ({ route, navigation }) => {
           .filter((currency) => currency.currency_code !== "PLN")
           .map((currency) => currency.currency_code.toUpperCase());
 
-        const ratePromises = currencyCodes.map((currency) =>
-          fetch(
-            `https://api.nbp.pl/api/exchangerates/rates/c/${currency.toLowerCase()}/?format=json`
-          )
-        );
-
-        const responses = await Promise.all(ratePromises);
-
-        const rateData = await Promise.all(
-          responses.map(async (response) => {
-            const text = await response.text();
-            if (response.status === 404 || !text.includes("rates")) {
-              console.error(`No data for currency: ${response.url}`);
-              return { error: `No data for currency: ${response.url}` };
-            }
-
-            try {
-              return JSON.parse(text);
-            } catch (e) {
-              console.error("Error parsing exchange rate response:", e, text);
-              return { error: "Invalid JSON response" };
-            }
-          })
-        );
+        const response = await axios.get(`${baseURL}/api/rates/`);
 
         const rates = {};
-        rateData.forEach((data, index) => {
-          if (data.error) {
-            rates[currencyCodes[index]] = { error: data.error };
+        currencyCodes.forEach((currency) => {
+          const rate = response.data.rates[currency];
+          if (!rate) {
+            console.error(`No data for currency: ${currency}`);
+            rates[currency] = { error: `No data for currency: ${currency}` };
           } else {
-            const currency = currencyCodes[index];
-            const rate = data.rates[0] || {};
             rates[currency] = {
               bid: rate.bid || "N/A",
               ask: rate.ask || "N/A",